@@ -0,0 +1,1225 @@
+"""
+Бенчмарки производительности работы с базой данных
+
+Запуск: python benchmark.py <сценарий> [<сценарий> ...]
+Без аргументов выводит список доступных сценариев.
+Каждый сценарий работает со своей временной базой данных.
+"""
+import asyncio
+import gc
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta
+
+import aiosqlite
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+import config
+from database import QUEUE_COLUMNS, Database
+from models import Book
+from outbox import render as render_notification
+from queue_index import OrderStatisticList
+
+SCENARIOS = {}
+
+
+def scenario(name: str):
+    """Зарегистрировать сценарий бенчмарка"""
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+    return decorator
+
+
+async def create_database(db_path: str) -> Database:
+    """Создать базу данных со схемой бота"""
+    db = Database(db_path)
+    await db.connect()
+    return db
+
+
+def seed(db_path: str, users: int = 1000, books_per_type: int = 500):
+    """Заполнить базу пользователями и очередями книг обоих типов"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+        ((user_id, f"user{user_id}") for user_id in range(1, users + 1))
+    )
+    for book_type in ('paid', 'free'):
+        conn.executemany(
+            """INSERT INTO books (user_id, title, link, price, book_type, queue_position, status)
+               VALUES (?, ?, ?, ?, ?, ?, ?)""",
+            ((position % users + 1, f"Книга {book_type} {position}", f"https://example.com/{position}",
+              99 if book_type == 'paid' else 0, book_type, position,
+              'in_recommendations' if position <= config.MAX_BOOKS_IN_RECOMMENDATIONS else 'in_queue')
+             for position in range(1, books_per_type + 1))
+        )
+    conn.commit()
+    conn.close()
+
+
+def report(title: str, rows):
+    """Вывести таблицу результатов"""
+    print(f"\n{title}")
+    print("─" * 70)
+    for name, value in rows:
+        print(f"  {name:<45} {value}")
+
+
+# ===== Пул соединений =====
+
+class LegacyDatabase:
+    """Прежняя схема работы: новое соединение aiosqlite на каждый запрос"""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.timeout = 30.0
+
+    async def get_recommendations(self, book_type: str):
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                """SELECT b.*, u.username
+                   FROM books b
+                   LEFT JOIN users u ON b.user_id = u.telegram_id
+                   WHERE b.book_type = ? AND b.status = 'in_recommendations'
+                   ORDER BY b.queue_position ASC
+                   LIMIT ?""",
+                (book_type, config.MAX_BOOKS_IN_RECOMMENDATIONS)
+            ) as cursor:
+                # Те же записи, что у Database, через прежнее копирование в словарь
+                return [Book(**dict(row)) for row in await cursor.fetchall()]
+
+    async def get_user_action_for_book(self, user_id: int, book_id: int):
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM user_actions WHERE user_id = ? AND book_id = ?",
+                (user_id, book_id)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def add_action(self, book_id: int, user_id: int, action_type: str = 'purchase',
+                         screenshot_file_id: str = None) -> int:
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            cursor = await db.execute(
+                """INSERT INTO user_actions (book_id, user_id, action_type, screenshot_file_id)
+                   VALUES (?, ?, ?, ?)""",
+                (book_id, user_id, action_type, screenshot_file_id)
+            )
+            await db.commit()
+            return cursor.lastrowid
+
+    async def get_action_by_id(self, action_id: int):
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                """SELECT ua.*, b.title, b.user_id as book_owner_id
+                   FROM user_actions ua
+                   JOIN books b ON ua.book_id = b.book_id
+                   WHERE ua.action_id = ?""",
+                (action_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def confirm_action(self, action_id: int, status: str = 'confirmed'):
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            await db.execute(
+                "UPDATE user_actions SET status = ?, confirmed_at = CURRENT_TIMESTAMP WHERE action_id = ?",
+                (status, action_id)
+            )
+            async with db.execute(
+                "SELECT book_id, user_id FROM user_actions WHERE action_id = ?", (action_id,)
+            ) as cursor:
+                book_id, user_id = await cursor.fetchone()
+            await db.execute(
+                "UPDATE books SET confirmed_actions = confirmed_actions + 1 WHERE book_id = ?", (book_id,)
+            )
+            await db.execute(
+                "UPDATE users SET confirmed_actions = confirmed_actions + 1 WHERE telegram_id = ?", (user_id,)
+            )
+            await db.execute(
+                "UPDATE books SET actions_limit = actions_limit + 1 WHERE user_id = ? AND status != 'completed'",
+                (user_id,)
+            )
+            await db.commit()
+        # Прежде завершение проверялось отдельным запросом после подтверждения
+        await self.check_book_completion(book_id)
+
+    async def check_book_completion(self, book_id: int) -> bool:
+        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+            async with db.execute(
+                "SELECT confirmed_actions FROM books WHERE book_id = ?", (book_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return bool(row and row[0] >= config.ACTIONS_REQUIRED)
+
+
+async def drive_feed_and_confirmations(db, taps: int, confirmations: int, book_ids):
+    """Нагрузка: просмотры ленты рекомендаций и подтверждения действий"""
+
+    async def feed_tap(viewer_id: int):
+        book_type = 'paid' if viewer_id % 2 else 'free'
+        books = await db.get_recommendations(book_type)
+        for book in books:
+            await db.get_user_action_for_book(viewer_id, book.book_id)
+
+    async def confirmation(index: int):
+        book_id = book_ids[index % len(book_ids)]
+        action_id = await db.add_action(book_id, index + 1, 'purchase', 'file_id')
+        await db.get_action_by_id(action_id)
+        # Завершение книги проверяется внутри confirm_action
+        await db.confirm_action(action_id, 'confirmed')
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(feed_tap(viewer_id) for viewer_id in range(1, taps + 1)),
+        *(confirmation(index) for index in range(confirmations))
+    )
+    return time.perf_counter() - started
+
+
+@scenario('pool')
+async def bench_pool(tmp_dir: str):
+    """Пул соединений против нового соединения на каждый запрос"""
+    taps, confirmations = 300, 100
+    template = os.path.join(tmp_dir, 'template.db')
+    db = await create_database(template)
+    await db.close()
+    seed(template)
+
+    conn = sqlite3.connect(template)
+    book_ids = [row[0] for row in conn.execute(
+        "SELECT book_id FROM books WHERE status = 'in_queue' ORDER BY book_id LIMIT ?", (confirmations,)
+    )]
+    conn.close()
+
+    legacy_path = os.path.join(tmp_dir, 'legacy.db')
+    pooled_path = os.path.join(tmp_dir, 'pooled.db')
+    shutil.copy(template, legacy_path)
+    shutil.copy(template, pooled_path)
+
+    legacy = LegacyDatabase(legacy_path)
+    legacy_time = await drive_feed_and_confirmations(legacy, taps, confirmations, book_ids)
+
+    pooled = Database(pooled_path)
+    await pooled.connect()
+    pooled_time = await drive_feed_and_confirmations(pooled, taps, confirmations, book_ids)
+    metrics = pooled.get_pool_metrics()
+    await pooled.close()
+
+    operations = taps * (1 + config.MAX_BOOKS_IN_RECOMMENDATIONS) + confirmations * 4
+    report(f"Пул соединений: {taps} просмотров ленты + {confirmations} подтверждений ({operations} запросов)", [
+        ("До: соединение на запрос, с", f"{legacy_time:.3f}"),
+        ("После: общий пул, с", f"{pooled_time:.3f}"),
+        ("Ускорение", f"x{legacy_time / pooled_time:.1f}"),
+        ("Выдачи читателей / писателя", f"{metrics['reader']['checkouts']} / {metrics['writer']['checkouts']}"),
+        ("Среднее ожидание читателя, мс", metrics['reader']['wait_avg_ms']),
+        ("Среднее ожидание писателя, мс", metrics['writer']['wait_avg_ms']),
+        ("Максимальное ожидание писателя, мс", metrics['writer']['wait_max_ms']),
+    ])
+
+
+# ===== Автоподтверждение =====
+
+def seed_overdue_actions(db_path: str, count: int, users: int = 1000):
+    """Добавить просроченные ожидающие действия (уникальные пары книга-пользователь)"""
+    conn = sqlite3.connect(db_path)
+    book_ids = [row[0] for row in conn.execute("SELECT book_id FROM books ORDER BY book_id")]
+    overdue = (datetime.now() - timedelta(hours=config.AUTO_CONFIRM_HOURS + 1)).strftime('%Y-%m-%d %H:%M:%S')
+    conn.executemany(
+        """INSERT INTO user_actions (book_id, user_id, action_type, status, created_at)
+           VALUES (?, ?, 'purchase', 'pending', ?)""",
+        ((book_ids[index % len(book_ids)], index // len(book_ids) + 1, overdue) for index in range(count))
+    )
+    conn.commit()
+    conn.close()
+
+
+async def legacy_auto_confirm(db: Database):
+    """Прежний алгоритм: отдельное подтверждение и commit на каждое действие"""
+    threshold = datetime.now() - timedelta(hours=config.AUTO_CONFIRM_HOURS)
+    async with db.pool.reader() as conn:
+        async with conn.execute(
+            "SELECT action_id FROM user_actions WHERE status = 'pending' AND created_at < ?",
+            (threshold,)
+        ) as cursor:
+            action_ids = [row[0] for row in await cursor.fetchall()]
+    for action_id in action_ids:
+        await db.confirm_action(action_id, 'auto_confirmed')
+    return action_ids
+
+
+@scenario('auto_confirm')
+async def bench_auto_confirm(tmp_dir: str):
+    """Автоподтверждение 10 000 просроченных действий: по одному против одной транзакции"""
+    count = 10_000
+    template = os.path.join(tmp_dir, 'template.db')
+    db = await create_database(template)
+    await db.close()
+    seed(template)
+    seed_overdue_actions(template, count)
+
+    results = {}
+    totals = {}
+    for name, run in (('legacy', legacy_auto_confirm), ('bulk', Database.auto_confirm_old_actions)):
+        path = os.path.join(tmp_dir, f'{name}.db')
+        shutil.copy(template, path)
+        db = Database(path)
+        await db.connect()
+        started = time.perf_counter()
+        confirmed = await run(db)
+        results[name] = (time.perf_counter() - started, len(confirmed))
+        await db.close()
+
+        conn = sqlite3.connect(path)
+        totals[name] = conn.execute(
+            "SELECT (SELECT SUM(confirmed_actions) FROM books), (SELECT SUM(confirmed_actions) FROM users), "
+            "(SELECT SUM(actions_limit) FROM books)"
+        ).fetchone()
+        conn.close()
+
+    legacy_time, legacy_count = results['legacy']
+    bulk_time, bulk_count = results['bulk']
+    report(f"Автоподтверждение {count} просроченных действий", [
+        ("До: подтверждение по одному, с", f"{legacy_time:.3f} ({legacy_count} действий)"),
+        ("После: одна транзакция, с", f"{bulk_time:.3f} ({bulk_count} действий)"),
+        ("Ускорение", f"x{legacy_time / bulk_time:.1f}"),
+        ("Счётчики совпадают", "да" if totals['legacy'] == totals['bulk'] else f"нет: {totals}"),
+    ])
+
+
+# ===== Сводки действий =====
+
+@scenario('digest')
+async def bench_digest(tmp_dir: str):
+    """Популярный автор с 30 действиями: по кнопке на действие против сводки и «Подтвердить все»"""
+    count = 30
+    results = {}
+    for name in ('instant', 'digest'):
+        db = await create_database(os.path.join(tmp_dir, f'{name}.db'))
+        owner_id = 1
+        for user_id in range(1, count + 2):
+            await db.add_user(user_id, f"user{user_id}")
+        book_id = await db.add_book(owner_id, "Популярная книга", "https://example.com", 0, 'free')
+        if name == 'digest':
+            await db.set_notify_mode(owner_id, 'digest')
+        action_ids = [await db.add_action(book_id, user_id, 'rating', f"photo{user_id}")
+                      for user_id in range(2, count + 2)]
+        if name == 'digest':
+            await db.enqueue_action_digests()
+
+        # Сообщения владельцу
+        rows = await db.claim_outbox(count * 2, lease_seconds=60)
+        messages = sum(len(render_notification(row.kind, row.payload)) for row in rows if row.chat_id == owner_id)
+
+        writer_before = db.get_pool_metrics()['writer']['checkouts']
+        started = time.perf_counter()
+        if name == 'digest':
+            # Один обработчик «Подтвердить все»
+            pending = await db.get_pending_actions(owner_id=owner_id)
+            await db.confirm_actions([action.action_id for action in pending], owner_id=owner_id)
+        else:
+            # Обработчик на каждое нажатие
+            for action_id in action_ids:
+                await db.confirm_action(action_id, 'confirmed', owner_id=owner_id)
+        elapsed = time.perf_counter() - started
+        writes = db.get_pool_metrics()['writer']['checkouts'] - writer_before
+        await db.close()
+        results[name] = (messages, elapsed, writes)
+
+    report(f"Автор с {count} ожидающими действиями", [
+        ("До: сообщений владельцу", results['instant'][0]),
+        ("После: сообщений владельцу (альбомы + список)", results['digest'][0]),
+        ("До: подтверждение по одному, мс", f"{results['instant'][1] * 1000:.1f}"),
+        ("После: «Подтвердить все», мс", f"{results['digest'][1] * 1000:.1f}"),
+        ("Транзакций записи: до / после", f"{results['instant'][2]} / {results['digest'][2]}"),
+        ("Ускорение", f"x{results['instant'][1] / results['digest'][1]:.1f}"),
+    ])
+
+
+# ===== Удаление просроченных книг =====
+
+async def legacy_remove_expired_books(db: Database):
+    """Прежний алгоритм: сдвиг очереди и пересчёт рекомендаций на каждую книгу"""
+    threshold = datetime.now() - timedelta(days=config.BOOK_EXPIRATION_DAYS)
+    async with db.pool.writer() as conn:
+        async with conn.execute(
+            """SELECT book_id, title, user_id FROM books
+               WHERE book_type = 'paid' AND status = 'in_recommendations'
+               AND confirmed_actions < ? AND recommendations_started_at < ?
+               AND recommendations_started_at IS NOT NULL""",
+            (config.ACTIONS_REQUIRED, threshold)
+        ) as cursor:
+            expired_books = await cursor.fetchall()
+        for book_id, title, user_id in expired_books:
+            async with conn.execute(
+                "SELECT book_type, queue_position FROM books WHERE book_id = ?", (book_id,)
+            ) as cursor:
+                book_type, position = await cursor.fetchone()
+            await conn.execute("DELETE FROM user_actions WHERE book_id = ?", (book_id,))
+            await conn.execute("DELETE FROM books WHERE book_id = ?", (book_id,))
+            await conn.execute(
+                "UPDATE books SET queue_position = queue_position - 1 WHERE book_type = ? AND queue_position > ?",
+                (book_type, position)
+            )
+            await conn.execute(
+                """UPDATE books SET status = 'in_queue', recommendations_started_at = NULL
+                   WHERE book_type = ? AND status = 'in_recommendations'""",
+                (book_type,)
+            )
+            async with conn.execute(
+                f"""SELECT book_id FROM books
+                   WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+                   ORDER BY queue_position ASC LIMIT {config.MAX_BOOKS_IN_RECOMMENDATIONS}""",
+                (book_type,)
+            ) as cursor:
+                book_ids = [row[0] for row in await cursor.fetchall()]
+            for top_id in book_ids:
+                await conn.execute(
+                    """UPDATE books SET status = 'in_recommendations',
+                       recommendations_started_at = COALESCE(recommendations_started_at, CURRENT_TIMESTAMP)
+                       WHERE book_id = ?""",
+                    (top_id,)
+                )
+        await conn.commit()
+        return expired_books
+
+
+@scenario('expiry')
+async def bench_expiry(tmp_dir: str):
+    """Удаление просроченных книг из очереди в 50 000 книг: цикл против одного прохода"""
+    queue_size = 50_000
+    default_slots = config.MAX_BOOKS_IN_RECOMMENDATIONS
+    rows = []
+    try:
+        for slots in (default_slots, 50):
+            config.MAX_BOOKS_IN_RECOMMENDATIONS = slots
+            template = os.path.join(tmp_dir, f'template_{slots}.db')
+            db = await create_database(template)
+            await db.close()
+            seed(template, books_per_type=queue_size)
+            expired_at = (datetime.now() - timedelta(days=config.BOOK_EXPIRATION_DAYS + 1)).strftime('%Y-%m-%d %H:%M:%S')
+            conn = sqlite3.connect(template)
+            conn.execute(
+                "UPDATE books SET recommendations_started_at = ? WHERE status = 'in_recommendations'",
+                (expired_at,)
+            )
+            conn.commit()
+            conn.close()
+
+            timings = {}
+            for name, run in (('legacy', legacy_remove_expired_books),
+                              ('sweep', Database.auto_remove_expired_books)):
+                path = os.path.join(tmp_dir, f'{name}_{slots}.db')
+                shutil.copy(template, path)
+                db = Database(path)
+                await db.connect()
+                started = time.perf_counter()
+                removed = await run(db)
+                timings[name] = (time.perf_counter() - started, len(removed))
+                await db.close()
+
+            rows += [
+                (f"{slots} в топе: до (цикл по книгам), с", f"{timings['legacy'][0]:.3f} ({timings['legacy'][1]} книг)"),
+                (f"{slots} в топе: после (один проход), с", f"{timings['sweep'][0]:.3f} ({timings['sweep'][1]} книг)"),
+                (f"{slots} в топе: ускорение", f"x{timings['legacy'][0] / timings['sweep'][0]:.1f}"),
+            ]
+    finally:
+        config.MAX_BOOKS_IN_RECOMMENDATIONS = default_slots
+
+    report(f"Удаление просроченных книг, очередь {queue_size} книг", rows)
+
+
+# ===== Пересчёт рекомендаций =====
+
+async def legacy_update_recommendations(conn, book_type: str):
+    """Прежний пересчёт: сброс всего топа и повторное назначение по одной книге"""
+    await conn.execute(
+        """UPDATE books SET status = 'in_queue', recommendations_started_at = NULL
+           WHERE book_type = ? AND status = 'in_recommendations'""",
+        (book_type,)
+    )
+    async with conn.execute(
+        f"""SELECT book_id FROM books
+           WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+           ORDER BY queue_position ASC LIMIT {config.MAX_BOOKS_IN_RECOMMENDATIONS}""",
+        (book_type,)
+    ) as cursor:
+        book_ids = [row[0] for row in await cursor.fetchall()]
+    for book_id in book_ids:
+        await conn.execute(
+            """UPDATE books SET status = 'in_recommendations',
+               recommendations_started_at = COALESCE(recommendations_started_at, CURRENT_TIMESTAMP)
+               WHERE book_id = ?""",
+            (book_id,)
+        )
+
+
+@scenario('promoter')
+async def bench_promoter(tmp_dir: str):
+    """Записи при пересчёте рекомендаций: сброс топа против инкрементального обновления"""
+    additions, completions = 1000, 100
+    template = os.path.join(tmp_dir, 'template.db')
+    db = await create_database(template)
+    await db.close()
+    seed(template, books_per_type=10_000)
+
+    results = {}
+    for name in ('legacy', 'incremental'):
+        path = os.path.join(tmp_dir, f'{name}.db')
+        shutil.copy(template, path)
+        db = Database(path)
+        await db.connect()
+        promoter_writes = 0
+        started = time.perf_counter()
+        async with db.pool.writer() as conn:
+            for index in range(additions):
+                await conn.execute(
+                    """INSERT INTO books (user_id, title, link, book_type, queue_position)
+                       VALUES (1, 'Новая книга', 'https://example.com', 'free', 100000 + ?)""",
+                    (index,)
+                )
+                if index % (additions // completions) == 0:
+                    await conn.execute(
+                        """DELETE FROM books WHERE book_id = (
+                               SELECT book_id FROM books WHERE book_type = 'free'
+                               ORDER BY queue_position LIMIT 1)"""
+                    )
+                before = conn.total_changes
+                if name == 'legacy':
+                    await legacy_update_recommendations(conn, 'free')
+                else:
+                    await db._update_recommendations_status(conn, 'free')
+                promoter_writes += conn.total_changes - before
+                await conn.commit()
+        results[name] = (time.perf_counter() - started, promoter_writes)
+        await db.close()
+
+    report(f"Пересчёт рекомендаций: {additions} добавлений и {completions} завершений", [
+        ("До: записано строк при пересчёте", results['legacy'][1]),
+        ("После: записано строк при пересчёте", results['incremental'][1]),
+        ("До: время, с", f"{results['legacy'][0]:.3f}"),
+        ("После: время, с", f"{results['incremental'][0]:.3f}"),
+    ])
+
+
+# ===== Разреженные ключи очереди =====
+
+class DenseQueue:
+    """Прежняя очередь: MAX(позиция)+1 при добавлении и сдвиг всех следующих при удалении"""
+
+    async def add_book(self, conn, book_type: str):
+        async with conn.execute(
+            """SELECT MAX(queue_position) FROM books
+               WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')""",
+            (book_type,)
+        ) as cursor:
+            last_position = (await cursor.fetchone())[0] or 0
+        await conn.execute(
+            """INSERT INTO books (user_id, title, link, book_type, queue_position)
+               VALUES (1, 'Новая книга', 'https://example.com', ?, ?)""",
+            (book_type, last_position + 1)
+        )
+
+    async def complete_book(self, conn, book_id: int):
+        async with conn.execute(
+            "SELECT book_type, queue_position FROM books WHERE book_id = ?", (book_id,)
+        ) as cursor:
+            book_type, position = await cursor.fetchone()
+        await conn.execute("DELETE FROM books WHERE book_id = ?", (book_id,))
+        await conn.execute(
+            "UPDATE books SET queue_position = queue_position - 1 WHERE book_type = ? AND queue_position > ?",
+            (book_type, position)
+        )
+
+
+@scenario('queue_churn')
+async def bench_queue_churn(tmp_dir: str):
+    """Добавление и завершение книг в очереди из 100 000 книг: плотные позиции против разреженных ключей"""
+    queue_size, cycles = 100_000, 50
+    template = os.path.join(tmp_dir, 'template.db')
+    db = await create_database(template)
+    await db.close()
+    seed(template, books_per_type=queue_size)
+
+    # Плотные позиции 1..N — как до миграции
+    dense_path = os.path.join(tmp_dir, 'dense.db')
+    shutil.copy(template, dense_path)
+    conn = sqlite3.connect(dense_path)
+    conn.execute("CREATE INDEX idx_books_dense_position ON books (book_type, queue_position)")
+    conn.commit()
+    conn.close()
+
+    # Разреженные ключи — как после миграции
+    sparse_path = os.path.join(tmp_dir, 'sparse.db')
+    shutil.copy(template, sparse_path)
+    conn = sqlite3.connect(sparse_path)
+    conn.execute("UPDATE books SET queue_position = queue_position * ?", (config.QUEUE_RANK_GAP,))
+    conn.commit()
+    conn.close()
+
+    async def churn(path: str, dense: bool):
+        db = Database(path)
+        await db.connect()
+        queue = DenseQueue()
+        writes = 0
+        started = time.perf_counter()
+        for _ in range(cycles):
+            async with db.pool.reader() as conn:
+                async with conn.execute(
+                    """SELECT book_id FROM books
+                       WHERE book_type = 'free' AND status IN ('in_queue', 'in_recommendations')
+                       ORDER BY queue_position LIMIT 1"""
+                ) as cursor:
+                    top_id = (await cursor.fetchone())[0]
+            if dense:
+                async with db.pool.writer() as conn:
+                    before = conn.total_changes
+                    await queue.add_book(conn, 'free')
+                    await queue.complete_book(conn, top_id)
+                    await db._update_recommendations_status(conn, 'free')
+                    writes += conn.total_changes - before
+                    await conn.commit()
+            else:
+                async with db.pool.writer() as conn:
+                    before = conn.total_changes
+                await db.add_book(1, 'Новая книга', 'https://example.com', 0, 'free')
+                await db.complete_book(top_id)
+                async with db.pool.writer() as conn:
+                    writes += conn.total_changes - before
+        elapsed = time.perf_counter() - started
+        await db.close()
+        return elapsed, writes
+
+    dense_time, dense_writes = await churn(dense_path, dense=True)
+    sparse_time, sparse_writes = await churn(sparse_path, dense=False)
+
+    report(f"Очередь {queue_size} книг: {cycles} циклов добавление + завершение", [
+        ("До: плотные позиции, с", f"{dense_time:.3f}"),
+        ("После: разреженные ключи, с", f"{sparse_time:.3f}"),
+        ("До: записано строк", dense_writes),
+        ("После: записано строк", sparse_writes),
+        ("Ускорение", f"x{dense_time / sparse_time:.1f}"),
+    ])
+
+
+# ===== Очередь в памяти =====
+
+@scenario('queue_index')
+async def bench_queue_index(tmp_dir: str):
+    """Позиция книги: полная загрузка очереди против индекса в памяти; память на 1 000 000 книг"""
+    # Память и время операций на очереди из миллиона книг
+    size = 1_000_000
+    items = [(position * config.QUEUE_RANK_GAP, position) for position in range(1, size + 1)]
+    tracemalloc.start()
+    started = time.perf_counter()
+    queue = OrderStatisticList(items)
+    build_time = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del items
+
+    probes = random.Random(1).sample(range(1, size + 1), 10_000)
+    started = time.perf_counter()
+    for book_id in probes:
+        queue.rank(book_id * config.QUEUE_RANK_GAP, book_id)
+    rank_time = (time.perf_counter() - started) / len(probes)
+
+    started = time.perf_counter()
+    for book_id in probes:
+        queue.remove(book_id * config.QUEUE_RANK_GAP, book_id)
+        queue.add(book_id * config.QUEUE_RANK_GAP - 1, book_id)
+    move_time = (time.perf_counter() - started) / len(probes)
+
+    report(f"Индекс очереди на {size} книг", [
+        ("Память (tracemalloc), МБ", f"{memory / 2 ** 20:.1f}"),
+        ("Память на книгу, байт", f"{memory / size:.1f}"),
+        ("Построение, с", f"{build_time:.2f}"),
+        ("Позиция книги, мкс", f"{rank_time * 1e6:.2f}"),
+        ("Перемещение книги, мкс", f"{move_time * 1e6:.2f}"),
+    ])
+    del queue
+
+    # Позиция книги в очереди из 100 000 книг
+    queue_size, requests = 100_000, 20
+    db_path = os.path.join(tmp_dir, 'queue_index.db')
+    db = await create_database(db_path)
+    await db.close()
+    seed(db_path, books_per_type=queue_size)
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE books SET queue_position = queue_position * ?", (config.QUEUE_RANK_GAP,))
+    conn.commit()
+    conn.close()
+
+    db = Database(db_path)
+    started = time.perf_counter()
+    await db.connect()
+    load_time = time.perf_counter() - started
+    book_ids = random.Random(2).sample(range(1, 2 * queue_size + 1), requests)
+
+    # До: вся очередь загружается, чтобы посчитать книги впереди
+    started = time.perf_counter()
+    for book_id in book_ids:
+        book = await db.get_book_by_id(book_id)
+        queue_books = await db.get_queue_books(book.book_type)
+        sum(1 for b in queue_books if b.queue_position < book.queue_position)
+    legacy_time = (time.perf_counter() - started) / requests
+
+    # После: позиция из очереди в памяти
+    started = time.perf_counter()
+    for book_id in book_ids:
+        book = await db.get_book_by_id(book_id)
+        book.position - 1
+    index_time = (time.perf_counter() - started) / requests
+
+    mismatches = await db.verify_queue_index()
+    await db.close()
+
+    report(f"Книг впереди при очереди {queue_size} книг каждого типа", [
+        ("Загрузка очередей при запуске, с", f"{load_time:.3f}"),
+        ("До: загрузка очереди, мс/книга", f"{legacy_time * 1000:.2f}"),
+        ("После: очередь в памяти, мс/книга", f"{index_time * 1000:.3f}"),
+        ("Ускорение", f"x{legacy_time / index_time:.0f}"),
+        ("Расхождения с базой", mismatches),
+    ])
+
+
+# ===== Записи строк =====
+
+async def legacy_load_queue_books(db: Database, book_type: str):
+    """Прежняя загрузка очереди: SELECT b.*, строки aiosqlite.Row копируются в словари"""
+    async with db.pool.reader() as conn:
+        async with conn.execute(
+            """SELECT b.*, u.username,
+                      ROW_NUMBER() OVER (ORDER BY b.queue_position) AS position
+               FROM books b
+               LEFT JOIN users u ON b.user_id = u.telegram_id
+               WHERE b.book_type = ? AND b.status IN ('in_queue', 'in_recommendations')
+               ORDER BY b.queue_position ASC""",
+            (book_type,)
+        ) as cursor:
+            cursor.row_factory = aiosqlite.Row
+            return [dict(row) for row in await cursor.fetchall()]
+
+
+async def measure_load(load, repeats: int = 3):
+    """Лучшее время загрузки, память результата и пик (tracemalloc), число живых блоков памяти"""
+    best = float('inf')
+    for _ in range(repeats):
+        started = time.perf_counter()
+        rows = await load()
+        best = min(best, time.perf_counter() - started)
+        del rows
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    rows = await load()
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    allocated = sys.getallocatedblocks() - blocks
+    return rows, best, memory, peak, allocated
+
+
+@scenario('records')
+async def bench_records(tmp_dir: str):
+    """Очередь из 100 000 книг: словари всех столбцов из aiosqlite.Row против записей с нужными столбцами"""
+    queue_size = 100_000
+    db_path = os.path.join(tmp_dir, 'records.db')
+    db = await create_database(db_path)
+    await db.close()
+    seed(db_path, books_per_type=queue_size)
+
+    db = await create_database(db_path)
+    legacy_rows, legacy_time, legacy_memory, legacy_peak, legacy_blocks = await measure_load(
+        lambda: legacy_load_queue_books(db, 'paid'))
+    rows, records_time, records_memory, records_peak, records_blocks = await measure_load(
+        lambda: db._load_queue_books('paid'))
+    columns = QUEUE_COLUMNS + ('username', 'position')
+    same = [[getattr(row, name) for name in columns] for row in rows] == \
+        [[row[name] for name in columns] for row in legacy_rows]
+    del legacy_rows
+
+    # Чтение полей при отрисовке (по ключу у словаря, атрибут у записи)
+    legacy_rows = await legacy_load_queue_books(db, 'paid')
+    started = time.perf_counter()
+    sum(row['confirmed_actions'] for row in legacy_rows)
+    legacy_access = time.perf_counter() - started
+    started = time.perf_counter()
+    sum(row.confirmed_actions for row in rows)
+    records_access = time.perf_counter() - started
+    await db.close()
+
+    report(f"Загрузка очереди из {queue_size} книг: dict(aiosqlite.Row) → записи Book", [
+        ("До: загрузка, мс", f"{legacy_time * 1000:.1f}"),
+        ("После: загрузка, мс", f"{records_time * 1000:.1f}"),
+        ("До: память результата, МБ", f"{legacy_memory / 2 ** 20:.1f}"),
+        ("После: память результата, МБ", f"{records_memory / 2 ** 20:.1f}"),
+        ("До: пик памяти при загрузке, МБ", f"{legacy_peak / 2 ** 20:.1f}"),
+        ("После: пик памяти при загрузке, МБ", f"{records_peak / 2 ** 20:.1f}"),
+        ("До: живых блоков памяти на строку", f"{legacy_blocks / queue_size:.1f}"),
+        ("После: живых блоков памяти на строку", f"{records_blocks / queue_size:.1f}"),
+        ("До: чтение поля у 100 000 строк, мс", f"{legacy_access * 1000:.2f}"),
+        ("После: чтение поля у 100 000 строк, мс", f"{records_access * 1000:.2f}"),
+        ("Экономия памяти", f"x{legacy_memory / records_memory:.1f}"),
+        ("Результаты совпадают", same),
+    ])
+
+
+# ===== Статусы действий в ленте =====
+
+@scenario('feed')
+async def bench_feed(tmp_dir: str):
+    """Лента из 50 рекомендаций: запрос статуса на каждую книгу против одного запроса на ленту"""
+    slots, renders = 50, 200
+    default_slots = config.MAX_BOOKS_IN_RECOMMENDATIONS
+    config.MAX_BOOKS_IN_RECOMMENDATIONS = slots
+    try:
+        db_path = os.path.join(tmp_dir, 'feed.db')
+        db = await create_database(db_path)
+        await db.close()
+        seed(db_path)
+
+        # Зритель уже выполнил действия для половины книг ленты
+        viewer_id = 1
+        conn = sqlite3.connect(db_path)
+        conn.execute(
+            """INSERT INTO user_actions (book_id, user_id, action_type, status)
+               SELECT book_id, ?, 'purchase', 'confirmed' FROM books
+               WHERE book_type = 'paid' AND status = 'in_recommendations' AND book_id % 2 = 0""",
+            (viewer_id,)
+        )
+        conn.commit()
+        conn.close()
+
+        db = Database(db_path)
+        await db.connect()
+
+        async def render(batched: bool):
+            queries = 0
+            started = time.perf_counter()
+            for _ in range(renders):
+                books = await db.get_recommendations('paid')
+                queries += 1
+                if batched:
+                    statuses = await db.get_user_actions_for_books(
+                        viewer_id, [book.book_id for book in books]
+                    )
+                    queries += 1
+                else:
+                    statuses = {}
+                    for book in books:
+                        statuses[book.book_id] = await db.get_user_action_for_book(viewer_id, book.book_id)
+                        queries += 1
+            return (time.perf_counter() - started) / renders, queries // renders, len(books)
+
+        legacy_time, legacy_queries, feed_size = await render(batched=False)
+        batched_time, batched_queries, _ = await render(batched=True)
+        await db.close()
+    finally:
+        config.MAX_BOOKS_IN_RECOMMENDATIONS = default_slots
+
+    report(f"Лента из {feed_size} книг, {renders} показов", [
+        ("До: запросов на показ", legacy_queries),
+        ("После: запросов на показ", batched_queries),
+        ("До: мс на показ", f"{legacy_time * 1000:.2f}"),
+        ("После: мс на показ", f"{batched_time * 1000:.2f}"),
+        ("Ускорение", f"x{legacy_time / batched_time:.1f}"),
+    ])
+
+
+# ===== Кэш рекомендаций =====
+
+@scenario('cache')
+async def bench_cache(tmp_dir: str):
+    """Нажатия кнопок ленты: запрос рекомендаций на каждое нажатие против кэша"""
+    taps, concurrency, confirm_every = 5000, 50, 100
+    db_path = os.path.join(tmp_dir, 'cache.db')
+    db = await create_database(db_path)
+    await db.close()
+    seed(db_path)
+
+    db = Database(db_path)
+    await db.connect()
+    book_ids = [book.book_id for book in await db.get_recommendations('paid')]
+
+    viewers = iter(range(10_000, 100_000))
+
+    async def run(load):
+        async def tap(index: int):
+            # Каждое сотое нажатие сопровождается подтверждением действия
+            if index % confirm_every == 0:
+                action_id = await db.add_action(book_ids[0], next(viewers))
+                await db.confirm_action(action_id, 'confirmed')
+            await load('paid' if index % 2 else 'free')
+
+        started = time.perf_counter()
+        checkouts = db.pool.metrics.checkouts['reader']
+        for start in range(0, taps, concurrency):
+            await asyncio.gather(*(tap(index) for index in range(start, start + concurrency)))
+        reads = db.pool.metrics.checkouts['reader'] - checkouts
+        return time.perf_counter() - started, reads
+
+    async def cached(book_type):
+        return await db.get_recommendations(book_type)
+
+    legacy_time, legacy_reads = await run(db._load_recommendations)
+    cached_time, cached_reads = await run(cached)
+    metrics = db.get_cache_metrics()
+    await db.close()
+
+    report(f"{taps} нажатий ленты, по {concurrency} одновременно, подтверждение каждые {confirm_every}", [
+        ("До: запросов к БД", legacy_reads),
+        ("После: запросов к БД", cached_reads),
+        ("До: время, с", f"{legacy_time:.3f}"),
+        ("После: время, с", f"{cached_time:.3f}"),
+        ("Ускорение", f"x{legacy_time / cached_time:.1f}"),
+        ("Метрики кэша", metrics),
+    ])
+
+
+# ===== Карусель ленты =====
+
+class CountingSession(BaseSession):
+    """Сессия Bot API без сети: считает вызовы методов и возвращает сообщения-заглушки"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[type(method).__name__] += 1
+        if method.__returning__ is bool:
+            return True
+        self._message_id += 1
+        return Message(
+            message_id=self._message_id, date=datetime.now(),
+            chat=Chat(id=getattr(method, 'chat_id', 0) or 0, type='private'), text='ok'
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def text_update(update_id: int, user_id: int, text: str) -> Update:
+    """Сообщение пользователя"""
+    user = User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=user, text=text
+    ))
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> Update:
+    """Нажатие инлайн-кнопки под сообщением бота"""
+    user = User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=user, chat_instance='bench', data=data,
+        message=Message(message_id=update_id, date=datetime.now(),
+                        chat=Chat(id=user_id, type='private'), text='feed')
+    ))
+
+
+@scenario('carousel')
+async def bench_carousel(tmp_dir: str):
+    """Вызовы Bot API на просмотр ленты: сообщение на каждую книгу против карусели"""
+    from handlers import feed, paid_books, free_books
+
+    session = CountingSession()
+    bot = Bot(token="42:BENCHMARK", session=session)
+    dp = Dispatcher()
+    dp.include_routers(feed.router, paid_books.router, free_books.router)
+    viewers = 20
+    update_ids = iter(range(1, 1_000_000))
+
+    async def browse(mode: str, page_turns: int):
+        """Открытие ленты платных книг и перелистывания; вызовов API на одного зрителя"""
+        config.FEED_MODE = mode
+        session.calls.clear()
+        for viewer_id in range(2000, 2000 + viewers):
+            await dp.feed_update(bot, text_update(next(update_ids), viewer_id, "📘 Платные книги"))
+            for page in range(1, page_turns + 1):
+                await dp.feed_update(bot, callback_update(next(update_ids), viewer_id, f"page:paid:{page}"))
+        return sum(session.calls.values()) / viewers, {name: count // viewers for name, count in session.calls.items()}
+
+    default_mode, default_slots = config.FEED_MODE, config.MAX_BOOKS_IN_RECOMMENDATIONS
+    rows = []
+    try:
+        for slots in (5, 50):
+            config.MAX_BOOKS_IN_RECOMMENDATIONS = slots
+            db_path = os.path.join(tmp_dir, f'carousel_{slots}.db')
+            db = await create_database(db_path)
+            await db.close()
+            seed(db_path)
+            db = Database(db_path)
+            await db.connect()
+            # Обработчики получают базу через workflow_data диспетчера
+            dp['db'] = db
+
+            # В режиме сообщений вся лента видна сразу, перелистывать нечего
+            legacy = await browse('messages', 0)
+            opened = await browse('carousel', 0)
+            browsed = await browse('carousel', 3)
+            await db.close()
+            rows += [
+                (f"{slots} книг, до: открытие ленты", f"{legacy[0]:.0f}  {legacy[1]}"),
+                (f"{slots} книг, после: открытие ленты", f"{opened[0]:.0f}  {opened[1]}"),
+                (f"{slots} книг, после: открытие + 3 страницы", f"{browsed[0]:.0f}  {browsed[1]}"),
+                (f"{slots} книг, сокращение при открытии", f"x{legacy[0] / opened[0]:.0f}"),
+            ]
+    finally:
+        config.FEED_MODE, config.MAX_BOOKS_IN_RECOMMENDATIONS = default_mode, default_slots
+
+    report(f"Вызовы Bot API на одного зрителя ({viewers} зрителей)", rows)
+
+
+@scenario('fsm')
+async def bench_fsm(tmp_dir: str):
+    """Состояния FSM: MemoryStorage против SQLite с отложенной записью"""
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.fsm.storage.memory import MemoryStorage
+    from fsm_storage import SQLiteStorage
+
+    users, concurrency = 2000, 100
+
+    async def flow(storage, user_id: int, write_through: bool):
+        """Сценарий добавления книги: три шага с данными и сброс состояния"""
+        key = StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+        for state, field in (('waiting_for_type', 'book_type'), ('waiting_for_title', 'title'),
+                             ('waiting_for_link', 'link')):
+            await storage.get_state(key)
+            await storage.set_state(key, state)
+            await storage.update_data(key, {field: f"{field}{user_id}"})
+            if write_through:
+                await storage.flush()
+        await storage.get_data(key)
+        await storage.set_state(key, None)
+        await storage.set_data(key, {})
+        if write_through:
+            await storage.flush()
+
+    async def run(storage, write_through: bool = False):
+        started = time.perf_counter()
+        for start in range(0, users, concurrency):
+            await asyncio.gather(*(flow(storage, user_id, write_through)
+                                   for user_id in range(start, start + concurrency)))
+        if isinstance(storage, SQLiteStorage):
+            await storage.flush()
+        elapsed = time.perf_counter() - started
+        # get_state + set_state + get_data/set_data в update_data на шаг, плюс завершение
+        operations = users * (3 * 4 + 3)
+        return operations / elapsed, storage.get_metrics()['flushes'] if isinstance(storage, SQLiteStorage) else 0
+
+    memory_rate, _ = await run(MemoryStorage())
+    storage = SQLiteStorage(os.path.join(tmp_dir, 'fsm_sync.db'), flush_interval=None)
+    sync_rate, sync_commits = await run(storage, write_through=True)
+    await storage.close()
+    storage = SQLiteStorage(os.path.join(tmp_dir, 'fsm.db'))
+    cached_rate, cached_commits = await run(storage)
+    await storage.close()
+
+    report(f"{users} сценариев добавления книги, по {concurrency} одновременно", [
+        ("MemoryStorage: операций/с", f"{memory_rate:,.0f}"),
+        ("SQLite, коммит на шаг: операций/с", f"{sync_rate:,.0f}"),
+        ("SQLite, коммит на шаг: коммитов", sync_commits),
+        ("SQLite, кэш и сброс раз в 1 с: операций/с", f"{cached_rate:,.0f}"),
+        ("SQLite, кэш и сброс раз в 1 с: коммитов", cached_commits),
+    ])
+
+
+class PollingSession(CountingSession):
+    """Сессия Bot API для long polling: getUpdates отдаёт заготовленные обновления с задержкой сети"""
+
+    def __init__(self, updates, rtt: float):
+        super().__init__()
+        self.updates = updates
+        self.rtt = rtt
+
+    async def make_request(self, bot, method, timeout=None):
+        from aiogram.methods import GetMe, GetUpdates
+        if isinstance(method, GetMe):
+            return User(id=42, is_bot=True, first_name="bench")
+        if isinstance(method, GetUpdates):
+            self.calls['GetUpdates'] += 1
+            await asyncio.sleep(self.rtt)
+            offset = method.offset or 0
+            batch = [update for update in self.updates if update.update_id >= offset][:method.limit or 100]
+            return batch
+        return await super().make_request(bot, method, timeout)
+
+
+@scenario('webhook')
+async def bench_webhook(tmp_dir: str):
+    """Пропускная способность: long polling против вебхука с пулом воркеров (Bot API подменён)"""
+    from aiogram import Router
+    from aiohttp import ClientSession, TCPConnector
+    from aiohttp.test_utils import TestServer
+    from webhook import WEBHOOK_HANDLER, create_app
+
+    updates_count, rtt, work, connections = 3000, 0.05, 0.005, 40
+    updates = [text_update(update_id, 1000 + update_id % 500, "текст") for update_id in range(1, updates_count + 1)]
+
+    def make_dispatcher(done: asyncio.Event, handled: list):
+        router = Router()
+
+        @router.message()
+        async def handler(message: Message):
+            # Работа обработчика: запросы к БД и ответ пользователю
+            await asyncio.sleep(work)
+            handled.append(message.message_id)
+            if len(handled) == updates_count:
+                done.set()
+
+        dp = Dispatcher()
+        dp.include_router(router)
+        return dp
+
+    # Long polling: пачки по 100 обновлений, одна задержка сети на запрос getUpdates
+    done, handled = asyncio.Event(), []
+    dp = make_dispatcher(done, handled)
+    session = PollingSession(updates, rtt)
+    bot = Bot(token="42:BENCHMARK", session=session)
+    started = time.perf_counter()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await done.wait()
+    polling_time = time.perf_counter() - started
+    await dp.stop_polling()
+    await polling
+    polling_requests = session.calls['GetUpdates']
+
+    # Вебхук: Telegram держит до max_connections одновременных POST-запросов
+    done, handled = asyncio.Event(), []
+    dp = make_dispatcher(done, handled)
+    bot = Bot(token="42:BENCHMARK", session=CountingSession())
+    app = create_app(dp, bot, "secret", workers=config.WEBHOOK_WORKERS)
+    server = TestServer(app)
+    await server.start_server()
+    url = str(server.make_url(config.WEBHOOK_PATH))
+    payloads = [update.model_dump(mode='json', exclude_none=True, by_alias=True) for update in updates]
+    response_times = []
+
+    async with ClientSession(connector=TCPConnector(limit=connections)) as client:
+        slots = asyncio.Semaphore(connections)
+
+        async def deliver(payload):
+            # Telegram повторяет доставку, если сервер ответил 503
+            while True:
+                async with slots:
+                    sent = time.perf_counter()
+                    async with client.post(url, json=payload,
+                                           headers={"X-Telegram-Bot-Api-Secret-Token": "secret"}) as response:
+                        status = response.status
+                    response_times.append(time.perf_counter() - sent)
+                if status == 200:
+                    return
+                await asyncio.sleep(rtt)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(deliver(payload) for payload in payloads))
+        await done.wait()
+        webhook_time = time.perf_counter() - started
+    metrics = app[WEBHOOK_HANDLER].get_metrics()
+    await server.close()
+    response_times.sort()
+
+    report(f"{updates_count} обновлений, обработчик {work * 1000:.0f} мс, задержка сети {rtt * 1000:.0f} мс", [
+        ("Polling: обновлений/с", f"{updates_count / polling_time:,.0f}"),
+        ("Polling: запросов getUpdates", polling_requests),
+        (f"Вебхук ({config.WEBHOOK_WORKERS} воркеров): обновлений/с", f"{updates_count / webhook_time:,.0f}"),
+        ("Вебхук: ответ Telegram, медиана", f"{response_times[len(response_times) // 2] * 1000:.2f} мс"),
+        ("Вебхук: ответ Telegram, p99", f"{response_times[int(len(response_times) * 0.99)] * 1000:.2f} мс"),
+        ("Вебхук: очередь → конец обработки, среднее", f"{metrics['latency_avg_ms']:.1f} мс"),
+        ("Вебхук: отказов 503 (повторная доставка)", metrics['rejected']),
+    ])
+
+
+# ===== Статистика =====
+
+async def legacy_get_statistics(db: Database):
+    """Прежняя статистика: пять запросов COUNT(*) по таблицам"""
+    stats = {}
+    async with db.pool.reader() as conn:
+        for name, sql in (
+            ('total_users', "SELECT COUNT(*) FROM users"),
+            ('total_books', "SELECT COUNT(*) FROM books WHERE status != 'completed'"),
+            ('paid_books', "SELECT COUNT(*) FROM books WHERE book_type = 'paid' AND status != 'completed'"),
+            ('free_books', "SELECT COUNT(*) FROM books WHERE book_type = 'free' AND status != 'completed'"),
+            ('total_actions', "SELECT COUNT(*) FROM user_actions"),
+        ):
+            async with conn.execute(sql) as cursor:
+                stats[name] = (await cursor.fetchone())[0]
+    return stats
+
+
+@scenario('stats')
+async def bench_stats(tmp_dir: str):
+    """/stats: COUNT(*) по таблицам против счётчиков, поддерживаемых триггерами"""
+    calls = 200
+    db_path = os.path.join(tmp_dir, 'stats.db')
+    db = await create_database(db_path)
+    await db.close()
+    started = time.perf_counter()
+    seed(db_path, users=100_000, books_per_type=50_000)
+    seed_overdue_actions(db_path, 300_000, users=100_000)
+    seed_time = time.perf_counter() - started
+
+    db = Database(db_path)
+    await db.connect()
+    timings = {}
+    results = {}
+    for name, run in (('legacy', legacy_get_statistics), ('counters', Database.get_statistics)):
+        started = time.perf_counter()
+        for _ in range(calls):
+            results[name] = await run(db)
+        timings[name] = (time.perf_counter() - started) / calls
+    drift = await db.reconcile_statistics()
+    await db.close()
+
+    keys = ('total_users', 'total_books', 'paid_books', 'free_books', 'total_actions')
+    same = all(results['legacy'][key] == results['counters'][key] for key in keys)
+    report("Статистика: 100 000 пользователей, 100 000 книг, 300 000 действий", [
+        ("Заполнение базы (с триггерами), с", f"{seed_time:.2f}"),
+        ("До: COUNT(*) по таблицам, мс/вызов", f"{timings['legacy'] * 1000:.3f}"),
+        ("После: чтение счётчиков, мс/вызов", f"{timings['counters'] * 1000:.3f}"),
+        ("Ускорение", f"x{timings['legacy'] / timings['counters']:.1f}"),
+        ("Результаты совпадают", "да" if same else f"нет: {results}"),
+        ("Расхождений при сверке", len(drift)),
+    ])
+
+
+async def main(names):
+    if not names:
+        print("Доступные сценарии:")
+        for name, func in SCENARIOS.items():
+            print(f"  {name:<20} {func.__doc__}")
+        return
+
+    for name in names:
+        if name not in SCENARIOS:
+            print(f"Неизвестный сценарий: {name}")
+            continue
+        tmp_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+        try:
+            await SCENARIOS[name](tmp_dir)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
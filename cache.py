@@ -0,0 +1,128 @@
+"""
+Кэш результатов запросов в памяти процесса
+
+Используется для рекомендаций и снимков очереди: они читаются на каждое
+нажатие кнопок ленты, а меняются только при изменении очереди. Записи
+сбрасываются методами Database, изменяющими данные, и по истечении TTL.
+Одновременные запросы к отсутствующей записи ждут одну общую загрузку.
+
+LRUCache — ограниченный словарь для данных, известных без запроса к БД
+(username зарегистрированных пользователей).
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class QueryCache:
+    """Кэш с TTL, явным сбросом и защитой от одновременной перезагрузки"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: Dict[Hashable, Tuple[float, object]] = {}
+        self._pending: Dict[Hashable, asyncio.Task] = {}
+        # Номер поколения: загрузка, начатая до сброса, не сохраняет результат
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable]):
+        """Вернуть значение из кэша или загрузить его одним вызовом loader"""
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+
+        pending = self._pending.get(key)
+        if pending:
+            # Загрузка уже идёт: ждём её результат вместо повторного запроса
+            self.shared += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        # Загрузка выполняется задачей кэша: отмена вызвавшего её запроса
+        # не прерывает загрузку для остальных ожидающих
+        task = asyncio.ensure_future(self._load(key, loader, self._generation))
+        # Исключение уже передано ожидающим; без них оно не попадает в лог как необработанное
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        self._pending[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable], generation: int):
+        try:
+            value = await loader()
+            if generation == self._generation:
+                self._entries[key] = (time.monotonic() + self.ttl, value)
+            return value
+        finally:
+            self._pending.pop(key, None)
+
+    def invalidate(self, *parts):
+        """Сбросить записи, ключ которых содержит все указанные части (без частей — все)"""
+        self._generation += 1
+        self.invalidations += 1
+        if not parts:
+            self._entries.clear()
+            return
+        for key in [key for key in self._entries if all(part in key for part in parts)]:
+            del self._entries[key]
+
+    def get_metrics(self) -> Dict:
+        """Попадания, промахи, общие загрузки и сбросы"""
+        requests = self.hits + self.misses + self.shared
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'invalidations': self.invalidations,
+            'entries': len(self._entries),
+            'hit_rate': round((self.hits + self.shared) / requests, 3) if requests else 0.0,
+        }
+
+
+class LRUCache:
+    """Ограниченный словарь: при переполнении вытесняется давно не использованный ключ"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(self, key: Hashable, default=None):
+        if key not in self._entries:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def set(self, key: Hashable, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        return self._entries.pop(key, default)
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_metrics(self) -> Dict:
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self._entries),
+            'hit_rate': round(self.hits / requests, 3) if requests else 0.0,
+        }
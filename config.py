@@ -24,6 +24,74 @@ ACTIONS_REQUIRED = 5  # Количество действий для завер
 AUTO_CONFIRM_HOURS = 12  # Часы для автоподтверждения
 MIN_DONATION = 50  # Минимальная сумма доната
 BOOK_EXPIRATION_DAYS = 30  # Дней до автоматического удаления книги из рекомендаций
+DEADLINE_RETRY_SECONDS = 30  # Через сколько повторить автоподтверждение или истечение показа после ошибки
+# Режим ленты: 'carousel' — одно сообщение с перелистыванием, 'messages' — сообщение на каждую книгу
+FEED_MODE = os.getenv('FEED_MODE', 'carousel')
 
 # База данных
 DATABASE_PATH = 'books_bot.db'
+
+# Пул соединений с базой данных
+DB_POOL_READERS = 4  # Количество соединений только для чтения
+DB_BUSY_TIMEOUT_MS = 30000  # Ожидание снятия блокировки БД, мс
+DB_CACHE_SIZE_KB = 16384  # Кэш страниц SQLite на одно соединение, КБ
+DB_MMAP_SIZE = 64 * 1024 * 1024  # Объём memory-mapped I/O на соединение, байт
+
+# Очередь книг (разреженные ключи queue_position)
+QUEUE_RANK_GAP = 1024  # Шаг между ключами соседних книг при добавлении и перестройке
+QUEUE_REBALANCE_MIN_GAP = 8  # Минимальный зазор между ключами, после которого очередь перестраивается
+
+# Кэш рекомендаций и снимков очереди
+CACHE_TTL_SECONDS = 60  # Срок жизни записи кэша, если её не сбросила запись в БД
+CACHE_DATA_VERSION_CHECK_SECONDS = 1  # Как часто проверять изменения БД другими процессами (PRAGMA data_version)
+
+# Исходящие сообщения (лимиты Bot API)
+SEND_RATE_PER_SECOND = 30  # Общий лимит сообщений в секунду
+SEND_CHAT_PER_SECOND = 1  # Сообщений в секунду в один личный чат
+SEND_GROUP_PER_MINUTE = 20  # Сообщений в минуту в одну группу
+SEND_CHAT_BURST = 3  # Сколько сообщений подряд можно отправить в чат без ожидания
+SEND_MAX_RETRIES = 3  # Повторы после TelegramRetryAfter и сетевых ошибок
+SEND_QUEUE_MAX = 10000  # Размер очереди, после которого массовые уведомления отбрасываются
+
+# Хранилище состояний FSM (сценарии добавления книги и отправки скриншота)
+FSM_DATABASE_PATH = 'fsm_states.db'
+FSM_CACHE_SIZE = 10000  # Состояний пользователей в памяти
+FSM_FLUSH_INTERVAL_SECONDS = 1  # Как часто изменения состояний записываются одним коммитом
+FSM_STATE_TTL_HOURS = 24  # Через сколько часов без действий сценарий считается брошенным
+FSM_SWEEP_INTERVAL_SECONDS = 600  # Как часто удалять брошенные сценарии
+
+# Режим получения обновлений: 'polling' или 'webhook'
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # Публичный адрес сервера, например https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+# Секрет из заголовка X-Telegram-Bot-Api-Secret-Token (A-Z, a-z, 0-9, _ и -); обязателен в режиме вебхука,
+# одинаковый во всех процессах, обслуживающих вебхук
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 16))  # Обновлений, обрабатываемых одновременно
+WEBHOOK_QUEUE_MAX = 1000  # Очередь обновлений, после которой Telegram получает 503 и повторяет доставку
+
+# Обработка входящих обновлений
+UPDATE_MAX_CONCURRENCY = 32  # Обновлений, обрабатываемых одновременно
+UPDATE_QUEUE_MAX = 1000  # Обновлений, ожидающих обработки; сверх этого новые отбрасываются
+UPDATE_LANE_MAX = 20  # Обновлений одного пользователя в очереди; сверх этого новые отбрасываются
+
+# Пользователи
+USER_CACHE_SIZE = 50000  # Пользователей, username которых известен без запроса к БД
+USERNAME_FLUSH_INTERVAL_SECONDS = 5  # Как часто записывать изменения username одной транзакцией
+
+# Статистика для администратора (/stats)
+STATS_DAYS = 7  # За сколько последних дней показывать завершения и истечения показа
+STATS_RECONCILE_HOURS = 24  # Как часто сверять счётчики с основными таблицами
+
+# Исходящие уведомления (таблица outbox): доставляются фоновой задачей после коммита
+OUTBOX_BATCH_SIZE = 50  # Уведомлений, отправляемых за один проход
+OUTBOX_POLL_SECONDS = 5  # Как часто проверять отложенные повторы, если новых записей нет
+OUTBOX_MAX_ATTEMPTS = 8  # Попыток доставки, после которых уведомление помечается failed
+OUTBOX_RETRY_BASE_SECONDS = 5  # Задержка перед первым повтором; удваивается с каждой попыткой
+OUTBOX_RETENTION_DAYS = 7  # Сколько дней хранить отправленные и неотправляемые уведомления
+
+# Сводки действий для владельцев книг (режим уведомлений выбирается в «📊 Моя книга»)
+DIGEST_INTERVAL_MINUTES = 30  # Как часто отправлять сводку владельцам в режиме сводки
+DIGEST_MAX_ACTIONS = 30  # Действий в одной сводке; остальные попадут в следующую
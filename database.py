@@ -1,216 +1,384 @@
 import aiosqlite
+import asyncio
+import json
+import time
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
 import config
+from cache import LRUCache, QueryCache
+from db_pool import ConnectionPool
+from deadlines import ACTION, BOOK, DeadlineIndex, action_deadline, book_deadline, utc_now
+from migrations import STATS_COUNTERS_QUERY, migrate
+from models import Action, Book, OutboxMessage, User
+from queue_index import QueueIndex
+from sender import BULK, NOTIFICATION
+
+ACTIVE_STATUSES = ('in_queue', 'in_recommendations')
+ACTION_STATUSES = ('pending', 'confirmed', 'rejected', 'auto_confirmed')
+NOTIFY_MODES = ('instant', 'digest')
+# Столбцы книг для снимка очереди и для завершённых и удалённых книг
+QUEUE_COLUMNS = ('book_id', 'user_id', 'title', 'book_type', 'confirmed_actions', 'queue_position', 'status')
+REMOVED_COLUMNS = ('book_id', 'user_id', 'title', 'book_type', 'queue_position')
+# Столбцы книги, возвращаемые вместе с подтверждённым действием
+ACTION_BOOK_COLUMNS = ('title', 'user_id', 'book_type')
+# Столбцы уведомления, нужные для отправки
+CLAIM_COLUMNS = ('outbox_id', 'chat_id', 'kind', 'payload', 'priority', 'attempts')
+_MISSING = object()
 
 
 class Database:
     def __init__(self, db_path: str = config.DATABASE_PATH):
         self.db_path = db_path
-        self.timeout = 30.0  # Таймаут для ожидания блокировки БД
+        self.timeout = config.DB_BUSY_TIMEOUT_MS / 1000  # Таймаут для ожидания блокировки БД
+        # Общий пул соединений: WAL и PRAGMA применяются к каждому соединению
+        self.pool = ConnectionPool(db_path, timeout=self.timeout)
+        # Очереди в памяти: позиция книги считается без запросов к БД.
+        # Обновляется после коммита под блокировкой писателя
+        self.queue = QueueIndex()
+        # Рекомендации и снимки очереди; сбрасываются методами, изменяющими данные
+        self.cache = QueryCache(config.CACHE_TTL_SECONDS)
+        # Сроки автоподтверждения и истечения показа для планировщика сроков
+        self.deadlines = DeadlineIndex()
+        # username зарегистрированных пользователей в том виде, в каком он записан в БД
+        self.usernames = LRUCache(config.USER_CACHE_SIZE)
+        # Изменения username из входящих обновлений, ждущие записи пачкой
+        self._pending_usernames: Dict[int, Optional[str]] = {}
+        # Устанавливается после коммита, записавшего уведомления в outbox
+        self.outbox_ready = asyncio.Event()
+        # Изменения БД другими процессами обнаруживаются по PRAGMA data_version
+        self.data_version_interval = config.CACHE_DATA_VERSION_CHECK_SECONDS
+        self._data_version = None
+        self._data_version_checked_at = 0.0
 
     async def connect(self):
-        """Инициализация базы данных и создание таблиц"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            # Включаем WAL режим для лучшей конкурентности
-            await db.execute("PRAGMA journal_mode=WAL")
-            await db.execute("PRAGMA busy_timeout=30000")  # 30 секунд
-            
-            # Таблица пользователей
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    confirmed_actions INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-
-            # Таблица книг
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS books (
-                    book_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    link TEXT NOT NULL,
-                    price REAL DEFAULT 0,
-                    book_type TEXT NOT NULL CHECK(book_type IN ('paid', 'free')),
-                    confirmed_actions INTEGER DEFAULT 0,
-                    actions_limit INTEGER DEFAULT 0,
-                    queue_position INTEGER,
-                    status TEXT DEFAULT 'in_queue' CHECK(status IN ('in_queue', 'in_recommendations', 'completed')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    recommendations_started_at TIMESTAMP,
-                    is_admin_book INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users(telegram_id)
-                )
-            """)
-            
-            # Добавляем поле recommendations_started_at если его нет (миграция)
-            try:
-                await db.execute("""
-                    ALTER TABLE books 
-                    ADD COLUMN recommendations_started_at TIMESTAMP
-                """)
-            except:
-                pass  # Поле уже существует
-
-            # Таблица действий пользователей (для предотвращения накрутки)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS user_actions (
-                    action_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    book_id INTEGER NOT NULL,
-                    user_id INTEGER NOT NULL,
-                    action_type TEXT NOT NULL CHECK(action_type IN ('purchase', 'rating', 'review', 'subscribe')),
-                    screenshot_file_id TEXT,
-                    status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'confirmed', 'rejected', 'auto_confirmed')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    confirmed_at TIMESTAMP,
-                    FOREIGN KEY (book_id) REFERENCES books(book_id),
-                    FOREIGN KEY (user_id) REFERENCES users(telegram_id),
-                    UNIQUE(book_id, user_id)
-                )
-            """)
-
-            # Таблица очередей (для отслеживания позиций)
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS queue_history (
-                    history_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    book_id INTEGER NOT NULL,
-                    old_position INTEGER,
-                    new_position INTEGER,
-                    reason TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (book_id) REFERENCES books(book_id)
-                )
-            """)
+        """Инициализация базы данных, применение миграций и загрузка очередей"""
+        async with self.pool.writer() as db:
+            await migrate(db)
+            await self.queue.load(db)
+            await self.deadlines.load(db)
+            self._data_version = await self._read_data_version(db)
 
-            await db.commit()
+    async def close(self):
+        """Закрыть соединения с базой данных"""
+        await self.pool.close()
+
+    def get_pool_metrics(self) -> Dict:
+        """Метрики пула соединений (ожидание и выдача соединений)"""
+        return self.pool.get_metrics()
+
+    def get_cache_metrics(self) -> Dict:
+        """Попадания и промахи кэша рекомендаций и очередей и кэша пользователей"""
+        return {**self.cache.get_metrics(),
+                'users': {**self.usernames.get_metrics(), 'pending': len(self._pending_usernames)}}
+
+    async def warm_cache(self):
+        """Заранее загрузить рекомендации обоих типов"""
+        for book_type in ('paid', 'free'):
+            await self.get_recommendations(book_type)
+
+    async def _read_data_version(self, db) -> int:
+        async with db.execute("PRAGMA data_version") as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def _check_external_writes(self):
+        """Сбросить кэш и очереди в памяти, если БД изменил другой процесс.
+
+        PRAGMA data_version на соединении писателя меняется только после
+        коммитов других соединений. Проверка выполняется не чаще
+        data_version_interval и пропускается, пока писатель занят.
+        """
+        now = time.monotonic()
+        if now - self._data_version_checked_at < self.data_version_interval or self.pool.writer_busy:
+            return
+        self._data_version_checked_at = now
+        async with self.pool.writer() as db:
+            version = await self._read_data_version(db)
+            if self._data_version is not None and version != self._data_version:
+                await self.queue.load(db)
+                await self.deadlines.load(db)
+                self.cache.invalidate()
+                self.usernames.clear()
+            self._data_version = version
+
+    async def _ensure_queue_index(self):
+        """Загрузить очереди в память, если connect() ещё не вызывался"""
+        if not self.queue.loaded:
+            async with self.pool.writer() as db:
+                if not self.queue.loaded:
+                    await self.queue.load(db)
+
+    async def _with_position(self, book: Optional[Book]) -> Optional[Book]:
+        """Добавить к книге отображаемую позицию в очереди"""
+        if book is None:
+            return None
+        await self._ensure_queue_index()
+        await self._check_external_writes()
+        if book.status in ACTIVE_STATUSES:
+            book.position = self.queue.position(book.book_type, book.queue_position, book.book_id)
+        else:
+            book.position = None
+        return book
+
+    async def verify_queue_index(self) -> Dict[str, int]:
+        """Сверить очереди в памяти с базой данных.
+
+        Возвращает число расхождений по типам книг; при расхождении
+        очереди перезагружаются из базы.
+        """
+        await self._ensure_queue_index()
+        async with self.pool.writer() as db:
+            mismatches = await self.queue.verify(db)
+            if any(mismatches.values()):
+                await self.queue.load(db)
+                self.cache.invalidate()
+        return mismatches
+
+    async def reload_deadlines(self):
+        """Перечитать сроки из базы (страховка от пропущенных обновлений кучи)"""
+        async with self.pool.reader() as db:
+            await self.deadlines.load(db)
 
     # ===== ПОЛЬЗОВАТЕЛИ =====
     async def add_user(self, telegram_id: int, username: str = None):
-        """Добавить нового пользователя"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+        """Добавить нового пользователя или обновить его username.
+
+        Если username совпадает с известным из кэша, запрос к БД не выполняется.
+        """
+        if self.usernames.get(telegram_id, _MISSING) == username:
+            return
+        async with self.pool.writer() as db:
+            # username обновляется, только если он изменился
+            async with db.execute(
+                """INSERT INTO users (telegram_id, username) VALUES (?, ?)
+                   ON CONFLICT(telegram_id) DO UPDATE SET username = excluded.username
+                   WHERE username IS NOT excluded.username
+                   RETURNING EXISTS (SELECT 1 FROM books WHERE books.user_id = users.telegram_id)""",
+                (telegram_id, username)
+            ) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+            self.usernames.set(telegram_id, username)
+            self._pending_usernames.pop(telegram_id, None)
+        if row and row[0]:
+            # username показывается в рекомендациях
+            self.cache.invalidate()
+
+    def note_username(self, telegram_id: int, username: Optional[str]):
+        """Запомнить username из входящего обновления; записывается flush_usernames"""
+        if self.usernames.get(telegram_id, _MISSING) == username:
+            self._pending_usernames.pop(telegram_id, None)
+            return
+        self._pending_usernames[telegram_id] = username
+
+    async def flush_usernames(self) -> int:
+        """Записать накопленные изменения username одной транзакцией из двух запросов.
+
+        Незарегистрированные пользователи не добавляются (регистрация — /start).
+        Возвращает число обновлённых пользователей.
+        """
+        if not self._pending_usernames:
+            return 0
+        pending, self._pending_usernames = self._pending_usernames, {}
+        # Все изменения передаются одним параметром: пары [telegram_id, username]
+        changes = json.dumps(list(pending.items()))
+        async with self.pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
             try:
-                await db.execute(
-                    "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
-                    (telegram_id, username)
-                )
-                await db.commit()
-            except aiosqlite.IntegrityError:
-                # Пользователь уже существует, обновляем username
-                await db.execute(
-                    "UPDATE users SET username = ? WHERE telegram_id = ?",
-                    (username, telegram_id)
-                )
+                async with db.execute(
+                    """SELECT telegram_id FROM users
+                       WHERE telegram_id IN (SELECT json_extract(value, '$[0]') FROM json_each(?))""",
+                    (changes,)
+                ) as cursor:
+                    registered = [row[0] for row in await cursor.fetchall()]
+                async with db.execute(
+                    """UPDATE users SET username = changes.username
+                       FROM (SELECT json_extract(value, '$[0]') AS telegram_id,
+                                    json_extract(value, '$[1]') AS username
+                             FROM json_each(?)) AS changes
+                       WHERE users.telegram_id = changes.telegram_id
+                       AND users.username IS NOT changes.username
+                       RETURNING EXISTS (SELECT 1 FROM books WHERE books.user_id = users.telegram_id)""",
+                    (changes,)
+                ) as cursor:
+                    updated = [row[0] for row in await cursor.fetchall()]
                 await db.commit()
+            except Exception:
+                await db.rollback()
+                # Более свежие значения, полученные за время записи, не затираются
+                self._pending_usernames = {**pending, **self._pending_usernames}
+                raise
+        for telegram_id in registered:
+            if telegram_id not in self._pending_usernames:
+                self.usernames.set(telegram_id, pending[telegram_id])
+        if any(updated):
+            # username показывается в рекомендациях
+            self.cache.invalidate()
+        return len(updated)
 
-    async def get_user(self, telegram_id: int) -> Optional[Dict]:
+    async def get_user(self, telegram_id: int) -> Optional[User]:
         """Получить информацию о пользователе"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
-                "SELECT * FROM users WHERE telegram_id = ?",
+                f"SELECT {User.select()} FROM users WHERE telegram_id = ?",
                 (telegram_id,)
             ) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+                cursor.row_factory = User.from_row
+                return await cursor.fetchone()
 
     async def increment_user_actions(self, telegram_id: int):
         """Увеличить количество подтверждённых действий пользователя"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+        async with self.pool.writer() as db:
             await db.execute(
                 "UPDATE users SET confirmed_actions = confirmed_actions + 1 WHERE telegram_id = ?",
                 (telegram_id,)
             )
             await db.commit()
 
+    async def set_notify_mode(self, telegram_id: int, mode: str):
+        """Выбрать режим уведомлений о действиях: 'instant' (сразу) или 'digest' (сводкой).
+
+        При переходе к сводкам уже отправленные действия в сводку не попадают,
+        при возврате к мгновенным уведомлениям ожидающие сводки отправляются сразу.
+        """
+        if mode not in NOTIFY_MODES:
+            raise ValueError(f"Unknown notify mode: {mode}")
+        async with self.pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            if mode == 'instant':
+                digests = await self._enqueue_digests(db, telegram_id)
+            else:
+                digests = 0
+            await db.execute(
+                """UPDATE users
+                   SET notify_mode = ?,
+                       last_digest_action_id = CASE WHEN ? = 'digest' AND notify_mode != 'digest'
+                           THEN (SELECT COALESCE(MAX(action_id), 0) FROM user_actions)
+                           ELSE last_digest_action_id END
+                   WHERE telegram_id = ?""",
+                (mode, mode, telegram_id)
+            )
+            await db.commit()
+        if digests:
+            self.outbox_ready.set()
+
     # ===== КНИГИ =====
     async def add_book(self, user_id: int, title: str, link: str, price: float, 
                       book_type: str, is_admin_book: bool = False) -> int:
         """Добавить новую книгу в очередь"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            # Получаем последнюю позицию в очереди для данного типа книги
+        async with self.pool.writer() as db:
+            # Ключ новой книги вычисляется в том же запросе, что и вставка:
+            # последний ключ очереди данного типа плюс шаг
             async with db.execute(
-                """SELECT MAX(queue_position) FROM books 
-                   WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')""",
-                (book_type,)
-            ) as cursor:
-                row = await cursor.fetchone()
-                last_position = row[0] if row[0] is not None else 0
-                new_position = last_position + 1
-
-            # Добавляем книгу
-            cursor = await db.execute(
                 """INSERT INTO books (user_id, title, link, price, book_type, 
                    queue_position, actions_limit, is_admin_book) 
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, title, link, price, book_type, new_position, 
-                 0 if is_admin_book else 0, 1 if is_admin_book else 0)
-            )
-            book_id = cursor.lastrowid
+                   SELECT ?, ?, ?, ?, ?, COALESCE(MAX(queue_position), 0) + ?, ?, ?
+                   FROM books 
+                   WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+                   RETURNING book_id, queue_position""",
+                (user_id, title, link, price, book_type, config.QUEUE_RANK_GAP,
+                 0 if is_admin_book else 0, 1 if is_admin_book else 0, book_type)
+            ) as cursor:
+                book_id, key = await cursor.fetchone()
 
             # Обновляем статус, если книга попала в топ-5
             await self._update_recommendations_status(db, book_type)
 
             await db.commit()
+            self.queue.add(book_type, key, book_id)
+            self.cache.invalidate(book_type)
             return book_id
 
-    async def get_user_book(self, user_id: int, book_type: str = None) -> Optional[Dict]:
+    async def get_user_book(self, user_id: int, book_type: str = None) -> Optional[Book]:
         """Получить активную книгу пользователя (опционально по типу)"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             if book_type:
                 # Получаем книгу определенного типа
                 async with db.execute(
-                    """SELECT * FROM books 
+                    f"""SELECT {Book.select()} FROM books 
                        WHERE user_id = ? AND book_type = ? AND status != 'completed' 
                        ORDER BY created_at DESC LIMIT 1""",
                     (user_id, book_type)
                 ) as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
+                    cursor.row_factory = Book.from_row
+                    book = await cursor.fetchone()
             else:
                 # Получаем любую активную книгу
                 async with db.execute(
-                    """SELECT * FROM books 
+                    f"""SELECT {Book.select()} FROM books 
                        WHERE user_id = ? AND status != 'completed' 
                        ORDER BY created_at DESC LIMIT 1""",
                     (user_id,)
                 ) as cursor:
-                    row = await cursor.fetchone()
-                    return dict(row) if row else None
+                    cursor.row_factory = Book.from_row
+                    book = await cursor.fetchone()
+        # Позиция в очереди берётся из индекса в памяти
+        return await self._with_position(book)
 
-    async def get_user_books(self, user_id: int) -> List[Dict]:
+    async def get_user_books(self, user_id: int) -> List[Book]:
         """Получить все активные книги пользователя"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT * FROM books 
+                f"""SELECT {Book.select()} FROM books 
                    WHERE user_id = ? AND status != 'completed' 
                    ORDER BY book_type, created_at DESC""",
                 (user_id,)
             ) as cursor:
+                cursor.row_factory = Book.from_row
+                books = await cursor.fetchall()
+        return [await self._with_position(book) for book in books]
+
+    async def get_user_context(self, user_id: int) -> Dict:
+        """Профиль пользователя и его активные книги одним запросом.
+
+        Возвращает {'user': User или None, 'books': [Book, ...]}; книги
+        упорядочены как в get_user_books. Незарегистрированный пользователь
+        книг не имеет.
+        """
+        async with self.pool.reader() as db:
+            async with db.execute(
+                f"""SELECT {User.select('u')}, {Book.select('b')}
+                   FROM users u
+                   LEFT JOIN books b ON b.user_id = u.telegram_id AND b.status != 'completed'
+                   WHERE u.telegram_id = ?
+                   ORDER BY b.book_type, b.created_at DESC""",
+                (user_id,)
+            ) as cursor:
+                # Строка — столбцы пользователя, затем столбцы книги
+                cursor.row_factory = None
                 rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        if not rows:
+            return {'user': None, 'books': []}
+        split = len(User.COLUMNS)
+        user = User(*rows[0][:split])
+        books = []
+        for row in rows:
+            if row[split] is not None:
+                books.append(await self._with_position(Book(*row[split:])))
+        return {'user': user, 'books': books}
 
-    async def get_book_by_id(self, book_id: int) -> Optional[Dict]:
+    async def get_book_by_id(self, book_id: int) -> Optional[Book]:
         """Получить книгу по ID"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
-                "SELECT * FROM books WHERE book_id = ?",
+                f"SELECT {Book.select()} FROM books WHERE book_id = ?",
                 (book_id,)
             ) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+                cursor.row_factory = Book.from_row
+                book = await cursor.fetchone()
+        return await self._with_position(book)
+
+    async def get_recommendations(self, book_type: str) -> List[Book]:
+        """Получить топ-5 книг для рекомендаций (из кэша; результат не изменять)"""
+        await self._check_external_writes()
+        return await self.cache.get_or_load(
+            ('recommendations', book_type), lambda: self._load_recommendations(book_type)
+        )
 
-    async def get_recommendations(self, book_type: str) -> List[Dict]:
-        """Получить топ-5 книг для рекомендаций"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+    async def _load_recommendations(self, book_type: str) -> List[Book]:
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT b.*, u.username 
+                f"""SELECT {Book.select('b')}, u.username,
+                          ROW_NUMBER() OVER (ORDER BY b.queue_position) AS position
                    FROM books b
                    LEFT JOIN users u ON b.user_id = u.telegram_id
                    WHERE b.book_type = ? AND b.status = 'in_recommendations'
@@ -218,64 +386,60 @@ class Database:
                    LIMIT ?""",
                 (book_type, config.MAX_BOOKS_IN_RECOMMENDATIONS)
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                cursor.row_factory = Book.from_row
+                return await cursor.fetchall()
 
-    async def get_queue_books(self, book_type: str) -> List[Dict]:
-        """Получить все книги в очереди определённого типа"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_queue_books(self, book_type: str) -> List[Book]:
+        """Получить все книги в очереди определённого типа (из кэша; результат не изменять)"""
+        await self._check_external_writes()
+        return await self.cache.get_or_load(
+            ('queue', book_type), lambda: self._load_queue_books(book_type)
+        )
+
+    async def _load_queue_books(self, book_type: str) -> List[Book]:
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT b.*, u.username 
+                f"""SELECT {Book.select('b', QUEUE_COLUMNS)}, u.username,
+                          ROW_NUMBER() OVER (ORDER BY b.queue_position) AS position
                    FROM books b
                    LEFT JOIN users u ON b.user_id = u.telegram_id
                    WHERE b.book_type = ? AND b.status IN ('in_queue', 'in_recommendations')
                    ORDER BY b.queue_position ASC""",
                 (book_type,)
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                cursor.row_factory = Book.from_named_row
+                return await cursor.fetchall()
 
     async def complete_book(self, book_id: int):
         """Завершить продвижение книги"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            # Получаем информацию о книге
+        async with self.pool.writer() as db:
+            # Удаляем книгу (согласно требованиям); ключи остальных книг не меняются
             async with db.execute(
-                "SELECT book_type, queue_position FROM books WHERE book_id = ?",
+                "DELETE FROM books WHERE book_id = ? RETURNING book_type, queue_position",
                 (book_id,)
             ) as cursor:
                 row = await cursor.fetchone()
-                if not row:
-                    return
-                book_type, position = row
-
-            # Удаляем книгу (согласно требованиям)
-            await db.execute("DELETE FROM books WHERE book_id = ?", (book_id,))
-
-            # Пересчитываем позиции в очереди
-            await db.execute(
-                """UPDATE books 
-                   SET queue_position = queue_position - 1 
-                   WHERE book_type = ? AND queue_position > ?""",
-                (book_type, position)
-            )
+            if not row:
+                return
+            book_type = row[0]
+            await self._record_daily(db, 'completed', 1)
 
             # Обновляем статусы рекомендаций
             await self._update_recommendations_status(db, book_type)
 
             await db.commit()
+            self.queue.remove(book_type, row[1], book_id)
+            self.deadlines.discard(BOOK, book_id)
+            self.cache.invalidate(book_type)
 
-    async def _update_recommendations_status(self, db, book_type: str):
-        """Обновить статусы книг (топ-5 в рекомендациях)"""
-        # Сбрасываем статусы в in_queue для книг, которые выходят из рекомендаций
-        await db.execute(
-            """UPDATE books 
-               SET status = 'in_queue', recommendations_started_at = NULL 
-               WHERE book_type = ? AND status = 'in_recommendations'""",
-            (book_type,)
-        )
+    async def _update_recommendations_status(self, db, book_type: str) -> Dict[str, List[int]]:
+        """Обновить статусы книг (топ-5 в рекомендациях).
 
-        # Получаем топ-5 книг для рекомендаций (среди всех книг, не завершенных)
+        Текущий набор рекомендаций сравнивается с новым топом, и изменяются
+        только входящие и выходящие книги. У книг, оставшихся в топе,
+        сохраняется recommendations_started_at (срок показа не сбрасывается).
+        """
+        # Новый топ-5 среди всех незавершённых книг
         async with db.execute(
             f"""SELECT book_id FROM books 
                WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
@@ -283,26 +447,101 @@ class Database:
                LIMIT {config.MAX_BOOKS_IN_RECOMMENDATIONS}""",
             (book_type,)
         ) as cursor:
-            book_ids = [row[0] for row in await cursor.fetchall()]
-        
-        # Устанавливаем статус in_recommendations и время начала рекомендаций
-        for book_id in book_ids:
+            top_ids = {row[0] for row in await cursor.fetchall()}
+
+        # Книги, которые сейчас в рекомендациях
+        async with db.execute(
+            """SELECT book_id FROM books 
+               WHERE book_type = ? AND status = 'in_recommendations'""",
+            (book_type,)
+        ) as cursor:
+            current_ids = {row[0] for row in await cursor.fetchall()}
+
+        demoted = sorted(current_ids - top_ids)
+        promoted = sorted(top_ids - current_ids)
+
+        # Возвращаем в очередь книги, которые вышли из топа
+        if demoted:
             await db.execute(
-                """UPDATE books 
-                   SET status = 'in_recommendations',
-                       recommendations_started_at = CASE 
-                           WHEN recommendations_started_at IS NULL 
-                           THEN CURRENT_TIMESTAMP 
-                           ELSE recommendations_started_at 
-                       END
-                   WHERE book_id = ?""",
-                (book_id,)
+                f"""UPDATE books 
+                   SET status = 'in_queue', recommendations_started_at = NULL 
+                   WHERE book_id IN ({', '.join('?' * len(demoted))})""",
+                demoted
             )
 
+        for book_id in demoted:
+            self.deadlines.discard(BOOK, book_id)
+
+        # Новым книгам в топе ставим статус и время начала рекомендаций
+        if promoted:
+            async with db.execute(
+                f"""UPDATE books 
+                   SET status = 'in_recommendations', recommendations_started_at = CURRENT_TIMESTAMP 
+                   WHERE book_id IN ({', '.join('?' * len(promoted))})
+                   RETURNING book_id, recommendations_started_at""",
+                promoted
+            ) as cursor:
+                started = await cursor.fetchall()
+            # Срок показа отсчитывается только у платных книг
+            if book_type == 'paid':
+                for book_id, started_at in started:
+                    self.deadlines.set(BOOK, book_id, book_deadline(started_at))
+
+        return {'promoted': promoted, 'demoted': demoted}
+
+    async def _complete_reached_books(self, db, candidates_sql: str, params=()) -> List[Book]:
+        """Завершить книги, набравшие ACTIONS_REQUIRED подтверждённых действий.
+
+        Выполняется внутри транзакции, изменившей счётчики: книги удаляются, а
+        следующие книги очереди поднимаются в рекомендации в той же транзакции.
+        candidates_sql — подзапрос с book_id книг, счётчики которых изменились.
+        После коммита вызывающий передаёт результат в _after_completion.
+        """
+        async with db.execute(
+            f"""DELETE FROM books
+               WHERE book_id IN ({candidates_sql}) AND confirmed_actions >= ?
+               RETURNING {Book.select(columns=REMOVED_COLUMNS)}""",
+            (*params, config.ACTIONS_REQUIRED)
+        ) as cursor:
+            cursor.row_factory = Book.from_named_row
+            completed = await cursor.fetchall()
+
+        if completed:
+            await self._record_daily(db, 'completed', len(completed))
+        for book_type in sorted({book.book_type for book in completed}):
+            await self._update_recommendations_status(db, book_type)
+        return completed
+
+    def _after_completion(self, completed: List[Book]):
+        """Убрать завершённые книги из очередей в памяти (после коммита)"""
+        for book in completed:
+            self.queue.remove(book.book_type, book.queue_position, book.book_id)
+            self.deadlines.discard(BOOK, book.book_id)
+        if completed:
+            print(f"[{datetime.now()}] Completed book(s): {[book.book_id for book in completed]}")
+
+    async def complete_reached_books(self) -> List[Book]:
+        """Завершить все книги, уже набравшие нужное число действий.
+
+        Нужна один раз при запуске: до перехода на завершение в транзакции
+        подтверждения такие книги ждали проверки планировщиком.
+        """
+        await self._ensure_queue_index()
+        async with self.pool.writer() as db:
+            completed = await self._complete_reached_books(
+                db, "SELECT book_id FROM books WHERE confirmed_actions >= ?", (config.ACTIONS_REQUIRED,)
+            )
+            await db.commit()
+            self._after_completion(completed)
+            if completed:
+                self.cache.invalidate()
+        return completed
+
     async def move_book_up(self, book_id: int) -> bool:
         """Продвинуть книгу на 1 позицию вверх (если возможно)"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            # Получаем текущую позицию книги
+        await self._ensure_queue_index()
+        async with self.pool.writer() as db:
+            # Получаем текущий ключ книги
             async with db.execute(
                 "SELECT queue_position, book_type FROM books WHERE book_id = ?",
                 (book_id,)
@@ -310,37 +549,119 @@ class Database:
                 row = await cursor.fetchone()
                 if not row:
                     return False
-                current_position, book_type = row
+                current_key, book_type = row
+            old_key = current_key
+            old_position = self.queue.position(book_type, old_key, book_id)
 
-            if current_position <= 1:
+            new_key = await self._key_before_previous(db, book_type, current_key)
+            if new_key is None:
                 return False  # Уже на первой позиции
 
-            # Меняем позиции с предыдущей книгой
-            await db.execute(
-                """UPDATE books 
-                   SET queue_position = ? 
-                   WHERE book_type = ? AND queue_position = ?""",
-                (current_position, book_type, current_position - 1)
-            )
+            rebalanced = new_key == current_key
+            if rebalanced:
+                # Между соседними ключами не осталось места: перестраиваем ключи
+                await self._rebalance_queue(db, book_type)
+                async with db.execute(
+                    "SELECT queue_position FROM books WHERE book_id = ?", (book_id,)
+                ) as cursor:
+                    current_key = (await cursor.fetchone())[0]
+                new_key = await self._key_before_previous(db, book_type, current_key)
 
+            # Книга перемещается одной записью: новый ключ между двумя предыдущими
             await db.execute(
                 "UPDATE books SET queue_position = ? WHERE book_id = ?",
-                (current_position - 1, book_id)
+                (new_key, book_id)
             )
 
-            # Записываем историю
+            # Записываем историю (новый ключ всегда перед предыдущей книгой)
             await db.execute(
                 """INSERT INTO queue_history (book_id, old_position, new_position, reason)
                    VALUES (?, ?, ?, 'additional_activity')""",
-                (book_id, current_position, current_position - 1)
+                (book_id, old_position, old_position - 1)
             )
 
+            # Книга могла войти в топ рекомендаций
+            await self._update_recommendations_status(db, book_type)
+
             await db.commit()
+            if rebalanced:
+                await self.queue.load(db, book_type)
+            else:
+                self.queue.move(book_type, old_key, new_key, book_id)
+            self.cache.invalidate(book_type)
             return True
 
+    async def _key_before_previous(self, db, book_type: str, key: int) -> Optional[int]:
+        """Ключ между двумя книгами перед указанным ключом.
+
+        None — перед ключом нет книг; равен исходному ключу — свободного места нет.
+        """
+        async with db.execute(
+            """SELECT queue_position FROM books 
+               WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+               AND queue_position < ?
+               ORDER BY queue_position DESC LIMIT 2""",
+            (book_type, key)
+        ) as cursor:
+            previous = [row[0] for row in await cursor.fetchall()]
+
+        if not previous:
+            return None
+        upper = previous[0]
+        lower = previous[1] if len(previous) > 1 else upper - 2 * config.QUEUE_RANK_GAP
+        if upper - lower < 2:
+            return key
+        return (lower + upper) // 2
+
+    async def _rebalance_queue(self, db, book_type: str) -> int:
+        """Равномерно перераспределить ключи очереди; возвращает число изменённых книг"""
+        cursor = await db.execute(
+            """UPDATE books
+               SET queue_position = ranked.position * ?
+               FROM (SELECT book_id,
+                            ROW_NUMBER() OVER (ORDER BY queue_position, book_id) AS position
+                     FROM books
+                     WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')) AS ranked
+               WHERE books.book_id = ranked.book_id
+               AND books.queue_position != ranked.position * ?""",
+            (config.QUEUE_RANK_GAP, book_type, config.QUEUE_RANK_GAP)
+        )
+        return cursor.rowcount
+
+    async def rebalance_queues(self) -> Dict[str, int]:
+        """Перестроить ключи очередей, в которых между соседями почти не осталось места"""
+        rebalanced = {}
+        async with self.pool.writer() as db:
+            for book_type in ('paid', 'free'):
+                async with db.execute(
+                    """SELECT MIN(gap) FROM (
+                           SELECT queue_position - LAG(queue_position) OVER (ORDER BY queue_position) AS gap
+                           FROM books
+                           WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations'))""",
+                    (book_type,)
+                ) as cursor:
+                    min_gap = (await cursor.fetchone())[0]
+                if min_gap is not None and min_gap < config.QUEUE_REBALANCE_MIN_GAP:
+                    rebalanced[book_type] = await self._rebalance_queue(db, book_type)
+            await db.commit()
+            for book_type in rebalanced:
+                await self.queue.load(db, book_type)
+                self.cache.invalidate(book_type)
+        return rebalanced
+
+    async def refresh_recommendations(self) -> Dict[str, Dict[str, List[int]]]:
+        """Пересчитать статусы рекомендаций обеих очередей; возвращает поднятые и опущенные книги"""
+        changes = {}
+        async with self.pool.writer() as db:
+            for book_type in ('paid', 'free'):
+                changes[book_type] = await self._update_recommendations_status(db, book_type)
+            await db.commit()
+            self.cache.invalidate()
+        return changes
+
     async def increment_actions_limit(self, user_id: int):
         """Увеличить лимит действий для книги пользователя"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+        async with self.pool.writer() as db:
             await db.execute(
                 """UPDATE books 
                    SET actions_limit = actions_limit + 1 
@@ -348,268 +669,631 @@ class Database:
                 (user_id,)
             )
             await db.commit()
+            self.cache.invalidate()
 
     # ===== ДЕЙСТВИЯ =====
     async def add_action(self, book_id: int, user_id: int, action_type: str = 'purchase', 
                         screenshot_file_id: str = None) -> int:
-        """Добавить действие пользователя (покупка, оценка и т.д.)"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
+        """Добавить действие пользователя (покупка, оценка и т.д.).
+
+        Уведомление владельцу книги записывается в outbox той же транзакцией
+        (если владелец не получает действия сводкой).
+        """
+        async with self.pool.writer() as db:
             try:
-                cursor = await db.execute(
+                async with db.execute(
                     """INSERT INTO user_actions (book_id, user_id, action_type, screenshot_file_id)
-                       VALUES (?, ?, ?, ?)""",
+                       VALUES (?, ?, ?, ?)
+                       RETURNING action_id, created_at""",
                     (book_id, user_id, action_type, screenshot_file_id)
+                ) as cursor:
+                    action_id, created_at = await cursor.fetchone()
+                # Уведомление владельцу книги со скриншотом и кнопками подтверждения;
+                # владельцу в режиме сводки действие придёт в следующей сводке
+                await db.execute(
+                    """INSERT INTO outbox (chat_id, kind, payload, priority)
+                       SELECT b.user_id, 'action_submitted',
+                              json_object('action_id', ?, 'photo', ?, 'title', b.title,
+                                          'book_type', b.book_type, 'username', u.username), ?
+                       FROM books b
+                       LEFT JOIN users u ON u.telegram_id = ?
+                       LEFT JOIN users o ON o.telegram_id = b.user_id
+                       WHERE b.book_id = ? AND o.notify_mode IS NOT 'digest'""",
+                    (action_id, screenshot_file_id, NOTIFICATION, user_id, book_id)
                 )
                 await db.commit()
-                return cursor.lastrowid
+                self.deadlines.set(ACTION, action_id, action_deadline(created_at))
+                self.outbox_ready.set()
+                # Статусы пользователя в ленте
+                self.cache.invalidate('statuses', user_id)
+                return action_id
             except aiosqlite.IntegrityError:
                 # Пользователь уже выполнил действие для этой книги
                 return -1
 
-    async def confirm_action(self, action_id: int, status: str = 'confirmed'):
-        """Подтвердить или отклонить действие"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            # Обновляем статус действия
-            await db.execute(
+    async def confirm_action(self, action_id: int, status: str = 'confirmed',
+                             owner_id: Optional[int] = None) -> Optional[Action]:
+        """Подтвердить или отклонить ожидающее действие.
+
+        Статус меняется условным UPDATE только у действия в статусе pending
+        (и только для книги owner_id, если он указан), поэтому повторное
+        нажатие кнопки или повторная доставка callback ничего не меняют.
+        Счётчики, завершение книги и уведомление в outbox записываются в той
+        же транзакции. Возвращает действие с полями книги и completed_book (завершённая
+        книга или None) либо None, если действие не было изменено.
+        """
+        await self._ensure_queue_index()
+        completed = []
+        async with self.pool.writer() as db:
+            async with db.execute(
                 """UPDATE user_actions 
                    SET status = ?, confirmed_at = CURRENT_TIMESTAMP 
-                   WHERE action_id = ?""",
-                (status, action_id)
-            )
+                   WHERE action_id = ? AND status = 'pending'
+                   AND (? IS NULL OR EXISTS (SELECT 1 FROM books
+                                            WHERE books.book_id = user_actions.book_id
+                                            AND books.user_id = ?))
+                   RETURNING action_id, book_id, user_id, action_type, status""",
+                (status, action_id, owner_id, owner_id)
+            ) as cursor:
+                cursor.row_factory = Action.from_named_row
+                action = await cursor.fetchone()
+            if action is None:
+                # Действие не найдено, уже обработано или принадлежит чужой книге
+                await db.rollback()
+                return None
+            book_id, user_id = action.book_id, action.user_id
 
             if status in ['confirmed', 'auto_confirmed']:
-                # Получаем информацию о действии
+                # Увеличиваем счётчик подтверждённых действий для книги
                 async with db.execute(
-                    "SELECT book_id, user_id FROM user_actions WHERE action_id = ?",
-                    (action_id,)
+                    f"""UPDATE books 
+                       SET confirmed_actions = confirmed_actions + 1 
+                       WHERE book_id = ?
+                       RETURNING {Book.select(columns=ACTION_BOOK_COLUMNS)}""",
+                    (book_id,)
                 ) as cursor:
-                    row = await cursor.fetchone()
-                    if row:
-                        book_id, user_id = row
-
-                        # Увеличиваем счётчик подтверждённых действий для книги
-                        await db.execute(
-                            """UPDATE books 
-                               SET confirmed_actions = confirmed_actions + 1 
-                               WHERE book_id = ?""",
-                            (book_id,)
-                        )
-
-                        # Увеличиваем счётчик действий пользователя
-                        await db.execute(
-                            """UPDATE users 
-                               SET confirmed_actions = confirmed_actions + 1 
-                               WHERE telegram_id = ?""",
-                            (user_id,)
-                        )
-
-                        # Увеличиваем лимит действий для книги пользователя, совершившего действие
-                        # Делаем это в том же соединении, чтобы избежать блокировки БД
-                        await db.execute(
-                            """UPDATE books 
-                               SET actions_limit = actions_limit + 1 
-                               WHERE user_id = ? AND status != 'completed'""",
-                            (user_id,)
-                        )
+                    cursor.row_factory = Book.from_named_row
+                    book = await cursor.fetchone()
+                book_type = book.book_type if book else None
+
+                # Увеличиваем счётчики действий пользователя (всего и по типу книги)
+                await db.execute(
+                    """UPDATE users 
+                       SET confirmed_actions = confirmed_actions + 1,
+                           confirmed_paid_actions = confirmed_paid_actions + (? IS 'paid'),
+                           confirmed_free_actions = confirmed_free_actions + (? IS 'free')
+                       WHERE telegram_id = ?""",
+                    (book_type, book_type, user_id)
+                )
+
+                # Увеличиваем лимит действий для книги пользователя, совершившего действие
+                await db.execute(
+                    """UPDATE books 
+                       SET actions_limit = actions_limit + 1 
+                       WHERE user_id = ? AND status != 'completed'""",
+                    (user_id,)
+                )
+
+                # Книга набрала нужное число действий — завершаем сразу
+                completed = await self._complete_reached_books(db, "?", (book_id,))
+            else:
+                async with db.execute(
+                    f"SELECT {Book.select(columns=ACTION_BOOK_COLUMNS)} FROM books WHERE book_id = ?",
+                    (book_id,)
+                ) as cursor:
+                    cursor.row_factory = Book.from_named_row
+                    book = await cursor.fetchone()
+
+            # Уведомление совершившему действие; username автора — из таблицы пользователей
+            await db.execute(
+                """INSERT INTO outbox (chat_id, kind, payload, priority)
+                   SELECT ?, ?, json_object('title', b.title, 'owner_username', u.username), ?
+                   FROM books b
+                   LEFT JOIN users u ON u.telegram_id = b.user_id
+                   WHERE b.book_id = ?""",
+                (user_id, f"action_{status}", NOTIFICATION, book_id)
+            )
 
             await db.commit()
+            self.deadlines.discard(ACTION, action_id)
+            self.outbox_ready.set()
+            self._after_completion(completed)
+            if status in ['confirmed', 'auto_confirmed']:
+                # Изменились счётчики действий книг, показываемые в рекомендациях
+                self.cache.invalidate()
+            else:
+                self.cache.invalidate('statuses', user_id)
+
+        if book:
+            action.title, action.book_owner_id, action.book_type = book.title, book.user_id, book.book_type
+        action.completed_book = completed[0] if completed else None
+        return action
 
     async def delete_action(self, action_id: int):
         """Удалить действие (для возможности повторной отправки после отклонения)"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            await db.execute(
-                "DELETE FROM user_actions WHERE action_id = ?",
+        async with self.pool.writer() as db:
+            async with db.execute(
+                "DELETE FROM user_actions WHERE action_id = ? RETURNING user_id",
                 (action_id,)
-            )
+            ) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+            self.deadlines.discard(ACTION, action_id)
+            if row:
+                self.cache.invalidate('statuses', row[0])
 
-    async def get_pending_actions(self) -> List[Dict]:
-        """Получить все ожидающие подтверждения действия"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+    async def get_pending_actions(self, owner_id: Optional[int] = None) -> List[Action]:
+        """Получить ожидающие подтверждения действия (для книг owner_id, если он указан)"""
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT ua.*, b.title, b.user_id as book_owner_id, u.username
+                f"""SELECT {Action.select('ua')}, b.title, b.user_id as book_owner_id, u.username
                    FROM user_actions ua
                    JOIN books b ON ua.book_id = b.book_id
                    JOIN users u ON ua.user_id = u.telegram_id
-                   WHERE ua.status = 'pending'
-                   ORDER BY ua.created_at ASC"""
+                   WHERE ua.status = 'pending' AND (? IS NULL OR b.user_id = ?)
+                   ORDER BY ua.created_at ASC, ua.action_id ASC""",
+                (owner_id, owner_id)
             ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+                cursor.row_factory = Action.from_row
+                return await cursor.fetchall()
 
-    async def get_action_by_id(self, action_id: int) -> Optional[Dict]:
+    async def get_action_by_id(self, action_id: int) -> Optional[Action]:
         """Получить действие по ID"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT ua.*, b.title, b.user_id as book_owner_id
+                f"""SELECT {Action.select('ua')}, b.title, b.user_id as book_owner_id
                    FROM user_actions ua
                    JOIN books b ON ua.book_id = b.book_id
                    WHERE ua.action_id = ?""",
                 (action_id,)
             ) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
-
-    async def auto_confirm_old_actions(self):
-        """Автоматически подтвердить действия старше 12 часов"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            threshold = datetime.now() - timedelta(hours=config.AUTO_CONFIRM_HOURS)
-            
-            # Получаем действия для автоподтверждения
-            async with db.execute(
-                """SELECT action_id FROM user_actions 
-                   WHERE status = 'pending' AND created_at < ?""",
-                (threshold,)
-            ) as cursor:
-                action_ids = [row[0] for row in await cursor.fetchall()]
+                cursor.row_factory = Action.from_row
+                return await cursor.fetchone()
+
+    async def auto_confirm_old_actions(self, now: Optional[datetime] = None) -> List[Action]:
+        """Автоматически подтвердить действия старше 12 часов.
+
+        Все просроченные действия подтверждаются в одной транзакции
+        (_confirm_pending). Возвращает подтверждённые действия; у действий
+        завершённых книг book_completed = True. now — время UTC (по умолчанию текущее).
+        """
+        threshold = (now or utc_now()) - timedelta(hours=config.AUTO_CONFIRM_HOURS)
+        return await self._confirm_pending('auto_confirmed', "ua.created_at <= ?", (threshold,))
+
+    async def confirm_actions(self, action_ids: List[int], owner_id: Optional[int] = None) -> List[Action]:
+        """Подтвердить несколько ожидающих действий одной транзакцией.
+
+        Подтверждаются только действия в статусе pending (и только для книг
+        owner_id, если он указан); завершение проверяется один раз на книгу.
+        Возвращает подтверждённые действия; у действий завершённых книг
+        book_completed = True.
+        """
+        if not action_ids:
+            return []
+        return await self._confirm_pending(
+            'confirmed',
+            f"ua.action_id IN ({', '.join('?' * len(action_ids))}) AND (? IS NULL OR b.user_id = ?)",
+            (*action_ids, owner_id, owner_id)
+        )
+
+    async def _confirm_pending(self, status: str, condition: str, params=()) -> List[Action]:
+        """Подтвердить ожидающие действия, отобранные условием, в одной транзакции.
+
+        condition — условие на ua (user_actions) и b (books). Статусы действий и
+        счётчики книг и пользователей обновляются групповыми запросами,
+        уведомления записываются в outbox, книги, набравшие нужное число
+        действий, завершаются. Владельцам завершённых книг пишется уведомление
+        только при автоподтверждении: при ручном им отвечает обработчик.
+        """
+        auto = status == 'auto_confirmed'
+        await self._ensure_queue_index()
+
+        async with self.pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.execute(
+                """CREATE TEMP TABLE IF NOT EXISTS confirm_batch (
+                       action_id INTEGER PRIMARY KEY,
+                       book_id INTEGER NOT NULL,
+                       user_id INTEGER NOT NULL,
+                       book_type TEXT
+                   )"""
+            )
+            await db.execute("DELETE FROM confirm_batch")
 
-            # Подтверждаем каждое действие
-            for action_id in action_ids:
-                await self.confirm_action(action_id, 'auto_confirmed')
+            # Фиксируем набор действий вместе с типом книги
+            await db.execute(
+                f"""INSERT INTO confirm_batch (action_id, book_id, user_id, book_type)
+                   SELECT ua.action_id, ua.book_id, ua.user_id, b.book_type FROM user_actions ua
+                   LEFT JOIN books b ON b.book_id = ua.book_id
+                   WHERE ua.status = 'pending' AND {condition}""",
+                params
+            )
+
+            await db.execute(
+                """UPDATE user_actions
+                   SET status = ?, confirmed_at = CURRENT_TIMESTAMP
+                   WHERE action_id IN (SELECT action_id FROM confirm_batch)""",
+                (status,)
+            )
+
+            # Счётчик подтверждённых действий книг
+            await db.execute(
+                """UPDATE books
+                   SET confirmed_actions = confirmed_actions + batch.total
+                   FROM (SELECT book_id, COUNT(*) AS total
+                         FROM confirm_batch GROUP BY book_id) AS batch
+                   WHERE books.book_id = batch.book_id"""
+            )
+
+            # Счётчики действий пользователей, совершивших действия (всего и по типам книг)
+            await db.execute(
+                """UPDATE users
+                   SET confirmed_actions = confirmed_actions + batch.total,
+                       confirmed_paid_actions = confirmed_paid_actions + batch.paid,
+                       confirmed_free_actions = confirmed_free_actions + batch.free
+                   FROM (SELECT user_id, COUNT(*) AS total,
+                                SUM(book_type IS 'paid') AS paid, SUM(book_type IS 'free') AS free
+                         FROM confirm_batch GROUP BY user_id) AS batch
+                   WHERE users.telegram_id = batch.user_id"""
+            )
+
+            # Лимит действий для книг пользователей, совершивших действия
+            await db.execute(
+                """UPDATE books
+                   SET actions_limit = actions_limit + batch.total
+                   FROM (SELECT user_id, COUNT(*) AS total
+                         FROM confirm_batch GROUP BY user_id) AS batch
+                   WHERE books.user_id = batch.user_id AND books.status != 'completed'"""
+            )
 
-    async def check_book_completion(self, book_id: int) -> bool:
-        """Проверить, набрала ли книга необходимое количество действий"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
             async with db.execute(
-                "SELECT confirmed_actions FROM books WHERE book_id = ?",
-                (book_id,)
+                """SELECT batch.action_id, batch.book_id, batch.user_id,
+                          b.user_id AS book_owner_id, b.title, b.book_type
+                   FROM confirm_batch batch
+                   LEFT JOIN books b ON b.book_id = batch.book_id
+                   ORDER BY batch.action_id"""
             ) as cursor:
-                row = await cursor.fetchone()
-                if row and row[0] >= config.ACTIONS_REQUIRED:
-                    await self.complete_book(book_id)
-                    return True
-                return False
-
-    async def auto_remove_expired_books(self) -> int:
-        """Автоматически удалить платные книги, которые не набрали 5 действий за 30 дней"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            threshold = datetime.now() - timedelta(days=config.BOOK_EXPIRATION_DAYS)
-            
+                cursor.row_factory = Action.from_named_row
+                confirmed = await cursor.fetchall()
+
+            # Уведомления совершившим действия (до удаления завершённых книг)
+            await db.execute(
+                """INSERT INTO outbox (chat_id, kind, payload, priority)
+                   SELECT batch.user_id, ?, json_object('title', b.title, 'owner_username', o.username), ?
+                   FROM confirm_batch batch
+                   JOIN books b ON b.book_id = batch.book_id
+                   LEFT JOIN users o ON o.telegram_id = b.user_id
+                   ORDER BY batch.action_id""",
+                (f"action_{status}", BULK if auto else NOTIFICATION)
+            )
+
+            # Завершение книг и продвижение следующих в той же транзакции
+            completed = await self._complete_reached_books(
+                db, "SELECT DISTINCT book_id FROM confirm_batch"
+            )
+            completed_ids = {book.book_id for book in completed}
+            for action in confirmed:
+                action.book_completed = action.book_id in completed_ids
+
+            # Уведомления владельцам завершённых книг
+            if auto:
+                for book in completed:
+                    await self._enqueue(db, book.user_id, 'book_completed', {'title': book.title}, BULK)
+
+            await db.execute("DELETE FROM confirm_batch")
+            await db.commit()
+            for action in confirmed:
+                self.deadlines.discard(ACTION, action.action_id)
+            self._after_completion(completed)
+            if confirmed:
+                self.cache.invalidate()
+                self.outbox_ready.set()
+            return confirmed
+
+    async def auto_remove_expired_books(self, now: Optional[datetime] = None) -> List[Book]:
+        """Автоматически удалить платные книги, которые не набрали 5 действий за 30 дней.
+
+        Все просроченные книги удаляются за один проход, рекомендации
+        пересчитываются один раз на тип, владельцам записываются уведомления
+        в outbox. Возвращает удалённые книги.
+        now — время UTC (по умолчанию текущее).
+        """
+        threshold = (now or utc_now()) - timedelta(days=config.BOOK_EXPIRATION_DAYS)
+
+        async with self.pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            await db.execute(
+                """CREATE TEMP TABLE IF NOT EXISTS expired_batch (
+                       book_id INTEGER PRIMARY KEY,
+                       book_type TEXT NOT NULL,
+                       queue_position INTEGER,
+                       title TEXT,
+                       user_id INTEGER
+                   )"""
+            )
+            await db.execute("DELETE FROM expired_batch")
+
             # Находим книги для удаления
-            async with db.execute(
-                """SELECT book_id, title, user_id FROM books 
-                   WHERE book_type = 'paid' 
+            await db.execute(
+                """INSERT INTO expired_batch (book_id, book_type, queue_position, title, user_id)
+                   SELECT book_id, book_type, queue_position, title, user_id FROM books
+                   WHERE book_type = 'paid'
                    AND status = 'in_recommendations'
                    AND confirmed_actions < ?
-                   AND recommendations_started_at < ?
+                   AND recommendations_started_at <= ?
                    AND recommendations_started_at IS NOT NULL""",
                 (config.ACTIONS_REQUIRED, threshold)
+            )
+
+            async with db.execute(
+                f"SELECT {Book.select(columns=REMOVED_COLUMNS)} FROM expired_batch ORDER BY book_id"
             ) as cursor:
+                cursor.row_factory = Book.from_named_row
                 expired_books = await cursor.fetchall()
-            
-            removed_count = 0
-            for book_id, title, user_id in expired_books:
-                # Получаем информацию о книге
-                async with db.execute(
-                    "SELECT book_type, queue_position FROM books WHERE book_id = ?",
-                    (book_id,)
-                ) as cursor:
-                    row = await cursor.fetchone()
-                    if not row:
-                        continue
-                    book_type, position = row
 
-                # Удаляем все связанные действия
-                await db.execute("DELETE FROM user_actions WHERE book_id = ?", (book_id,))
-
-                # Удаляем книгу
-                await db.execute("DELETE FROM books WHERE book_id = ?", (book_id,))
+            if not expired_books:
+                await db.commit()
+                return []
 
-                # Пересчитываем позиции в очереди
-                await db.execute(
-                    """UPDATE books 
-                       SET queue_position = queue_position - 1 
-                       WHERE book_type = ? AND queue_position > ?""",
-                    (book_type, position)
-                )
+            # Удаляем связанные действия и сами книги
+            await db.execute(
+                "DELETE FROM user_actions WHERE book_id IN (SELECT book_id FROM expired_batch)"
+            )
+            await db.execute(
+                "DELETE FROM books WHERE book_id IN (SELECT book_id FROM expired_batch)"
+            )
+            await self._record_daily(db, 'expired', len(expired_books))
+            for book in expired_books:
+                await self._enqueue(db, book.user_id, 'book_expired', {'title': book.title}, BULK)
 
-                # Обновляем статусы рекомендаций
+            # Ключи очереди разреженные: перенумерация не нужна,
+            # рекомендации пересчитываются один раз на тип
+            for book_type in sorted({book.book_type for book in expired_books}):
                 await self._update_recommendations_status(db, book_type)
-                
-                removed_count += 1
-                print(f"[{datetime.now()}] Удалена книга '{title}' (ID: {book_id}) за неактивность")
-            
+
+            await db.execute("DELETE FROM expired_batch")
             await db.commit()
-            return removed_count
+            for book in expired_books:
+                self.queue.remove(book.book_type, book.queue_position, book.book_id)
+                self.deadlines.discard(BOOK, book.book_id)
+            self.cache.invalidate()
+            self.outbox_ready.set()
 
-    async def get_user_action_for_book(self, user_id: int, book_id: int) -> Optional[Dict]:
+        for book in expired_books:
+            print(f"[{datetime.now()}] Удалена книга '{book.title}' (ID: {book.book_id}) за неактивность")
+        return expired_books
+
+    async def get_user_action_for_book(self, user_id: int, book_id: int) -> Optional[Action]:
         """Проверить, выполнял ли пользователь действие для данной книги"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
+        async with self.pool.reader() as db:
             async with db.execute(
-                "SELECT * FROM user_actions WHERE user_id = ? AND book_id = ?",
+                f"""SELECT {Action.select(columns=('action_id', 'book_id', 'user_id', 'status'))}
+                   FROM user_actions WHERE user_id = ? AND book_id = ?""",
                 (user_id, book_id)
             ) as cursor:
-                row = await cursor.fetchone()
-                return dict(row) if row else None
+                cursor.row_factory = Action.from_named_row
+                return await cursor.fetchone()
 
-    async def get_user_confirmed_actions_by_type(self, user_id: int) -> Dict[str, int]:
-        """Получить количество подтвержденных действий пользователя по типам книг"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            db.row_factory = aiosqlite.Row
-            
-            # Подсчитываем подтвержденные действия для платных книг
+    async def get_user_actions_for_books(self, user_id: int, book_ids: List[int]) -> Dict[int, Action]:
+        """Действия пользователя для списка книг одним запросом: book_id -> действие"""
+        if not book_ids:
+            return {}
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT COUNT(*) as count FROM user_actions ua
-                   JOIN books b ON ua.book_id = b.book_id
-                   WHERE ua.user_id = ? 
-                   AND ua.status IN ('confirmed', 'auto_confirmed')
-                   AND b.book_type = 'paid'""",
-                (user_id,)
+                f"""SELECT {Action.select()} FROM user_actions 
+                   WHERE user_id = ? AND book_id IN ({', '.join('?' * len(book_ids))})""",
+                (user_id, *book_ids)
             ) as cursor:
-                paid_row = await cursor.fetchone()
-                paid_count = paid_row['count'] if paid_row else 0
-            
-            # Подсчитываем подтвержденные действия для бесплатных книг
+                cursor.row_factory = Action.from_row
+                actions = await cursor.fetchall()
+                return {action.book_id: action for action in actions}
+
+    async def get_user_confirmed_actions_by_type(self, user_id: int) -> Dict[str, int]:
+        """Получить количество подтвержденных действий пользователя по типам книг.
+
+        Счётчики хранятся в users и не уменьшаются после удаления книг.
+        """
+        async with self.pool.reader() as db:
             async with db.execute(
-                """SELECT COUNT(*) as count FROM user_actions ua
-                   JOIN books b ON ua.book_id = b.book_id
-                   WHERE ua.user_id = ? 
-                   AND ua.status IN ('confirmed', 'auto_confirmed')
-                   AND b.book_type = 'free'""",
+                """SELECT confirmed_paid_actions, confirmed_free_actions
+                   FROM users WHERE telegram_id = ?""",
                 (user_id,)
             ) as cursor:
-                free_row = await cursor.fetchone()
-                free_count = free_row['count'] if free_row else 0
-            
-            return {
-                'paid': paid_count,
-                'free': free_count,
-                'total': paid_count + free_count
-            }
+                row = await cursor.fetchone()
+        paid_count, free_count = (row[0], row[1]) if row else (0, 0)
+        return {
+            'paid': paid_count,
+            'free': free_count,
+            'total': paid_count + free_count
+        }
 
     # ===== СТАТИСТИКА =====
+    async def _record_daily(self, db, event: str, count: int):
+        """Добавить события за текущий день (UTC) в транзакции вызывающего"""
+        await db.execute(
+            """INSERT INTO stats_daily (day, event, count) VALUES (date('now'), ?, ?)
+               ON CONFLICT(day, event) DO UPDATE SET count = count + excluded.count""",
+            (event, count)
+        )
+
     async def get_statistics(self) -> Dict:
-        """Получить общую статистику"""
-        async with aiosqlite.connect(self.db_path, timeout=self.timeout) as db:
-            stats = {}
-            
-            # Всего пользователей
-            async with db.execute("SELECT COUNT(*) FROM users") as cursor:
-                stats['total_users'] = (await cursor.fetchone())[0]
-
-            # Всего книг в очередях
-            async with db.execute(
-                "SELECT COUNT(*) FROM books WHERE status != 'completed'"
-            ) as cursor:
-                stats['total_books'] = (await cursor.fetchone())[0]
+        """Получить общую статистику.
 
-            # Платные книги
+        Счётчики поддерживаются триггерами, поэтому чтение не зависит от
+        размера таблиц: одна выборка счётчиков и одна — событий за STATS_DAYS дней.
+        """
+        async with self.pool.reader() as db:
+            async with db.execute("SELECT name, value FROM stats_counters") as cursor:
+                counters = {row[0]: row[1] for row in await cursor.fetchall()}
             async with db.execute(
-                "SELECT COUNT(*) FROM books WHERE book_type = 'paid' AND status != 'completed'"
+                """SELECT day, event, count FROM stats_daily
+                   WHERE day > date('now', ?) ORDER BY day DESC""",
+                (f"-{config.STATS_DAYS} days",)
             ) as cursor:
-                stats['paid_books'] = (await cursor.fetchone())[0]
+                daily_rows = await cursor.fetchall()
 
-            # Бесплатные книги
+        books = {
+            book_type: {status: counters.get(f"books:{book_type}:{status}", 0) for status in ACTIVE_STATUSES}
+            for book_type in ('paid', 'free')
+        }
+        actions = {status: counters.get(f"actions:{status}", 0) for status in ACTION_STATUSES}
+        daily = {}
+        for day, event, count in daily_rows:
+            daily.setdefault(day, {'completed': 0, 'expired': 0})[event] = count
+
+        return {
+            'total_users': counters.get('users', 0),
+            'total_books': sum(sum(by_status.values()) for by_status in books.values()),
+            'paid_books': sum(books['paid'].values()),
+            'free_books': sum(books['free'].values()),
+            'total_actions': sum(actions.values()),
+            'books': books,
+            'actions': actions,
+            'daily': daily,
+        }
+
+    async def reconcile_statistics(self) -> Dict[str, tuple]:
+        """Пересчитать счётчики по основным таблицам и исправить расхождения.
+
+        Возвращает расхождения: имя счётчика -> (было, стало). События по дням
+        не пересчитываются: удалённые книги в основных таблицах не хранятся.
+        """
+        async with self.pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            async with db.execute(STATS_COUNTERS_QUERY) as cursor:
+                actual = {row[0]: row[1] for row in await cursor.fetchall()}
+            async with db.execute("SELECT name, value FROM stats_counters") as cursor:
+                stored = {row[0]: row[1] for row in await cursor.fetchall()}
+
+            drift = {
+                name: (stored.get(name, 0), actual.get(name, 0))
+                for name in stored.keys() | actual.keys()
+                if stored.get(name, 0) != actual.get(name, 0)
+            }
+            if drift:
+                await db.execute("DELETE FROM stats_counters")
+                await db.executemany(
+                    "INSERT INTO stats_counters (name, value) VALUES (?, ?)", actual.items()
+                )
+            await db.commit()
+        return drift
+
+    # ===== ИСХОДЯЩИЕ УВЕДОМЛЕНИЯ =====
+    async def _enqueue(self, db, chat_id: int, kind: str, payload: Dict, priority: int = NOTIFICATION):
+        """Записать уведомление в outbox в транзакции вызывающего.
+
+        После коммита вызывающий устанавливает outbox_ready.
+        """
+        await db.execute(
+            "INSERT INTO outbox (chat_id, kind, payload, priority) VALUES (?, ?, ?, ?)",
+            (chat_id, kind, json.dumps(payload, ensure_ascii=False), priority)
+        )
+
+    async def _enqueue_digests(self, db, owner_id: Optional[int] = None) -> int:
+        """Записать в outbox сводки новых ожидающих действий владельцам в режиме сводки.
+
+        Выполняется в транзакции вызывающего. В сводку попадает не больше
+        DIGEST_MAX_ACTIONS действий, остальные — в следующую. Возвращает число сводок.
+        """
+        async with db.execute(
+            """SELECT b.user_id AS book_owner_id, ua.action_id, ua.screenshot_file_id,
+                      b.title, b.book_type, u.username
+               FROM users o
+               JOIN books b ON b.user_id = o.telegram_id
+               JOIN user_actions ua ON ua.book_id = b.book_id
+               LEFT JOIN users u ON u.telegram_id = ua.user_id
+               WHERE o.notify_mode = 'digest' AND (? IS NULL OR o.telegram_id = ?)
+               AND ua.status = 'pending' AND ua.action_id > o.last_digest_action_id
+               ORDER BY b.user_id, ua.action_id""",
+            (owner_id, owner_id)
+        ) as cursor:
+            cursor.row_factory = Action.from_named_row
+            rows = await cursor.fetchall()
+
+        digests: Dict[int, List[Dict]] = {}
+        for action in rows:
+            actions = digests.setdefault(action.book_owner_id, [])
+            if len(actions) < config.DIGEST_MAX_ACTIONS:
+                actions.append({'action_id': action.action_id, 'photo': action.screenshot_file_id,
+                                'title': action.title, 'book_type': action.book_type,
+                                'username': action.username})
+        for chat_id, actions in digests.items():
+            await self._enqueue(db, chat_id, 'action_digest', {'actions': actions})
+        await db.executemany(
+            "UPDATE users SET last_digest_action_id = ? WHERE telegram_id = ?",
+            [(actions[-1]['action_id'], chat_id) for chat_id, actions in digests.items()]
+        )
+        return len(digests)
+
+    async def enqueue_action_digests(self) -> int:
+        """Записать сводки действий всем владельцам в режиме сводки; возвращает их число"""
+        async with self.pool.writer() as db:
+            await db.execute("BEGIN IMMEDIATE")
+            digests = await self._enqueue_digests(db)
+            await db.commit()
+        if digests:
+            self.outbox_ready.set()
+        return digests
+
+    async def claim_outbox(self, limit: int, lease_seconds: float,
+                           now: Optional[float] = None) -> List[OutboxMessage]:
+        """Забрать до limit уведомлений, которым пора отправляться.
+
+        Забранные строки откладываются на lease_seconds и получают ещё одну
+        попытку: если процесс упадёт до finish_outbox, уведомление будет
+        отправлено повторно, а другой процесс не заберёт его одновременно.
+        """
+        now = time.time() if now is None else now
+        async with self.pool.writer() as db:
             async with db.execute(
-                "SELECT COUNT(*) FROM books WHERE book_type = 'free' AND status != 'completed'"
+                f"""UPDATE outbox
+                   SET next_attempt_at = ?, attempts = attempts + 1
+                   WHERE outbox_id IN (SELECT outbox_id FROM outbox
+                                       WHERE status = 'pending' AND next_attempt_at <= ?
+                                       ORDER BY priority, outbox_id
+                                       LIMIT ?)
+                   RETURNING {OutboxMessage.select(columns=CLAIM_COLUMNS)}""",
+                (now + lease_seconds, now, limit)
             ) as cursor:
-                stats['free_books'] = (await cursor.fetchone())[0]
+                cursor.row_factory = OutboxMessage.from_named_row
+                rows = await cursor.fetchall()
+            await db.commit()
+        for row in rows:
+            row.payload = json.loads(row.payload)
+        rows.sort(key=lambda row: (row.priority, row.outbox_id))
+        return rows
+
+    async def finish_outbox(self, sent: List[int], retry: List[tuple] = (), failed: List[tuple] = ()):
+        """Отметить результат доставки одной транзакцией.
+
+        sent — отправленные outbox_id; retry — (outbox_id, next_attempt_at, ошибка);
+        failed — (outbox_id, ошибка) для уведомлений, которые больше не отправляются.
+        """
+        async with self.pool.writer() as db:
+            await db.executemany(
+                "UPDATE outbox SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE outbox_id = ?",
+                [(outbox_id,) for outbox_id in sent]
+            )
+            await db.executemany(
+                "UPDATE outbox SET next_attempt_at = ?, last_error = ? WHERE outbox_id = ?",
+                [(next_attempt_at, error, outbox_id) for outbox_id, next_attempt_at, error in retry]
+            )
+            await db.executemany(
+                "UPDATE outbox SET status = 'failed', last_error = ? WHERE outbox_id = ?",
+                [(error, outbox_id) for outbox_id, error in failed]
+            )
+            await db.commit()
+
+    async def purge_outbox(self, days: int = config.OUTBOX_RETENTION_DAYS) -> int:
+        """Удалить отправленные и неотправляемые уведомления старше days дней"""
+        async with self.pool.writer() as db:
+            cursor = await db.execute(
+                "DELETE FROM outbox WHERE status != 'pending' AND created_at < datetime('now', ?)",
+                (f"-{days} days",)
+            )
+            await db.commit()
+            return cursor.rowcount
 
-            # Всего действий
-            async with db.execute("SELECT COUNT(*) FROM user_actions") as cursor:
-                stats['total_actions'] = (await cursor.fetchone())[0]
 
-            return stats
+# Общий экземпляр базы данных для обработчиков и планировщика
+db = Database()
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import aiosqlite
+
+import config
+
+
+# Счётчик выдач соединений текущей задачи (см. track_checkouts)
+_checkout_counter: ContextVar[Optional[Dict[str, int]]] = ContextVar('checkout_counter', default=None)
+
+
+@contextmanager
+def track_checkouts() -> Iterator[Dict[str, int]]:
+    """Считать соединения, выданные пулом внутри блока (в этой задаче и запущенных из неё)"""
+    counter = {'reader': 0, 'writer': 0}
+    token = _checkout_counter.set(counter)
+    try:
+        yield counter
+    finally:
+        _checkout_counter.reset(token)
+
+
+class PoolMetrics:
+    """Счётчики ожидания и выдачи соединений из пула"""
+
+    def __init__(self):
+        self.checkouts = {'reader': 0, 'writer': 0}
+        self.wait_total = {'reader': 0.0, 'writer': 0.0}
+        self.wait_max = {'reader': 0.0, 'writer': 0.0}
+        self.in_use = {'reader': 0, 'writer': 0}
+        self.waiting = {'reader': 0, 'writer': 0}
+
+    def record_checkout(self, kind: str, waited: float):
+        self.checkouts[kind] += 1
+        counter = _checkout_counter.get()
+        if counter is not None:
+            counter[kind] += 1
+        self.wait_total[kind] += waited
+        if waited > self.wait_max[kind]:
+            self.wait_max[kind] = waited
+
+    def snapshot(self) -> Dict:
+        """Текущие значения метрик"""
+        result = {}
+        for kind in ('reader', 'writer'):
+            checkouts = self.checkouts[kind]
+            result[kind] = {
+                'checkouts': checkouts,
+                'in_use': self.in_use[kind],
+                'waiting': self.waiting[kind],
+                'wait_total_ms': round(self.wait_total[kind] * 1000, 3),
+                'wait_avg_ms': round(self.wait_total[kind] * 1000 / checkouts, 3) if checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max[kind] * 1000, 3),
+            }
+        return result
+
+
+class ConnectionPool:
+    """Пул соединений SQLite: одно соединение для записи и несколько только для чтения.
+
+    WAL позволяет читателям работать параллельно с писателем, поэтому запросы
+    на чтение распределяются между читателями, а все изменения проходят
+    последовательно через единственное соединение писателя.
+    """
+
+    def __init__(self, db_path: str, readers: int = config.DB_POOL_READERS,
+                 timeout: float = config.DB_BUSY_TIMEOUT_MS / 1000):
+        self.db_path = db_path
+        self.readers_count = max(1, readers)
+        self.timeout = timeout
+        self.metrics = PoolMetrics()
+        self._writer = None
+        self._writer_lock = asyncio.Lock()
+        self._readers: asyncio.Queue = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._open_lock = asyncio.Lock()
+        self._opened = False
+
+    async def _configure(self, conn: aiosqlite.Connection):
+        """Применить PRAGMA к новому соединению"""
+        await conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        await conn.execute("PRAGMA synchronous=NORMAL")
+        await conn.execute(f"PRAGMA cache_size=-{config.DB_CACHE_SIZE_KB}")
+        await conn.execute(f"PRAGMA mmap_size={config.DB_MMAP_SIZE}")
+
+    async def open(self):
+        """Открыть соединения пула (повторный вызов ничего не делает)"""
+        if self._opened:
+            return
+        async with self._open_lock:
+            if self._opened:
+                return
+
+            # Писатель создаёт файл БД и включает WAL до открытия читателей
+            self._writer = await aiosqlite.connect(self.db_path, timeout=self.timeout)
+            await self._writer.execute("PRAGMA journal_mode=WAL")
+            await self._configure(self._writer)
+
+            reader_uri = Path(self.db_path).absolute().as_uri() + "?mode=ro"
+            for _ in range(self.readers_count):
+                conn = await aiosqlite.connect(reader_uri, uri=True, timeout=self.timeout)
+                await self._configure(conn)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+
+            self._opened = True
+
+    async def close(self):
+        """Закрыть все соединения пула"""
+        async with self._open_lock:
+            if not self._opened:
+                return
+            for conn in self._all_readers:
+                await conn.close()
+            self._all_readers.clear()
+            self._readers = asyncio.Queue()
+            await self._writer.close()
+            self._writer = None
+            self._opened = False
+
+    @property
+    def writer_busy(self) -> bool:
+        """Соединение писателя сейчас занято"""
+        return self._writer_lock.locked()
+
+    def connections(self) -> List[aiosqlite.Connection]:
+        """Все открытые соединения пула (писатель первым)"""
+        if not self._opened:
+            return []
+        return [self._writer] + list(self._all_readers)
+
+    @asynccontextmanager
+    async def reader(self):
+        """Взять соединение только для чтения"""
+        await self.open()
+        started = time.perf_counter()
+        self.metrics.waiting['reader'] += 1
+        try:
+            conn = await self._readers.get()
+        finally:
+            self.metrics.waiting['reader'] -= 1
+        self.metrics.record_checkout('reader', time.perf_counter() - started)
+        self.metrics.in_use['reader'] += 1
+        try:
+            yield conn
+        finally:
+            self.metrics.in_use['reader'] -= 1
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Взять единственное соединение для записи (запись выполняется последовательно)"""
+        await self.open()
+        started = time.perf_counter()
+        self.metrics.waiting['writer'] += 1
+        try:
+            await self._writer_lock.acquire()
+        finally:
+            self.metrics.waiting['writer'] -= 1
+        self.metrics.record_checkout('writer', time.perf_counter() - started)
+        self.metrics.in_use['writer'] += 1
+        try:
+            yield self._writer
+        finally:
+            # Незавершённая транзакция (ошибка или выход без commit) откатывается,
+            # чтобы не достаться следующему владельцу соединения
+            try:
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+            finally:
+                self.metrics.in_use['writer'] -= 1
+                self._writer_lock.release()
+
+    def get_metrics(self) -> Dict:
+        """Метрики пула: число выдач, ожидание, занятые соединения"""
+        return self.metrics.snapshot()
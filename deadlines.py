@@ -0,0 +1,131 @@
+"""
+Сроки автоподтверждения действий и истечения показа книг
+
+Вместо периодического сканирования таблиц хранится куча ближайших сроков:
+created_at + AUTO_CONFIRM_HOURS для каждого ожидающего действия и
+recommendations_started_at + BOOK_EXPIRATION_DAYS для каждой платной книги
+в рекомендациях. Куча загружается индексными запросами при запуске и
+обновляется методами Database при создании и удалении действий и книг.
+DeadlineScheduler (scheduler.py) спит до ближайшего срока и обрабатывает
+все наступившие сроки одной пачкой. Куча только будит планировщик: что
+именно просрочено, решают запросы к БД, поэтому лишний или устаревший
+срок безопасен.
+
+Все времена — наивные UTC, как CURRENT_TIMESTAMP в SQLite.
+"""
+import asyncio
+import heapq
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import config
+
+ACTION = 'action'
+BOOK = 'book'
+
+
+def utc_now() -> datetime:
+    """Текущее время UTC без часового пояса (формат CURRENT_TIMESTAMP)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_timestamp(value) -> datetime:
+    """Значение CURRENT_TIMESTAMP из SQLite"""
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+
+class SystemClock:
+    """Часы планировщика; в тестах подменяются часами с ручной перемоткой"""
+
+    def now(self) -> datetime:
+        return utc_now()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+
+class DeadlineIndex:
+    """Куча сроков с ленивым удалением: отменённые записи пропускаются при извлечении"""
+
+    def __init__(self):
+        self._heap: List[Tuple[datetime, str, int]] = []
+        self._entries: Dict[Tuple[str, int], datetime] = {}
+        # Будит планировщик, если появился срок раньше текущего ближайшего
+        self.changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._heap.clear()
+        self._entries.clear()
+        self.changed.set()
+
+    async def load(self, db):
+        """Заполнить кучу из БД (частичный индекс ожидающих действий и индекс статусов книг)"""
+        self._heap.clear()
+        self._entries.clear()
+        async with db.execute(
+            "SELECT action_id, created_at FROM user_actions WHERE status = 'pending'"
+        ) as cursor:
+            for action_id, created_at in await cursor.fetchall():
+                self._entries[(ACTION, action_id)] = action_deadline(created_at)
+        async with db.execute(
+            """SELECT book_id, recommendations_started_at FROM books
+               WHERE book_type = 'paid' AND status = 'in_recommendations'
+               AND recommendations_started_at IS NOT NULL"""
+        ) as cursor:
+            for book_id, started_at in await cursor.fetchall():
+                self._entries[(BOOK, book_id)] = book_deadline(started_at)
+        self._heap = [(deadline, kind, item_id) for (kind, item_id), deadline in self._entries.items()]
+        heapq.heapify(self._heap)
+        self.changed.set()
+
+    def set(self, kind: str, item_id: int, deadline: datetime):
+        current = self.next_deadline()
+        self._entries[(kind, item_id)] = deadline
+        heapq.heappush(self._heap, (deadline, kind, item_id))
+        if current is None or deadline < current:
+            self.changed.set()
+
+    def restore(self, kind: str, item_ids: List[int], deadline: datetime):
+        """Вернуть извлечённые сроки, обработка которых не удалась.
+
+        Срок, заданный заново за время обработки, не заменяется.
+        """
+        for item_id in item_ids:
+            if (kind, item_id) not in self._entries:
+                self.set(kind, item_id, deadline)
+
+    def discard(self, kind: str, item_id: int):
+        self._entries.pop((kind, item_id), None)
+
+    def _prune(self):
+        while self._heap:
+            deadline, kind, item_id = self._heap[0]
+            if self._entries.get((kind, item_id)) == deadline:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self) -> Optional[datetime]:
+        self._prune()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime) -> Dict[str, List[int]]:
+        """Извлечь все наступившие сроки, сгруппированные по виду"""
+        due = {ACTION: [], BOOK: []}
+        while True:
+            self._prune()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            _, kind, item_id = heapq.heappop(self._heap)
+            del self._entries[(kind, item_id)]
+            due[kind].append(item_id)
+
+
+def action_deadline(created_at) -> datetime:
+    return parse_timestamp(created_at) + timedelta(hours=config.AUTO_CONFIRM_HOURS)
+
+
+def book_deadline(started_at) -> datetime:
+    return parse_timestamp(started_at) + timedelta(days=config.BOOK_EXPIRATION_DAYS)
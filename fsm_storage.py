@@ -0,0 +1,252 @@
+"""Хранилище состояний FSM в SQLite, сохраняющее сценарии между перезапусками бота"""
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from itertools import islice
+from typing import Any, Dict, Optional
+
+import aiosqlite
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class FSMRecord:
+    """Состояние и данные FSM одного пользователя в чате"""
+
+    __slots__ = ('state', 'data', 'touched_at')
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None,
+                 touched_at: float = 0.0):
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched_at = touched_at
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище FSM в отдельном файле SQLite с кэшем в памяти.
+
+    Чтения обслуживаются из LRU-кэша, изменения копятся в памяти и раз в
+    flush_interval записываются одной транзакцией: несколько шагов сценария
+    одного пользователя между сбросами превращаются в одну запись строки.
+    Сценарии, не менявшиеся дольше state_ttl, считаются брошенными и удаляются.
+    Данные состояния хранятся в JSON, поэтому должны быть сериализуемы.
+
+    Кэш локален для процесса: при нескольких процессах обновления одного
+    пользователя должны попадать в один и тот же процесс.
+    """
+
+    def __init__(self, db_path: str = config.FSM_DATABASE_PATH,
+                 cache_size: int = config.FSM_CACHE_SIZE,
+                 flush_interval: float = config.FSM_FLUSH_INTERVAL_SECONDS,
+                 state_ttl: float = config.FSM_STATE_TTL_HOURS * 3600,
+                 sweep_interval: float = config.FSM_SWEEP_INTERVAL_SECONDS,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.db_path = db_path
+        self.cache_size = max(1, cache_size)
+        self.flush_interval = flush_interval
+        self.state_ttl = state_ttl
+        self.sweep_interval = sweep_interval
+        self.key_builder = key_builder or DefaultKeyBuilder()
+        self._records: 'OrderedDict[str, FSMRecord]' = OrderedDict()
+        self._dirty = set()
+        self._conn: Optional[aiosqlite.Connection] = None
+        self._open_lock = asyncio.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._swept_at = time.monotonic()
+        self.metrics = {
+            'hits': 0, 'misses': 0, 'writes': 0, 'flushes': 0,
+            'rows_written': 0, 'evicted': 0, 'expired': 0
+        }
+
+    # ===== Соединение =====
+
+    async def open(self):
+        """Открыть файл хранилища и запустить фоновую запись (повторный вызов ничего не делает)"""
+        if self._conn is not None:
+            return
+        async with self._open_lock:
+            if self._conn is not None:
+                return
+            conn = await aiosqlite.connect(self.db_path, timeout=config.DB_BUSY_TIMEOUT_MS / 1000)
+            await conn.execute("PRAGMA journal_mode=WAL")
+            await conn.execute("PRAGMA synchronous=NORMAL")
+            await conn.execute(f"PRAGMA busy_timeout={config.DB_BUSY_TIMEOUT_MS}")
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS fsm_states (
+                    key TEXT PRIMARY KEY,
+                    state TEXT,
+                    data TEXT NOT NULL DEFAULT '{}',
+                    updated_at REAL NOT NULL
+                )
+            """)
+            await conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states(updated_at)"
+            )
+            await conn.commit()
+            self._conn = conn
+            if self.flush_interval is not None:
+                self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Записать несохранённые изменения и закрыть файл"""
+        if self._flush_task:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._conn is None:
+            return
+        await self.flush()
+        await self._conn.close()
+        self._conn = None
+
+    # ===== Интерфейс BaseStorage =====
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    # ===== Кэш =====
+
+    def _expired(self, record: FSMRecord, now: float) -> bool:
+        return not record.empty and now - record.touched_at > self.state_ttl
+
+    async def _record(self, key: StorageKey) -> FSMRecord:
+        """Запись пользователя из кэша или из файла"""
+        name = self.key_builder.build(key)
+        now = time.time()
+        record = self._records.get(name)
+        if record is None:
+            self.metrics['misses'] += 1
+            await self.open()
+            async with self._conn.execute(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (name,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            # Пока шло чтение, запись могла появиться в кэше — она новее
+            record = self._records.get(name)
+            if record is None:
+                record = FSMRecord(row[0], json.loads(row[1]), row[2]) if row else FSMRecord(touched_at=now)
+                self._records[name] = record
+                self._evict()
+        else:
+            self.metrics['hits'] += 1
+            self._records.move_to_end(name)
+
+        if self._expired(record, now):
+            # Брошенный сценарий начинается заново
+            record.state, record.data = None, {}
+            self._dirty.add(name)
+            self.metrics['expired'] += 1
+        return record
+
+    def _touch(self, key: StorageKey, record: FSMRecord):
+        name = self.key_builder.build(key)
+        record.touched_at = time.time()
+        # Запись могла быть вытеснена между чтением и изменением
+        self._records[name] = record
+        self._dirty.add(name)
+        self.metrics['writes'] += 1
+
+    def _evict(self):
+        """Вытеснить самые давние записи сверх размера кэша (несохранённые остаются)"""
+        excess = len(self._records) - self.cache_size
+        if excess <= 0:
+            return
+        candidates = [
+            name for name in islice(self._records, excess + len(self._dirty))
+            if name not in self._dirty
+        ]
+        for name in candidates[:excess]:
+            del self._records[name]
+        self.metrics['evicted'] += min(excess, len(candidates))
+
+    # ===== Запись в файл =====
+
+    async def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        async with self._flush_lock:
+            if not self._dirty or self._conn is None:
+                return
+            names, self._dirty = self._dirty, set()
+            upserts, deletes = [], []
+            for name in names:
+                record = self._records[name]
+                if record.empty:
+                    deletes.append((name,))
+                else:
+                    upserts.append((name, record.state, json.dumps(record.data, ensure_ascii=False),
+                                    record.touched_at))
+            try:
+                await self._conn.executemany(
+                    """INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(key) DO UPDATE SET
+                           state = excluded.state, data = excluded.data, updated_at = excluded.updated_at""",
+                    upserts
+                )
+                await self._conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+                await self._conn.commit()
+            except Exception:
+                # Повторим при следующем сбросе
+                self._dirty |= names
+                raise
+            self.metrics['flushes'] += 1
+            self.metrics['rows_written'] += len(names)
+        self._evict()
+
+    async def sweep(self) -> int:
+        """Удалить брошенные сценарии из файла и из кэша; возвращает число удалённых строк"""
+        await self.open()
+        cutoff = time.time() - self.state_ttl
+        async with self._flush_lock:
+            cursor = await self._conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,))
+            await self._conn.commit()
+        stale = [
+            name for name, record in self._records.items()
+            if name not in self._dirty and (record.empty or record.touched_at < cutoff)
+        ]
+        for name in stale:
+            del self._records[name]
+        self._swept_at = time.monotonic()
+        return cursor.rowcount
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - self._swept_at >= self.sweep_interval:
+                    removed = await self.sweep()
+                    if removed:
+                        logger.info(f"Removed {removed} abandoned FSM state(s)")
+            except Exception as e:
+                logger.error(f"Error flushing FSM states: {e}")
+
+    def get_metrics(self) -> Dict:
+        """Счётчики кэша и фоновой записи"""
+        return {**self.metrics, 'cached': len(self._records), 'dirty': len(self._dirty)}
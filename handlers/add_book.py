@@ -4,12 +4,12 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
 from database import Database
+from user_context import UserContext
 from keyboards import (get_main_menu, get_book_type_keyboard, get_cancel_keyboard,
                       get_admin_book_keyboard)
 import config
 
 router = Router()
-db = Database()
 
 
 class AddBookStates(StatesGroup):
@@ -20,19 +20,19 @@ class AddBookStates(StatesGroup):
 
 
 @router.message(F.text == "➕ Добавить свою книгу")
-async def add_book_start(message: Message, state: FSMContext):
+async def add_book_start(message: Message, state: FSMContext, user_context: UserContext):
     """Начало процесса добавления книги"""
-    # Проверяем, какие книги уже есть у пользователя
-    user_books = await db.get_user_books(message.from_user.id)
+    # Книги и действия пользователя загружаются одним запросом
+    await user_context.load()
+    paid_book = user_context.book('paid')
+    free_book = user_context.book('free')
     
     # Проверяем книги по типам
-    has_paid_book = any(book['book_type'] == 'paid' for book in user_books)
-    has_free_book = any(book['book_type'] == 'free' for book in user_books)
+    has_paid_book = paid_book is not None
+    has_free_book = free_book is not None
     
     # Если у пользователя уже есть книги в обоих разделах
     if has_paid_book and has_free_book:
-        paid_book = next((book for book in user_books if book['book_type'] == 'paid'), None)
-        free_book = next((book for book in user_books if book['book_type'] == 'free'), None)
         
         status_map = {
             'in_queue': 'В очереди',
@@ -42,21 +42,18 @@ async def add_book_start(message: Message, state: FSMContext):
         
         await message.answer(
             f"❌ У вас уже есть активные книги в обоих разделах!\n\n"
-            f"📘 <b>Платная:</b> {paid_book['title']}\n"
-            f"Статус: {status_map.get(paid_book['status'], paid_book['status'])}\n"
-            f"Позиция: {paid_book['queue_position']}\n\n"
-            f"🆓 <b>Бесплатная:</b> {free_book['title']}\n"
-            f"Статус: {status_map.get(free_book['status'], free_book['status'])}\n"
-            f"Позиция: {free_book['queue_position']}\n\n"
+            f"📘 <b>Платная:</b> {paid_book.title}\n"
+            f"Статус: {status_map.get(paid_book.status, paid_book.status)}\n"
+            f"Позиция: {paid_book.position}\n\n"
+            f"🆓 <b>Бесплатная:</b> {free_book.title}\n"
+            f"Статус: {status_map.get(free_book.status, free_book.status)}\n"
+            f"Позиция: {free_book.position}\n\n"
             f"Дождитесь завершения продвижения одной из книг, чтобы добавить новую.",
             parse_mode="HTML",
             reply_markup=get_main_menu()
         )
         return
     
-    # Проверяем лимит действий пользователя
-    user = await db.get_user(message.from_user.id)
-    
     # Админ может добавлять книги без ограничений
     if message.from_user.id == config.ADMIN_ID:
         await message.answer(
@@ -68,8 +65,8 @@ async def add_book_start(message: Message, state: FSMContext):
             reply_markup=get_admin_book_keyboard()
         )
     else:
-        # Получаем подтвержденные действия по типам книг
-        actions_by_type = await db.get_user_confirmed_actions_by_type(message.from_user.id)
+        # Подтвержденные действия по типам книг
+        actions_by_type = user_context.helper_counts
         
         # Обычный пользователь должен помочь другим авторам
         if actions_by_type['total'] > 0:
@@ -88,16 +85,14 @@ async def add_book_start(message: Message, state: FSMContext):
                 
                 existing_books_info = []
                 if has_paid_book:
-                    paid_book = next((book for book in user_books if book['book_type'] == 'paid'), None)
                     existing_books_info.append(
-                        f"📘 <b>Платная:</b> {paid_book['title']}\n"
-                        f"Статус: {status_map.get(paid_book['status'], paid_book['status'])}"
+                        f"📘 <b>Платная:</b> {paid_book.title}\n"
+                        f"Статус: {status_map.get(paid_book.status, paid_book.status)}"
                     )
                 if has_free_book:
-                    free_book = next((book for book in user_books if book['book_type'] == 'free'), None)
                     existing_books_info.append(
-                        f"🆓 <b>Бесплатная:</b> {free_book['title']}\n"
-                        f"Статус: {status_map.get(free_book['status'], free_book['status'])}"
+                        f"🆓 <b>Бесплатная:</b> {free_book.title}\n"
+                        f"Статус: {status_map.get(free_book.status, free_book.status)}"
                     )
                 
                 books_text = "\n\n".join(existing_books_info)
@@ -125,11 +120,9 @@ async def add_book_start(message: Message, state: FSMContext):
             if has_paid_book or has_free_book:
                 existing_info = "\n\n<b>Ваши книги в системе:</b>\n"
                 if has_paid_book:
-                    paid_book = next((book for book in user_books if book['book_type'] == 'paid'), None)
-                    existing_info += f"📘 Платная: {paid_book['title']}\n"
+                    existing_info += f"📘 Платная: {paid_book.title}\n"
                 if has_free_book:
-                    free_book = next((book for book in user_books if book['book_type'] == 'free'), None)
-                    existing_info += f"🆓 Бесплатная: {free_book['title']}\n"
+                    existing_info += f"🆓 Бесплатная: {free_book.title}\n"
             
             await message.answer(
                 "➕ <b>Добавление новой книги</b>\n\n"
@@ -237,7 +230,7 @@ async def book_title_received(message: Message, state: FSMContext):
 
 
 @router.message(AddBookStates.waiting_for_link)
-async def book_link_received(message: Message, state: FSMContext):
+async def book_link_received(message: Message, state: FSMContext, db: Database):
     """Получение ссылки на книгу"""
     link = message.text.strip()
     
@@ -263,10 +256,10 @@ async def book_link_received(message: Message, state: FSMContext):
         await state.set_state(AddBookStates.waiting_for_price)
     else:
         # Для бесплатных книг цена = 0
-        await finalize_book_addition(message, state, 0)
+        await finalize_book_addition(message, state, db, 0)
 
 
-async def finalize_book_addition(message: Message, state: FSMContext, price: float):
+async def finalize_book_addition(message: Message, state: FSMContext, db: Database, price: float):
     """Завершение добавления книги"""
     data = await state.get_data()
     title = data.get('title')
@@ -298,7 +291,7 @@ async def finalize_book_addition(message: Message, state: FSMContext, price: flo
         f"💰 {price_text}\n"
         f"🔗 {link}\n\n"
         f"Статус: <b>в очереди</b>\n"
-        f"Позиция: <b>{book['queue_position']}</b>\n"
+        f"Позиция: <b>{book.position}</b>\n"
         f"Тип: {type_name}{admin_note}\n\n"
         f"Ваша книга будет показана в рекомендациях, когда дойдёт очередь. "
         f"Продолжайте помогать другим авторам, чтобы быстрее продвинуться!",
@@ -310,7 +303,7 @@ async def finalize_book_addition(message: Message, state: FSMContext, price: flo
 
 
 @router.message(AddBookStates.waiting_for_price)
-async def book_price_received(message: Message, state: FSMContext):
+async def book_price_received(message: Message, state: FSMContext, db: Database):
     """Получение цены книги"""
     try:
         price = float(message.text.strip().replace(',', '.'))
@@ -325,7 +318,7 @@ async def book_price_received(message: Message, state: FSMContext):
         await message.answer("❌ Цена не может быть отрицательной")
         return
     
-    await finalize_book_addition(message, state, price)
+    await finalize_book_addition(message, state, db, price)
 
 
 @router.callback_query(F.data == "cancel")
@@ -1,4 +1,4 @@
-from aiogram import Router
+from aiogram import F, Router
 from aiogram.filters import CommandStart, Command
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
@@ -8,11 +8,10 @@ from keyboards import get_main_menu
 import config
 
 router = Router()
-db = Database()
 
 
 @router.message(CommandStart())
-async def cmd_start(message: Message, state: FSMContext):
+async def cmd_start(message: Message, state: FSMContext, db: Database):
     """Обработчик команды /start"""
     await state.clear()
     
@@ -81,3 +80,33 @@ async def feedback_handler(message: Message):
     )
     
     await message.answer(text, parse_mode="HTML")
+
+
+@router.message(Command("stats"), F.from_user.id == config.ADMIN_ID)
+async def cmd_stats(message: Message, db: Database):
+    """Статистика для администратора (счётчики, без подсчёта по таблицам)"""
+    stats = await db.get_statistics()
+    books, actions = stats['books'], stats['actions']
+    lines = [
+        "📈 <b>Статистика</b>\n",
+        f"👥 Пользователей: {stats['total_users']}\n",
+        f"📚 Книг в продвижении: {stats['total_books']}",
+    ]
+    for book_type, label in (('paid', "📘 Платные"), ('free', "🆓 Бесплатные")):
+        lines.append(
+            f"{label}: {books[book_type]['in_recommendations']} в рекомендациях, "
+            f"{books[book_type]['in_queue']} в очереди"
+        )
+    lines += [
+        f"\n✍️ Действий: {stats['total_actions']}",
+        f"⏳ Ожидают: {actions['pending']}",
+        f"✅ Подтверждены: {actions['confirmed']} (автоматически: {actions['auto_confirmed']})",
+        f"❌ Отклонены: {actions['rejected']}",
+        f"\n📅 <b>За {config.STATS_DAYS} дн.</b> (завершено / истекло)",
+    ]
+    if stats['daily']:
+        lines += [f"{day}: {events['completed']} / {events['expired']}" for day, events in stats['daily'].items()]
+    else:
+        lines.append("Нет событий")
+
+    await message.answer("\n".join(lines), parse_mode="HTML")
@@ -3,15 +3,14 @@ from aiogram.types import CallbackQuery
 import logging
 
 from database import Database
-from keyboards import get_main_menu
+from keyboards import get_main_menu, remove_action_buttons
 
 router = Router()
-db = Database()
 logger = logging.getLogger(__name__)
 
 
 @router.callback_query(F.data.startswith("confirm_action:"))
-async def confirm_user_action(callback: CallbackQuery):
+async def confirm_user_action(callback: CallbackQuery, db: Database):
     """Подтверждение или отклонение действия владельцем книги"""
     logger.info(f"=== CONFIRM ACTION HANDLER CALLED ===")
     logger.info(f"Callback data: {callback.data}")
@@ -30,61 +29,47 @@ async def confirm_user_action(callback: CallbackQuery):
     except ValueError as e:
         logger.error(f"Error parsing callback data: {e}")
         return
+    if status not in ('confirmed', 'rejected'):
+        logger.error(f"Unexpected action status in callback data: {status}")
+        return
     
-    # Получаем информацию о действии
-    action = await db.get_action_by_id(action_id)
+    # Проверка статуса и владельца, счётчики, завершение книги и уведомление
+    # пользователю в outbox — одна транзакция. Повторное нажатие или повторная
+    # доставка callback ничего не меняют
+    logger.info(f"Confirming action {action_id} with status {status}")
+    action = await db.confirm_action(action_id, status, owner_id=callback.from_user.id)
     logger.info(f"Action data: {action}")
     
     if not action:
-        logger.warning(f"Action {action_id} not found")
-        try:
-            await callback.message.answer("❌ Действие не найдено")
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-        return
-    
-    # Проверяем, что подтверждает владелец книги
-    if action['book_owner_id'] != callback.from_user.id:
-        logger.warning(f"User {callback.from_user.id} is not book owner {action['book_owner_id']}")
+        # Причину отказа выясняем только на редком пути
+        existing = await db.get_action_by_id(action_id)
+        if not existing:
+            logger.warning(f"Action {action_id} not found")
+            reply = "❌ Действие не найдено"
+        elif existing.book_owner_id != callback.from_user.id:
+            logger.warning(f"User {callback.from_user.id} is not book owner {existing.book_owner_id}")
+            reply = "❌ Вы не можете подтверждать действия для этой книги"
+        else:
+            logger.info(f"Action {action_id} already processed with status {existing.status}")
+            reply = "ℹ️ Это действие уже обработано"
         try:
-            await callback.message.answer("❌ Вы не можете подтверждать действия для этой книги")
+            await callback.message.answer(reply)
         except Exception as e:
             logger.error(f"Error sending message: {e}")
         return
     
-    # Проверяем, не подтверждено ли уже
-    if action['status'] != 'pending':
-        logger.info(f"Action {action_id} already processed with status {action['status']}")
-        try:
-            await callback.message.answer("ℹ️ Это действие уже обработано")
-        except Exception as e:
-            logger.error(f"Error sending message: {e}")
-        return
-    
-    # Подтверждаем или отклоняем действие
-    logger.info(f"Confirming action {action_id} with status {status}")
-    await db.confirm_action(action_id, status)
+    completed_book = action.completed_book
     
     if status == 'confirmed':
         response_text = "✅ Вы подтвердили действие пользователя!"
-        user_notification = (
-            f"✅ <b>Ваше действие подтверждено!</b>\n\n"
-            f"📚 Книга: {action['title']}\n"
-            f"👤 Автор: @{callback.from_user.username or 'Аноним'}\n\n"
-            f"Лимит продвижения вашей книги увеличен! 🎉"
-        )
     else:
         response_text = "❌ Вы отклонили действие пользователя"
-        user_notification = (
-            f"❌ <b>Ваше действие отклонено</b>\n\n"
-            f"📚 Книга: {action['title']}\n"
-            f"👤 Автор: @{callback.from_user.username or 'Аноним'}\n\n"
-            f"Автор не подтвердил ваше действие."
-        )
     
-    # Удаляем кнопки из сообщения первым делом
+    # Удаляем кнопки действия первым делом (в сводке остаются кнопки других действий)
     try:
-        await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.message.edit_reply_markup(
+            reply_markup=remove_action_buttons(callback.message.reply_markup, action_id)
+        )
         logger.info("Removed inline keyboard")
     except Exception as e:
         logger.error(f"Error removing keyboard: {e}")
@@ -96,32 +81,68 @@ async def confirm_user_action(callback: CallbackQuery):
     except Exception as e:
         logger.error(f"Error sending confirmation: {e}")
     
-    # Отправляем уведомление пользователю
+    logger.info(f"Book completed: {completed_book is not None}")
+    
+    if completed_book:
+        # Уведомляем владельца о завершении
+        try:
+            await callback.message.answer(
+                "🎉 <b>Поздравляем!</b>\n\n"
+                f"Ваша книга '{action.title}' набрала необходимое количество действий "
+                f"и завершила продвижение! Теперь вы можете добавить новую книгу.",
+                parse_mode="HTML",
+                reply_markup=get_main_menu()
+            )
+            logger.info("Sent book completion message")
+        except Exception as e:
+            logger.error(f"Error sending completion message: {e}")
+
+
+@router.callback_query(F.data.startswith("confirm_all:"))
+async def confirm_all_actions(callback: CallbackQuery, db: Database):
+    """Подтверждение всех ожидающих действий из сводки одной транзакцией"""
+    try:
+        await callback.answer("Обрабатываю...")
+    except Exception as e:
+        logger.error(f"Error answering callback: {e}")
+    
     try:
-        from main import bot
-        await bot.send_message(
-            action['user_id'],
-            user_notification,
-            parse_mode="HTML"
-        )
-        logger.info(f"Sent notification to user {action['user_id']}")
+        last_action_id = int(callback.data.split(":")[1])
+    except (IndexError, ValueError) as e:
+        logger.error(f"Error parsing callback data: {e}")
+        return
+    
+    # Действия владельца до последнего в сводке; уже обработанные пропускаются
+    owner_id = callback.from_user.id
+    pending = await db.get_pending_actions(owner_id=owner_id)
+    action_ids = [action.action_id for action in pending if action.action_id <= last_action_id]
+    confirmed = await db.confirm_actions(action_ids, owner_id=owner_id)
+    logger.info(f"Owner {owner_id} confirmed {len(confirmed)} action(s) from digest")
+    
+    try:
+        await callback.message.edit_reply_markup(reply_markup=None)
     except Exception as e:
-        logger.error(f"Error sending user notification: {e}")
+        logger.error(f"Error removing keyboard: {e}")
     
-    # Проверяем, не завершена ли книга
-    book_completed = await db.check_book_completion(action['book_id'])
-    logger.info(f"Book completion check: {book_completed}")
+    if confirmed:
+        reply = f"✅ Вы подтвердили действий: {len(confirmed)}"
+    else:
+        reply = "ℹ️ Все действия из сводки уже обработаны"
+    try:
+        await callback.message.answer(reply)
+    except Exception as e:
+        logger.error(f"Error sending confirmation: {e}")
     
-    if book_completed and status == 'confirmed':
-        # Уведомляем владельца о завершении
+    # Завершённые книги (каждая один раз)
+    completed = {action.book_id: action.title for action in confirmed if action.book_completed}
+    for title in completed.values():
         try:
             await callback.message.answer(
                 "🎉 <b>Поздравляем!</b>\n\n"
-                f"Ваша книга '{action['title']}' набрала необходимое количество действий "
+                f"Ваша книга '{title}' набрала необходимое количество действий "
                 f"и завершила продвижение! Теперь вы можете добавить новую книгу.",
                 parse_mode="HTML",
                 reply_markup=get_main_menu()
             )
-            logger.info("Sent book completion message")
         except Exception as e:
             logger.error(f"Error sending completion message: {e}")
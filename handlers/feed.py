@@ -0,0 +1,146 @@
+"""
+Общая логика лент рекомендаций: карточки книг, статус пользователя и карусель
+
+В режиме карусели (FEED_MODE = 'carousel') лента — одно сообщение, которое
+редактируется при перелистывании. В режиме 'messages' каждая книга
+отправляется отдельным сообщением, как раньше.
+"""
+from typing import Callable, Dict, List, Optional, Tuple
+
+from aiogram import Router, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import Message, CallbackQuery
+
+from database import Database
+from models import Action, Book
+from keyboards import get_book_card_keyboard, get_pagination_keyboard
+
+router = Router()
+
+STATUS_TEXT = {
+    'confirmed': 'Подтверждено',
+    'auto_confirmed': 'Автоподтверждено'
+}
+
+
+def render_status(card: Dict, user_action: Optional[Action], viewer_id: int) -> Tuple[str, bool]:
+    """Статус пользователя для карточки книги и нужна ли кнопка действия"""
+    if user_action and user_action.status in ['confirmed', 'auto_confirmed']:
+        # Действие уже подтверждено - показываем статус
+        return f"\n\n✅ Ваш статус: {STATUS_TEXT.get(user_action.status, 'Подтверждено')}", False
+    if user_action and user_action.status == 'pending':
+        # Ожидает подтверждения
+        return "\n\n⏳ Ваш статус: Ожидает подтверждения", False
+    if card['user_id'] == viewer_id:
+        return "\n\n<i>Это ваша книга</i>", False
+    # Пользователь может выполнить действие (первый раз или после отклонения)
+    if user_action and user_action.status == 'rejected':
+        return "\n\n❌ Ваше предыдущее действие было отклонено. Вы можете попробовать снова.", True
+    return "", True
+
+
+async def get_cards(db: Database, book_type: str, render_card: Callable[[Book], str]) -> List[Dict]:
+    """Отрисованные карточки рекомендаций.
+
+    Хранятся в кэше базы данных рядом с рекомендациями и сбрасываются вместе с ними.
+    """
+    async def load():
+        books = await db.get_recommendations(book_type)
+        return [
+            {'book_id': book.book_id, 'user_id': book.user_id, 'text': render_card(book)}
+            for book in books
+        ]
+
+    return await db.cache.get_or_load(('cards', book_type), load)
+
+
+async def get_viewer_actions(db: Database, book_type: str, cards: List[Dict],
+                             viewer_id: int) -> Dict[int, Action]:
+    """Действия пользователя для всех карточек ленты: book_id -> действие.
+
+    Загружаются одним запросом и хранятся в кэше на пользователя; сбрасываются
+    вместе с карточками и при изменении действий пользователя.
+    """
+    async def load():
+        return await db.get_user_actions_for_books(viewer_id, [card['book_id'] for card in cards])
+
+    return await db.cache.get_or_load(('statuses', book_type, viewer_id), load)
+
+
+def is_carousel(message: Message) -> bool:
+    """Сообщение — карусель ленты (в нём есть кнопки перелистывания)"""
+    markup = message.reply_markup
+    return bool(markup and any(
+        button.callback_data == "current_page"
+        for row in markup.inline_keyboard for button in row
+    ))
+
+
+async def send_feed_messages(db: Database, message: Message, book_type: str, header: str,
+                             render_card: Callable[[Book], str]):
+    """Лента отдельными сообщениями: заголовок и карточка на каждую книгу"""
+    cards = await get_cards(db, book_type, render_card)
+    await message.answer(header, parse_mode="HTML")
+
+    # Статусы действий пользователя для всех книг ленты одним запросом
+    user_actions = await db.get_user_actions_for_books(
+        message.from_user.id, [card['book_id'] for card in cards]
+    )
+
+    for card in cards:
+        status_text, show_button = render_status(card, user_actions.get(card['book_id']), message.from_user.id)
+        await message.answer(
+            card['text'] + status_text,
+            parse_mode="HTML",
+            reply_markup=get_book_card_keyboard(card['book_id'], book_type, message.from_user.id)
+            if show_button else None
+        )
+
+
+async def render_page(db: Database, book_type: str, page: int, header: str,
+                      render_card: Callable[[Book], str], viewer_id: int) -> Optional[Tuple[str, object]]:
+    """Текст и клавиатура страницы карусели; None, если лента пуста"""
+    cards = await get_cards(db, book_type, render_card)
+    if not cards:
+        return None
+    page = max(0, min(page, len(cards) - 1))
+    card = cards[page]
+
+    user_actions = await get_viewer_actions(db, book_type, cards, viewer_id)
+    status_text, show_button = render_status(card, user_actions.get(card['book_id']), viewer_id)
+    keyboard = get_pagination_keyboard(
+        book_type, page, len(cards),
+        book_id=card['book_id'] if show_button else None, user_id=viewer_id
+    )
+    return f"{header}\n\n{card['text']}{status_text}", keyboard
+
+
+async def send_carousel(db: Database, message: Message, book_type: str, header: str,
+                        render_card: Callable[[Book], str]):
+    """Лента одним сообщением с первой книгой и кнопками перелистывания"""
+    page = await render_page(db, book_type, 0, header, render_card, message.from_user.id)
+    if page:
+        text, keyboard = page
+        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+
+async def turn_carousel_page(db: Database, callback: CallbackQuery, book_type: str, page: int,
+                             header: str, empty_text: str, render_card: Callable[[Book], str]):
+    """Перелистнуть карусель: сообщение редактируется на месте"""
+    rendered = await render_page(db, book_type, page, header, render_card, callback.from_user.id)
+    text, keyboard = rendered if rendered else (empty_text, None)
+    try:
+        await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    except TelegramBadRequest:
+        pass  # Содержимое не изменилось или сообщение слишком старое
+
+    try:
+        await callback.answer()
+    except TelegramBadRequest:
+        pass  # Устаревший callback
+
+
+@router.callback_query(F.data == "current_page")
+async def current_page(callback: CallbackQuery):
+    """Нажатие на номер страницы карусели"""
+    await callback.answer()
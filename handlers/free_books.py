@@ -3,84 +3,70 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 
 from database import Database
-from keyboards import get_main_menu, get_book_card_keyboard, get_back_to_menu_keyboard
+from keyboards import get_main_menu, get_back_to_menu_keyboard
+from handlers.feed import is_carousel, send_carousel, send_feed_messages, turn_carousel_page
 import config
 
 router = Router()
-db = Database()
+
+
+def render_free_card(book) -> str:
+    """Карточка бесплатной книги"""
+    remaining_actions = config.ACTIONS_REQUIRED - book.confirmed_actions
+    return (
+        f"📚 <b>{book.title}</b>\n"
+        f"🆓 Бесплатно\n"
+        f"🔗 Ссылка: {book.link}\n\n"
+        f"<b>Сделайте это и здесь появится Ваша книга:</b>\n"
+        f"📥 Добавьте книгу в свою библиотеку\n"
+        f"⭐️ Поставьте оценку\n"
+        f"✍️ Напишите отзыв\n"
+        f"📢 Подпишитесь на автора\n\n"
+        f"Осталось действий для завершения: <b>{remaining_actions}</b>"
+    )
+
+
+FREE_FEED_HEADER = (
+    "🆓 <b>Бесплатные книги</b>\n\n"
+    f"Сейчас в рекомендациях:👇"
+)
+
+FREE_EMPTY_TEXT = (
+    "🆓 <b>Бесплатные книги</b>\n\n"
+    "Пока нет книг в рекомендациях. Будьте первым, кто добавит свою книгу!"
+)
 
 
 @router.message(F.text == "🆓 Бесплатные книги")
-async def show_free_books(message: Message):
+async def show_free_books(message: Message, db: Database):
     """Показать список бесплатных книг"""
     books = await db.get_recommendations("free")
     
     if not books:
         await message.answer(
-            "🆓 <b>Бесплатные книги</b>\n\n"
-            "Пока нет книг в рекомендациях. Будьте первым, кто добавит свою книгу!",
+            FREE_EMPTY_TEXT,
             parse_mode="HTML",
             reply_markup=get_main_menu()
         )
         return
     
-    await message.answer(
-        "🆓 <b>Бесплатные книги</b>\n\n"
-        f"Сейчас в рекомендациях:👇",
-        parse_mode="HTML"
-    )
-     
-    for book in books:
-        remaining_actions = config.ACTIONS_REQUIRED - book['confirmed_actions']
-        
-        book_text = (
-            f"📚 <b>{book['title']}</b>\n"
-            f"🆓 Бесплатно\n"
-            f"🔗 Ссылка: {book['link']}\n\n"
-            f"<b>Сделайте это и здесь появится Ваша книга:</b>\n"
-            f"📥 Добавьте книгу в свою библиотеку\n"
-            f"⭐️ Поставьте оценку\n"
-            f"✍️ Напишите отзыв\n"
-            f"📢 Подпишитесь на автора\n\n"
-            f"Осталось действий для завершения: <b>{remaining_actions}</b>"
-        )
-        
-        # Проверяем, выполнял ли пользователь действие для этой книги
-        user_action = await db.get_user_action_for_book(message.from_user.id, book['book_id'])
-        
-        if user_action and user_action['status'] in ['confirmed', 'auto_confirmed']:
-            # Действие уже подтверждено - показываем статус
-            status_emoji = {
-                'confirmed': '✅',
-                'auto_confirmed': '✅'
-            }
-            status_text = {
-                'confirmed': 'Подтверждено',
-                'auto_confirmed': 'Автоподтверждено'
-            }
-            book_text += f"\n\n{status_emoji.get(user_action['status'], '✅')} Ваш статус: {status_text.get(user_action['status'], 'Подтверждено')}"
-            await message.answer(book_text, parse_mode="HTML")
-        elif user_action and user_action['status'] == 'pending':
-            # Ожидает подтверждения
-            book_text += "\n\n⏳ Ваш статус: Ожидает подтверждения"
-            await message.answer(book_text, parse_mode="HTML")
-        else:
-            # Пользователь может выполнить действие (первый раз или после отклонения)
-            if book['user_id'] == message.from_user.id:
-                book_text += "\n\n<i>Это ваша книга</i>"
-                await message.answer(book_text, parse_mode="HTML")
-            else:
-                if user_action and user_action['status'] == 'rejected':
-                    book_text += "\n\n❌ Ваше предыдущее действие было отклонено. Вы можете попробовать снова."
-                await message.answer(
-                    book_text,
-                    parse_mode="HTML",
-                    reply_markup=get_book_card_keyboard(book['book_id'], "free", message.from_user.id)
-                )
+    if config.FEED_MODE == "carousel":
+        # Одно сообщение, которое редактируется при перелистывании
+        await send_carousel(db, message, "free", FREE_FEED_HEADER, render_free_card)
+    else:
+        await send_feed_messages(db, message, "free", FREE_FEED_HEADER, render_free_card)
+
+
+@router.callback_query(F.data.startswith("page:free:"))
+async def turn_free_page(callback: CallbackQuery, db: Database):
+    """Перелистывание карусели бесплатных книг"""
+    page = int(callback.data.split(":")[2])
+    await turn_carousel_page(db, callback, "free", page, FREE_FEED_HEADER,
+                             FREE_EMPTY_TEXT, render_free_card)
 
 
 @router.callback_query(F.data.startswith("complete_action:"))
-async def complete_free_book_action(callback: CallbackQuery, state: FSMContext):
+async def complete_free_book_action(callback: CallbackQuery, state: FSMContext, db: Database):
     """Запрос скриншота для бесплатной книги"""
     _, book_id, user_id = callback.data.split(":")
     book_id = int(book_id)
@@ -88,7 +74,7 @@ async def complete_free_book_action(callback: CallbackQuery, state: FSMContext):
     
     # Проверяем, не ожидает ли уже подтверждения или подтверждено
     user_action = await db.get_user_action_for_book(callback.from_user.id, book_id)
-    if user_action and user_action['status'] in ['pending', 'confirmed', 'auto_confirmed']:
+    if user_action and user_action.status in ['pending', 'confirmed', 'auto_confirmed']:
         await callback.answer("Вы уже отправили действие для этой книги!", show_alert=True)
         return
     
@@ -101,15 +87,16 @@ async def complete_free_book_action(callback: CallbackQuery, state: FSMContext):
     await state.update_data(book_id=book_id, action_type="rating", book_type="free")
     await state.set_state("waiting_for_screenshot")
     
-    # Удаляем предыдущее сообщение с кнопкой
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    # Удаляем предыдущее сообщение с кнопкой; карусель остаётся, чтобы листать ленту дальше
+    if not is_carousel(callback.message):
+        try:
+            await callback.message.delete()
+        except:
+            pass
     
     await callback.message.answer(
         f"📸 <b>Отправьте скриншот выполненных действий</b>\n\n"
-        f"📚 Книга: {book['title']}\n\n"
+        f"📚 Книга: {book.title}\n\n"
         f"<b>Как отправить скриншот:</b>\n"
         f"1️⃣ Сделайте скриншот выполненных действий (оценка, отзыв, подписка)\n"
         f"2️⃣ Нажмите на скрепку 📎 (или кнопку прикрепления) внизу экрана\n"
@@ -129,7 +116,7 @@ async def complete_free_book_action(callback: CallbackQuery, state: FSMContext):
 
 
 @router.message(F.photo)
-async def receive_free_screenshot(message: Message, state: FSMContext):
+async def receive_free_screenshot(message: Message, state: FSMContext, db: Database):
     """Получение скриншота для бесплатной книги"""
     # Проверяем состояние
     current_state = await state.get_state()
@@ -150,8 +137,8 @@ async def receive_free_screenshot(message: Message, state: FSMContext):
     
     # Проверяем, есть ли отклонённое действие - удаляем его
     user_action = await db.get_user_action_for_book(message.from_user.id, book_id)
-    if user_action and user_action['status'] == 'rejected':
-        await db.delete_action(user_action['action_id'])
+    if user_action and user_action.status == 'rejected':
+        await db.delete_action(user_action.action_id)
     
     # Добавляем новое действие в базу
     action_id = await db.add_action(book_id, message.from_user.id, "rating", photo_id)
@@ -164,31 +151,8 @@ async def receive_free_screenshot(message: Message, state: FSMContext):
         await state.clear()
         return
     
-    # Получаем информацию о книге и владельце
-    book = await db.get_book_by_id(book_id)
-    
-    # Отправляем уведомление владельцу книги
-    from keyboards import get_confirm_action_keyboard
-    
-    notification_text = (
-        f"🔔 <b>Пользователь выполнил действия с вашей книгой!</b>\n\n"
-        f"📚 Книга: {book['title']}\n"
-        f"👤 Пользователь: @{message.from_user.username or 'Аноним'}\n\n"
-        f"Пожалуйста, проверьте и подтвердите или отклоните действия в течение 12 часов.\n"
-        f"Если вы не ответите, действия будут подтверждены автоматически."
-    )
-    
-    try:
-        from main import bot
-        await bot.send_photo(
-            book['user_id'],
-            photo_id,
-            caption=notification_text,
-            parse_mode="HTML",
-            reply_markup=get_confirm_action_keyboard(action_id)
-        )
-    except:
-        pass  # Владелец может быть недоступен
+    # Уведомление владельцу книги записано в outbox вместе с действием
+    # и будет отправлено фоновой доставкой
     
     await message.answer(
         "✅ <b>Скриншот отправлен!</b>\n\n"
@@ -1,18 +1,27 @@
 from aiogram import Router, F
-from aiogram.types import Message
+from aiogram.types import CallbackQuery, Message
 
-from database import Database
-from keyboards import get_main_menu
+from database import Database, NOTIFY_MODES
+from keyboards import get_main_menu, get_notify_mode_keyboard
+from user_context import UserContext
 import config
 
 router = Router()
-db = Database()
+
+
+def render_notify_mode(mode: str) -> str:
+    """Строка о режиме уведомлений о действиях с книгами"""
+    if mode == 'digest':
+        return f"📬 Уведомления о действиях: сводкой раз в {config.DIGEST_INTERVAL_MINUTES} мин."
+    return "🔔 Уведомления о действиях: сразу"
 
 
 @router.message(F.text == "📊 Моя книга")
-async def show_my_book_status(message: Message):
+async def show_my_book_status(message: Message, user_context: UserContext):
     """Показать статус книг пользователя"""
-    books = await db.get_user_books(message.from_user.id)
+    # Книги и режим уведомлений загружаются одним запросом
+    await user_context.load()
+    books = user_context.books
     
     if not books:
         await message.answer(
@@ -38,33 +47,32 @@ async def show_my_book_status(message: Message):
     # Формируем информацию по каждой книге
     books_info = []
     for book in books:
-        type_emoji = "📘" if book['book_type'] == "paid" else "🆓"
-        type_name = "Платная" if book['book_type'] == "paid" else "Бесплатная"
-        price_text = f"{book['price']:.0f} ₽" if book['book_type'] == "paid" else "Бесплатно"
-        remaining_actions = config.ACTIONS_REQUIRED - book['confirmed_actions']
+        type_emoji = "📘" if book.book_type == "paid" else "🆓"
+        type_name = "Платная" if book.book_type == "paid" else "Бесплатная"
+        price_text = f"{book.price:.0f} ₽" if book.book_type == "paid" else "Бесплатно"
+        remaining_actions = config.ACTIONS_REQUIRED - book.confirmed_actions
         
-        # Получаем количество книг в очереди перед этой
-        queue_books = await db.get_queue_books(book['book_type'])
-        books_before = sum(1 for b in queue_books if b['queue_position'] < book['queue_position'])
+        # Количество книг в очереди перед этой (позиция считается по очереди в памяти)
+        books_before = book.position - 1
         
         book_text = (
-            f"{type_emoji} <b>{book['title']}</b> ({type_name})\n"
+            f"{type_emoji} <b>{book.title}</b> ({type_name})\n"
             f"💰 {price_text}\n"
-            f"🔗 {book['link']}\n\n"
+            f"🔗 {book.link}\n\n"
             f"<b>Статистика:</b>\n"
-            f"{status_emoji.get(book['status'], '❓')} Статус: {status_name.get(book['status'], 'Неизвестно')}\n"
-            f"📍 Позиция: {book['queue_position']}\n"
+            f"{status_emoji.get(book.status, '❓')} Статус: {status_name.get(book.status, 'Неизвестно')}\n"
+            f"📍 Позиция: {book.position}\n"
             f"👥 Книг впереди: {books_before}\n"
-            f"✅ Действий: {book['confirmed_actions']}/{config.ACTIONS_REQUIRED}\n"
-            f"📈 Лимит: {book['actions_limit']}\n"
+            f"✅ Действий: {book.confirmed_actions}/{config.ACTIONS_REQUIRED}\n"
+            f"📈 Лимит: {book.actions_limit}\n"
         )
         
-        if book['is_admin_book']:
+        if book.is_admin_book:
             book_text += "⚡️ Администраторская книга\n"
         
-        if book['status'] == 'in_recommendations':
+        if book.status == 'in_recommendations':
             book_text += f"🔥 <b>В топ-{config.MAX_BOOKS_IN_RECOMMENDATIONS} рекомендаций!</b>\n"
-        elif book['status'] == 'in_queue':
+        elif book.status == 'in_queue':
             book_text += "⏳ В очереди. Помогайте другим авторам!\n"
         
         if remaining_actions > 0:
@@ -77,10 +85,28 @@ async def show_my_book_status(message: Message):
     # Формируем итоговое сообщение
     header = "📊 <b>Мои книги</b>\n\n" if len(books) > 1 else "📊 <b>Моя книга</b>\n\n"
     separator = "\n\n" + "─" * 30 + "\n\n"
-    status_text = header + separator.join(books_info)
+    notify_mode = user_context.notify_mode
+    status_text = header + separator.join(books_info) + "\n\n" + render_notify_mode(notify_mode)
     
     await message.answer(
         status_text,
         parse_mode="HTML",
-        reply_markup=get_main_menu()
+        reply_markup=get_notify_mode_keyboard(notify_mode)
     )
+
+
+@router.callback_query(F.data.startswith("notify_mode:"))
+async def switch_notify_mode(callback: CallbackQuery, db: Database):
+    """Переключить режим уведомлений о действиях (сразу или сводкой)"""
+    mode = callback.data.split(":")[1]
+    if mode not in NOTIFY_MODES:
+        await callback.answer()
+        return
+    
+    await db.set_notify_mode(callback.from_user.id, mode)
+    
+    try:
+        await callback.message.edit_reply_markup(reply_markup=get_notify_mode_keyboard(mode))
+    except Exception:
+        pass  # Сообщение уже изменено или устарело
+    await callback.answer(render_notify_mode(mode), show_alert=True)
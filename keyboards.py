@@ -1,5 +1,6 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import ReplyKeyboardBuilder, InlineKeyboardBuilder
+from typing import List, Optional
 
 
 def get_main_menu() -> ReplyKeyboardMarkup:
@@ -45,25 +46,23 @@ def get_book_type_keyboard(can_add_paid: bool = True, can_add_free: bool = True)
     return builder.as_markup()
 
 
+def get_book_action_button(book_id: int, book_type: str, user_id: int) -> InlineKeyboardButton:
+    """Кнопка действия с книгой (скриншот покупки или выполненные действия)"""
+    if book_type == "paid":
+        return InlineKeyboardButton(
+            text="📸 Отправить скриншот покупки", 
+            callback_data=f"send_screenshot:{book_id}:{user_id}"
+        )
+    return InlineKeyboardButton(
+        text="✅ Действия выполнены", 
+        callback_data=f"complete_action:{book_id}:{user_id}"
+    )
+
+
 def get_book_card_keyboard(book_id: int, book_type: str, user_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для карточки книги"""
     builder = InlineKeyboardBuilder()
-    
-    if book_type == "paid":
-        builder.row(
-            InlineKeyboardButton(
-                text="📸 Отправить скриншот покупки", 
-                callback_data=f"send_screenshot:{book_id}:{user_id}"
-            )
-        )
-    else:
-        builder.row(
-            InlineKeyboardButton(
-                text="✅ Действия выполнены", 
-                callback_data=f"complete_action:{book_id}:{user_id}"
-            )
-        )
-    
+    builder.row(get_book_action_button(book_id, book_type, user_id))
     return builder.as_markup()
 
 
@@ -77,6 +76,43 @@ def get_confirm_action_keyboard(action_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
+def get_action_digest_keyboard(action_ids: List[int]) -> InlineKeyboardMarkup:
+    """Клавиатура сводки действий: подтверждение каждого действия по номеру и всех сразу"""
+    builder = InlineKeyboardBuilder()
+    for number, action_id in enumerate(action_ids, 1):
+        builder.row(
+            InlineKeyboardButton(text=f"✅ {number}", callback_data=f"confirm_action:{action_id}:confirmed"),
+            InlineKeyboardButton(text=f"❌ {number}", callback_data=f"confirm_action:{action_id}:rejected")
+        )
+    # Подтверждаются все ожидающие действия владельца до последнего в сводке
+    builder.row(
+        InlineKeyboardButton(text="✅ Подтвердить все", callback_data=f"confirm_all:{max(action_ids)}")
+    )
+    return builder.as_markup()
+
+
+def remove_action_buttons(markup: Optional[InlineKeyboardMarkup], action_id: int) -> Optional[InlineKeyboardMarkup]:
+    """Клавиатура без кнопок обработанного действия (None, если действий в ней не осталось)"""
+    if markup is None:
+        return None
+    prefix = f"confirm_action:{action_id}:"
+    rows = [row for row in markup.inline_keyboard
+            if not any((button.callback_data or '').startswith(prefix) for button in row)]
+    if not any((button.callback_data or '').startswith("confirm_action:") for row in rows for button in row):
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def get_notify_mode_keyboard(mode: str) -> InlineKeyboardMarkup:
+    """Переключение режима уведомлений о действиях с книгами"""
+    builder = InlineKeyboardBuilder()
+    if mode == 'digest':
+        builder.row(InlineKeyboardButton(text="🔔 Получать действия сразу", callback_data="notify_mode:instant"))
+    else:
+        builder.row(InlineKeyboardButton(text="📬 Получать действия сводкой", callback_data="notify_mode:digest"))
+    return builder.as_markup()
+
+
 def get_cancel_keyboard() -> InlineKeyboardMarkup:
     """Клавиатура отмены"""
     builder = InlineKeyboardBuilder()
@@ -95,10 +131,14 @@ def get_back_to_menu_keyboard() -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_pagination_keyboard(book_type: str, current_page: int, total_pages: int) -> InlineKeyboardMarkup:
-    """Клавиатура пагинации для списка книг"""
+def get_pagination_keyboard(book_type: str, current_page: int, total_pages: int,
+                            book_id: int = None, user_id: int = None) -> InlineKeyboardMarkup:
+    """Клавиатура пагинации для списка книг (с кнопкой действия для текущей книги)"""
     builder = InlineKeyboardBuilder()
     
+    if book_id is not None:
+        builder.row(get_book_action_button(book_id, book_type, user_id))
+    
     buttons = []
     if current_page > 0:
         buttons.append(InlineKeyboardButton(text="⬅️", callback_data=f"page:{book_type}:{current_page - 1}"))
@@ -1,14 +1,23 @@
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.base import BaseStorage
+from typing import Optional
 
 import config
-from database import Database
-from scheduler import setup_scheduler
+from database import Database, db
+from fsm_storage import SQLiteStorage
+from outbox import OutboxWorker
+from scheduler import DeadlineScheduler, setup_scheduler
+from sender import OutboundSender, sender
+from update_scheduler import UpdateScheduler
+from user_context import UserContextMiddleware
+from user_tracker import UsernameTracker
+from webhook import check_webhook_config, run_webhook
 
 # Импорт всех handlers
-from handlers import common, paid_books, free_books, add_book, my_book, support, confirmations
+from handlers import common, feed, paid_books, free_books, add_book, my_book, support, confirmations
 
 # Настройка логирования
 logging.basicConfig(
@@ -17,71 +26,145 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Инициализация бота и диспетчера
-bot = Bot(token=config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
 
+def create_bot(sender: OutboundSender, session: Optional[BaseSession] = None) -> Bot:
+    """Единственный экземпляр бота (и HTTP-сессии) на процесс"""
+    bot = Bot(token=config.BOT_TOKEN, session=session)
+    # Все запросы к чатам проходят через очередь исходящих сообщений
+    sender.set_bot(bot)
+    bot.session.middleware(sender.middleware)
+    return bot
 
-async def on_startup():
+
+def create_dispatcher(db: Database, sender: OutboundSender,
+                      storage: Optional[BaseStorage] = None) -> Dispatcher:
+    """Диспетчер с роутерами.
+
+    База данных и очередь сообщений передаются обработчикам через workflow_data
+    аргументами db и sender, бот — аргументом bot, профиль и книги пользователя —
+    аргументом user_context. Состояния FSM по умолчанию
+    хранятся в SQLite и переживают перезапуск.
+    """
+    update_scheduler = UpdateScheduler()
+    username_tracker = UsernameTracker(db)
+    user_context_middleware = UserContextMiddleware(db)
+    dp = Dispatcher(storage=storage or SQLiteStorage(), db=db, sender=sender,
+                    update_scheduler=update_scheduler, username_tracker=username_tracker,
+                    user_context_middleware=user_context_middleware)
+    # Смена username подхватывается из любого обновления и записывается пачкой
+    dp.update.outer_middleware(username_tracker)
+    dp.startup.register(username_tracker.start)
+    dp.shutdown.register(username_tracker.close)
+    # Не больше UPDATE_MAX_CONCURRENCY обновлений одновременно, по очереди для каждого пользователя
+    dp.update.outer_middleware(update_scheduler)
+    # Аргумент user_context (профиль и книги одним запросом) и счётчики запросов обработчиков
+    dp.message.middleware(user_context_middleware)
+    dp.callback_query.middleware(user_context_middleware)
+    
+    # Регистрация роутеров (confirmations должен быть первым для обработки подтверждений)
+    dp.include_router(confirmations.router)
+    dp.include_router(common.router)
+    dp.include_router(paid_books.router)
+    dp.include_router(free_books.router)
+    dp.include_router(feed.router)
+    dp.include_router(add_book.router)
+    dp.include_router(my_book.router)
+    dp.include_router(support.router)
+    return dp
+
+
+async def on_startup(db: Database, sender: OutboundSender, deadlines: DeadlineScheduler,
+                     outbox: OutboxWorker):
     """Действия при запуске бота"""
     logger.info("Bot is starting...")
     
-    # Инициализация базы данных
-    db = Database()
+    # Инициализация базы данных (общий пул соединений для всех обработчиков)
     await db.connect()
     logger.info("Database initialized")
     
+    # Книги, набравшие действия до запуска, завершаются сразу
+    completed = await db.complete_reached_books()
+    if completed:
+        logger.info(f"Completed {len(completed)} book(s) that reached the action limit")
+    
+    # Прогрев кэша рекомендаций до первых нажатий кнопок ленты
+    await db.warm_cache()
+    logger.info("Recommendations cache warmed up")
+    
+    # Очередь исходящих сообщений
+    await sender.start()
+    logger.info("Outbound sender started")
+    
+    # Доставка уведомлений из outbox, в том числе записанных до перезапуска
+    outbox.start()
+    logger.info("Outbox worker started")
+    
     # Запуск планировщика
-    setup_scheduler()
+    setup_scheduler(db)
     logger.info("Scheduler started")
     
-    # Уведомление администратора о запуске
-    try:
-        await bot.send_message(
-            config.ADMIN_ID,
-            "🤖 Бот успешно запущен и готов к работе!"
-        )
-    except Exception as e:
-        logger.warning(f"Could not send startup message to admin: {e}")
+    # Автоподтверждение и истечение показа точно в срок
+    deadlines.start()
+    logger.info(f"Deadline scheduler started: {len(db.deadlines)} pending deadline(s)")
+    
+    # Уведомление администратора о запуске (ошибки доставки логирует очередь)
+    sender.send_message(config.ADMIN_ID, "🤖 Бот успешно запущен и готов к работе!")
 
 
-async def on_shutdown():
+async def on_shutdown(bot: Bot, db: Database, sender: OutboundSender, deadlines: DeadlineScheduler,
+                      outbox: OutboxWorker):
     """Действия при остановке бота"""
     logger.info("Bot is shutting down...")
     
     # Уведомление администратора об остановке
     try:
-        await bot.send_message(
-            config.ADMIN_ID,
-            "🤖 Бот остановлен"
-        )
+        await sender.send_message(config.ADMIN_ID, "🤖 Бот остановлен")
     except Exception as e:
         logger.warning(f"Could not send shutdown message to admin: {e}")
     
+    await deadlines.stop()
+    logger.info(f"Deadline scheduler metrics: {deadlines.get_metrics()}")
+    
+    # Текущая пачка уведомлений отправляется, остальные ждут следующего запуска
+    await outbox.stop()
+    logger.info(f"Outbox worker metrics: {outbox.get_metrics()}")
+    
+    # Отправляем оставшиеся сообщения до закрытия сессии
+    await sender.stop()
+    logger.info(f"Outbound sender metrics: {sender.get_metrics()}")
+    logger.info(f"Database pool metrics: {db.get_pool_metrics()}")
+    logger.info(f"Cache metrics: {db.get_cache_metrics()}")
+    await db.close()
     await bot.session.close()
 
 
 async def main():
     """Главная функция запуска бота"""
-    # Регистрация роутеров (confirmations должен быть первым для обработки подтверждений)
-    dp.include_router(confirmations.router)
-    dp.include_router(common.router)
-    dp.include_router(paid_books.router)
-    dp.include_router(free_books.router)
-    dp.include_router(add_book.router)
-    dp.include_router(my_book.router)
-    dp.include_router(support.router)
+    if config.BOT_MODE == "webhook":
+        # Без настроенного секрета Telegram не сможет доставлять обновления
+        check_webhook_config()
+    bot = create_bot(sender)
+    dp = create_dispatcher(db, sender)
+    deadlines = DeadlineScheduler(db)
+    outbox = OutboxWorker(db, sender)
     
     # Выполнение действий при запуске
-    await on_startup()
+    await on_startup(db, sender, deadlines, outbox)
     
     try:
-        # Запуск polling
-        logger.info("Starting polling...")
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if config.BOT_MODE == "webhook":
+            # Обновления приходят на aiohttp-сервер
+            logger.info("Starting webhook server...")
+            await run_webhook(dp, bot)
+        else:
+            # Запуск polling
+            logger.info("Starting polling...")
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
-        await on_shutdown()
+        logger.info(f"Update scheduler metrics: {dp['update_scheduler'].get_metrics()}")
+        logger.info(f"Username tracker metrics: {dp['username_tracker'].get_metrics()}")
+        logger.info(f"Handler query metrics: {dp['user_context_middleware'].get_metrics()}")
+        await on_shutdown(bot, db, sender, deadlines, outbox)
 
 
 if __name__ == "__main__":
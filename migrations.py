@@ -0,0 +1,312 @@
+"""
+Версионированные миграции схемы базы данных
+
+Текущая версия схемы хранится в PRAGMA user_version. При запуске применяются
+только миграции с номером больше текущей версии, каждая в своей транзакции.
+"""
+import logging
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+async def _column_exists(db, table: str, column: str) -> bool:
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return any(row[1] == column for row in await cursor.fetchall())
+
+
+async def initial_schema(db):
+    """Начальная схема: пользователи, книги, действия, история очереди"""
+    # Таблица пользователей
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            username TEXT,
+            confirmed_actions INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    # Таблица книг
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS books (
+            book_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            link TEXT NOT NULL,
+            price REAL DEFAULT 0,
+            book_type TEXT NOT NULL CHECK(book_type IN ('paid', 'free')),
+            confirmed_actions INTEGER DEFAULT 0,
+            actions_limit INTEGER DEFAULT 0,
+            queue_position INTEGER,
+            status TEXT DEFAULT 'in_queue' CHECK(status IN ('in_queue', 'in_recommendations', 'completed')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            recommendations_started_at TIMESTAMP,
+            is_admin_book INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+    """)
+
+    # Базы, созданные до появления поля recommendations_started_at
+    if not await _column_exists(db, 'books', 'recommendations_started_at'):
+        await db.execute("ALTER TABLE books ADD COLUMN recommendations_started_at TIMESTAMP")
+
+    # Таблица действий пользователей (для предотвращения накрутки)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS user_actions (
+            action_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            action_type TEXT NOT NULL CHECK(action_type IN ('purchase', 'rating', 'review', 'subscribe')),
+            screenshot_file_id TEXT,
+            status TEXT DEFAULT 'pending' CHECK(status IN ('pending', 'confirmed', 'rejected', 'auto_confirmed')),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            confirmed_at TIMESTAMP,
+            FOREIGN KEY (book_id) REFERENCES books(book_id),
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id),
+            UNIQUE(book_id, user_id)
+        )
+    """)
+
+    # Таблица очередей (для отслеживания позиций)
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS queue_history (
+            history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            book_id INTEGER NOT NULL,
+            old_position INTEGER,
+            new_position INTEGER,
+            reason TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (book_id) REFERENCES books(book_id)
+        )
+    """)
+
+
+async def hot_path_indexes(db):
+    """Индексы для рекомендаций, очереди, книг пользователя и автоподтверждения"""
+    # Рекомендации, очередь и просроченные книги: тип + статус + позиция
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_books_type_status_position
+        ON books (book_type, status, queue_position)
+    """)
+    # Сдвиг позиций после удаления книги из очереди
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_books_type_position
+        ON books (book_type, queue_position)
+    """)
+    # Активные книги пользователя и увеличение лимита действий
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_books_user_status
+        ON books (user_id, status)
+    """)
+    # Подтверждённые действия пользователя
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_actions_user_status
+        ON user_actions (user_id, status)
+    """)
+    # Ожидающие действия для автоподтверждения
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_actions_pending_created
+        ON user_actions (created_at)
+        WHERE status = 'pending'
+    """)
+
+
+async def sparse_queue_keys(db):
+    """Разреженные ключи очереди вместо плотной нумерации позиций"""
+    # Существующие позиции переводятся в ключи с шагом QUEUE_RANK_GAP
+    await db.execute(
+        """UPDATE books
+           SET queue_position = ranked.position * ?
+           FROM (SELECT book_id,
+                        ROW_NUMBER() OVER (PARTITION BY book_type
+                                           ORDER BY queue_position, book_id) AS position
+                 FROM books
+                 WHERE status IN ('in_queue', 'in_recommendations')) AS ranked
+           WHERE books.book_id = ranked.book_id""",
+        (config.QUEUE_RANK_GAP,)
+    )
+    # Сдвиг позиций при удалении больше не выполняется
+    await db.execute("DROP INDEX IF EXISTS idx_books_type_position")
+    # Последний ключ, соседи и отображаемая позиция считаются по активной очереди
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_books_active_queue
+        ON books (book_type, queue_position)
+        WHERE status IN ('in_queue', 'in_recommendations')
+    """)
+
+
+# Значения счётчиков статистики, вычисленные по основным таблицам:
+# заполнение при миграции и периодическая сверка
+STATS_COUNTERS_QUERY = """
+    SELECT 'users', COUNT(*) FROM users
+    UNION ALL
+    SELECT 'books:' || book_type || ':' || status, COUNT(*) FROM books GROUP BY book_type, status
+    UNION ALL
+    SELECT 'actions:' || status, COUNT(*) FROM user_actions GROUP BY status
+"""
+
+
+def _counter_trigger(name: str, table: str, event: str, body: str, when: str = "") -> str:
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table}
+        {when}
+        BEGIN
+            {body}
+        END
+    """
+
+
+def _bump(counter: str, delta: int) -> str:
+    return (f"INSERT INTO stats_counters (name, value) VALUES ({counter}, {delta}) "
+            f"ON CONFLICT(name) DO UPDATE SET value = value + {delta};")
+
+
+async def stats_counters(db):
+    """Счётчики статистики, поддерживаемые триггерами, и события по дням"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    # Завершения и истечения показа записывают методы Database в своей транзакции
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT NOT NULL,
+            event TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, event)
+        ) WITHOUT ROWID
+    """)
+
+    book = "'books:' || {row}.book_type || ':' || {row}.status"
+    action = "'actions:' || {row}.status"
+    triggers = [
+        _counter_trigger('stats_users_insert', 'users', 'INSERT', _bump("'users'", 1)),
+        _counter_trigger('stats_users_delete', 'users', 'DELETE', _bump("'users'", -1)),
+        _counter_trigger('stats_books_insert', 'books', 'INSERT', _bump(book.format(row='NEW'), 1)),
+        _counter_trigger('stats_books_delete', 'books', 'DELETE', _bump(book.format(row='OLD'), -1)),
+        _counter_trigger(
+            'stats_books_update', 'books', 'UPDATE OF book_type, status',
+            _bump(book.format(row='OLD'), -1) + _bump(book.format(row='NEW'), 1),
+            when="FOR EACH ROW WHEN OLD.book_type IS NOT NEW.book_type OR OLD.status IS NOT NEW.status"
+        ),
+        _counter_trigger('stats_actions_insert', 'user_actions', 'INSERT', _bump(action.format(row='NEW'), 1)),
+        _counter_trigger('stats_actions_delete', 'user_actions', 'DELETE', _bump(action.format(row='OLD'), -1)),
+        _counter_trigger(
+            'stats_actions_update', 'user_actions', 'UPDATE OF status',
+            _bump(action.format(row='OLD'), -1) + _bump(action.format(row='NEW'), 1),
+            when="FOR EACH ROW WHEN OLD.status IS NOT NEW.status"
+        ),
+    ]
+    for trigger in triggers:
+        await db.execute(trigger)
+
+    # Начальные значения по существующим данным
+    await db.execute("DELETE FROM stats_counters")
+    await db.execute(f"INSERT INTO stats_counters (name, value) {STATS_COUNTERS_QUERY}")
+
+
+async def confirmed_actions_by_type(db):
+    """Счётчики подтверждённых действий пользователя по типам книг"""
+    for column in ('confirmed_paid_actions', 'confirmed_free_actions'):
+        if not await _column_exists(db, 'users', column):
+            await db.execute(f"ALTER TABLE users ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+
+    # Действия для уже удалённых книг восстановить нельзя: тип книги неизвестен
+    await db.execute("""
+        UPDATE users
+        SET confirmed_paid_actions = counts.paid, confirmed_free_actions = counts.free
+        FROM (SELECT ua.user_id,
+                     SUM(b.book_type = 'paid') AS paid,
+                     SUM(b.book_type = 'free') AS free
+              FROM user_actions ua
+              JOIN books b ON b.book_id = ua.book_id
+              WHERE ua.status IN ('confirmed', 'auto_confirmed')
+              GROUP BY ua.user_id) AS counts
+        WHERE users.telegram_id = counts.user_id
+    """)
+
+
+async def outbox(db):
+    """Исходящие уведомления, записываемые в транзакции изменения данных"""
+    # payload — JSON с данными для текста уведомления вида kind;
+    # next_attempt_at — время UNIX, раньше которого строка не отправляется
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS outbox (
+            outbox_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 1,
+            status TEXT NOT NULL DEFAULT 'pending' CHECK(status IN ('pending', 'sent', 'failed')),
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL DEFAULT 0,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+    """)
+    # Неотправленные уведомления в порядке доставки
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_pending
+        ON outbox (priority, outbox_id)
+        WHERE status = 'pending'
+    """)
+
+
+async def owner_digests(db):
+    """Режим уведомлений владельца: сразу или сводкой по расписанию"""
+    if not await _column_exists(db, 'users', 'notify_mode'):
+        await db.execute(
+            "ALTER TABLE users ADD COLUMN notify_mode TEXT NOT NULL DEFAULT 'instant' "
+            "CHECK(notify_mode IN ('instant', 'digest'))"
+        )
+    # Последнее действие, попавшее в сводку владельца
+    if not await _column_exists(db, 'users', 'last_digest_action_id'):
+        await db.execute("ALTER TABLE users ADD COLUMN last_digest_action_id INTEGER NOT NULL DEFAULT 0")
+    # Владельцы, получающие сводки
+    await db.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_digest
+        ON users (telegram_id)
+        WHERE notify_mode = 'digest'
+    """)
+
+
+# (версия, описание, функция миграции) — только добавлять в конец
+MIGRATIONS = [
+    (1, "Начальная схема", initial_schema),
+    (2, "Индексы для горячих запросов", hot_path_indexes),
+    (3, "Разреженные ключи очереди", sparse_queue_keys),
+    (4, "Счётчики статистики", stats_counters),
+    (5, "Подтверждённые действия по типам книг", confirmed_actions_by_type),
+    (6, "Очередь исходящих уведомлений", outbox),
+    (7, "Сводки действий для владельцев книг", owner_digests),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version(db) -> int:
+    """Текущая версия схемы базы данных"""
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(db) -> int:
+    """Применить недостающие миграции и вернуть итоговую версию схемы"""
+    version = await get_schema_version(db)
+
+    for target, description, apply in MIGRATIONS:
+        if target <= version:
+            continue
+        logger.info(f"Applying migration {target}: {description}")
+        await db.execute("BEGIN")
+        await apply(db)
+        await db.execute(f"PRAGMA user_version = {target}")
+        await db.commit()
+        version = target
+
+    return version
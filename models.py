@@ -0,0 +1,134 @@
+"""Записи строк базы данных: книги, действия, пользователи и уведомления"""
+from dataclasses import MISSING, dataclass, fields
+from typing import Any, ClassVar, Dict, Iterable, Optional, Tuple
+
+
+class Record:
+    """Общие методы записей"""
+
+    __slots__ = ()
+    # Столбцы таблицы в порядке полей и значения необязательных полей (заполняет декоратор record)
+    COLUMNS: ClassVar[Tuple[str, ...]] = ()
+    DEFAULTS: ClassVar[Dict[str, Any]] = {}
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple):
+        """row_factory курсора: запись из кортежа значений в порядке полей"""
+        return cls(*row)
+
+    @classmethod
+    def from_named_row(cls, cursor, row: tuple):
+        """row_factory курсора для части столбцов: поля заполняются по именам столбцов результата.
+
+        Невыбранный столбец не получает значения: чтение его поля вызывает AttributeError.
+        """
+        record = cls.__new__(cls)
+        for name, value in cls.DEFAULTS.items():
+            setattr(record, name, value)
+        for column, value in zip(cursor.description, row):
+            setattr(record, column[0], value)
+        return record
+
+    @classmethod
+    def select(cls, alias: str = '', columns: Optional[Iterable[str]] = None) -> str:
+        """Столбцы для SELECT: все столбцы таблицы или только columns, с псевдонимом таблицы"""
+        columns = cls.COLUMNS if columns is None else tuple(columns)
+        unknown = set(columns) - set(cls.COLUMNS)
+        if unknown:
+            raise ValueError(f"{cls.__name__} has no columns {sorted(unknown)}")
+        prefix = f"{alias}." if alias else ''
+        return ', '.join(prefix + column for column in columns)
+
+    def _values(self) -> Tuple[Tuple[str, Any], ...]:
+        """Заполненные поля записи"""
+        return tuple((field.name, getattr(self, field.name)) for field in fields(self)
+                     if hasattr(self, field.name))
+
+    def __repr__(self) -> str:
+        values = ', '.join(f"{name}={value!r}" for name, value in self._values())
+        return f"{type(self).__name__}({values})"
+
+    def __eq__(self, other) -> bool:
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+
+def record(cls):
+    """dataclass со __slots__, списком столбцов COLUMNS и значениями необязательных полей DEFAULTS.
+
+    Столбцы таблицы — поля без значения по умолчанию, остальные поля
+    заполняются из JOIN или вычисляются.
+    """
+    cls = dataclass(slots=True, repr=False, eq=False)(cls)
+    cls.COLUMNS = tuple(field.name for field in fields(cls) if field.default is MISSING)
+    cls.DEFAULTS = {field.name: field.default for field in fields(cls) if field.default is not MISSING}
+    return cls
+
+
+@record
+class Book(Record):
+    book_id: int
+    user_id: int
+    title: str
+    link: str
+    price: float
+    book_type: str
+    confirmed_actions: int
+    actions_limit: int
+    queue_position: int
+    status: str
+    created_at: str
+    recommendations_started_at: Optional[str]
+    is_admin_book: int
+    # username автора (рекомендации и очередь)
+    username: Optional[str] = None
+    # Отображаемая позиция в очереди, начиная с 1
+    position: Optional[int] = None
+
+
+@record
+class Action(Record):
+    action_id: int
+    book_id: int
+    user_id: int
+    action_type: str
+    screenshot_file_id: Optional[str]
+    status: str
+    created_at: str
+    confirmed_at: Optional[str]
+    # Книга и её владелец, username выполнившего действие
+    title: Optional[str] = None
+    book_owner_id: Optional[int] = None
+    username: Optional[str] = None
+    # Результат подтверждения: тип книги и завершила ли она продвижение
+    book_type: Optional[str] = None
+    book_completed: bool = False
+    completed_book: Optional[Book] = None
+
+
+@record
+class User(Record):
+    telegram_id: int
+    username: Optional[str]
+    confirmed_actions: int
+    confirmed_paid_actions: int
+    confirmed_free_actions: int
+    notify_mode: str
+    last_digest_action_id: int
+    created_at: str
+
+
+@record
+class OutboxMessage(Record):
+    outbox_id: int
+    chat_id: int
+    kind: str
+    payload: str
+    priority: int
+    status: str
+    attempts: int
+    next_attempt_at: float
+    last_error: Optional[str]
+    created_at: str
+    sent_at: Optional[str]
@@ -0,0 +1,253 @@
+"""
+Доставка уведомлений из таблицы outbox
+
+Уведомления о действиях с книгами записываются в outbox той же транзакцией,
+что и само изменение (add_action, confirm_action, автоподтверждение,
+истечение показа), поэтому падение процесса между коммитом и отправкой не
+теряет сообщение, а обработчик отвечает пользователю сразу после коммита.
+
+Владельцы книг в режиме сводки получают новые действия не по одному, а
+сводкой (action_digest) раз в DIGEST_INTERVAL_MINUTES: скриншоты альбомами и
+сообщение с кнопками для каждого действия и «✅ Подтвердить все».
+
+OutboxWorker забирает пачку строк, которым пора отправляться, отправляет их
+через очередь исходящих сообщений и отмечает результат одной транзакцией:
+- отправленные получают статус sent;
+- после сетевой ошибки строка откладывается с экспоненциальной задержкой;
+- если чат недоступен (бот заблокирован, неверный запрос) или попытки
+  исчерпаны, строка получает статус failed.
+Доставка «не менее одного раза»: уведомление, отправленное перед падением
+процесса, но не отмеченное, будет отправлено повторно.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InputMediaPhoto
+
+import config
+from database import Database
+from keyboards import get_action_digest_keyboard, get_confirm_action_keyboard
+from models import OutboxMessage
+from sender import OutboundSender
+
+logger = logging.getLogger(__name__)
+
+# Фото в одном альбоме (ограничение Bot API)
+MEDIA_GROUP_MAX = 10
+
+# Ошибки, после которых повторная отправка бессмысленна
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, KeyError, ValueError)
+
+
+def _action_submitted(payload: Dict) -> Dict:
+    book_type_text = "покупка вашей книги" if payload['book_type'] == "paid" else "действие с вашей книгой"
+    return {
+        'photo': payload['photo'],
+        'caption': (
+            f"🔔 <b>У Вас {book_type_text}!</b>\n\n"
+            f"📚 Книга: {payload['title']}\n"
+            f"👤 Пользователь: @{payload['username'] or 'Аноним'}\n\n"
+            f"Пожалуйста, подтвердите или отклоните действие в течение {config.AUTO_CONFIRM_HOURS} часов.\n"
+            f"Если вы не ответите, действие будет подтверждено автоматически."
+        ),
+        'reply_markup': get_confirm_action_keyboard(payload['action_id']),
+    }
+
+
+def _action_confirmed(payload: Dict) -> Dict:
+    return {'text': (
+        f"✅ <b>Ваше действие подтверждено!</b>\n\n"
+        f"📚 Книга: {payload['title']}\n"
+        f"👤 Автор: @{payload['owner_username'] or 'Аноним'}\n\n"
+        f"Лимит продвижения вашей книги увеличен! 🎉"
+    )}
+
+
+def _action_rejected(payload: Dict) -> Dict:
+    return {'text': (
+        f"❌ <b>Ваше действие отклонено</b>\n\n"
+        f"📚 Книга: {payload['title']}\n"
+        f"👤 Автор: @{payload['owner_username'] or 'Аноним'}\n\n"
+        f"Автор не подтвердил ваше действие."
+    )}
+
+
+def _action_auto_confirmed(payload: Dict) -> Dict:
+    return {'text': (
+        f"✅ <b>Ваше действие автоматически подтверждено!</b>\n\n"
+        f"📚 Книга: {payload['title']}\n\n"
+        f"Автор не ответил в течение {config.AUTO_CONFIRM_HOURS} часов. "
+        f"Лимит продвижения вашей книги увеличен! 🎉"
+    )}
+
+
+def _book_completed(payload: Dict) -> Dict:
+    return {'text': (
+        "🎉 <b>Поздравляем!</b>\n\n"
+        f"Ваша книга '{payload['title']}' набрала необходимое количество действий "
+        f"и завершила продвижение! Теперь вы можете добавить новую книгу."
+    )}
+
+
+def _book_expired(payload: Dict) -> Dict:
+    return {'text': (
+        f"⌛️ <b>Продвижение книги завершено</b>\n\n"
+        f"📚 Книга: {payload['title']}\n\n"
+        f"За {config.BOOK_EXPIRATION_DAYS} дней в рекомендациях книга не набрала "
+        f"{config.ACTIONS_REQUIRED} подтверждённых действий и удалена из очереди. "
+        f"Вы можете добавить её снова."
+    )}
+
+
+def _action_digest(payload: Dict) -> List[Dict]:
+    # Скриншоты — альбомами по MEDIA_GROUP_MAX, кнопки — в сообщении со списком
+    actions = payload['actions']
+    lines = [f"{number}. 📚 {action['title']} — @{action['username'] or 'Аноним'}"
+             for number, action in enumerate(actions, 1)]
+    photos = [(action['photo'], line) for action, line in zip(actions, lines) if action['photo']]
+    messages = []
+    for start in range(0, len(photos), MEDIA_GROUP_MAX):
+        chunk = photos[start:start + MEDIA_GROUP_MAX]
+        if len(chunk) == 1:
+            messages.append({'photo': chunk[0][0], 'caption': chunk[0][1]})
+        else:
+            messages.append({'media': [InputMediaPhoto(media=photo, caption=caption) for photo, caption in chunk]})
+    messages.append({
+        'text': (
+            f"📬 <b>Сводка действий с вашими книгами</b>\n\n"
+            + "\n".join(lines) +
+            f"\n\nПожалуйста, подтвердите или отклоните действия в течение {config.AUTO_CONFIRM_HOURS} часов.\n"
+            f"Если вы не ответите, действия будут подтверждены автоматически."
+        ),
+        'reply_markup': get_action_digest_keyboard([action['action_id'] for action in actions]),
+    })
+    return messages
+
+
+# Вид уведомления (outbox.kind) -> аргументы send_message, send_photo или send_media_group
+RENDERERS = {
+    'action_submitted': _action_submitted,
+    'action_confirmed': _action_confirmed,
+    'action_rejected': _action_rejected,
+    'action_auto_confirmed': _action_auto_confirmed,
+    'book_completed': _book_completed,
+    'book_expired': _book_expired,
+    'action_digest': _action_digest,
+}
+
+
+def render(kind: str, payload: Dict) -> List[Dict]:
+    """Сообщения уведомления по порядку: text, photo с caption или media (альбом)"""
+    messages = RENDERERS[kind](payload)
+    return messages if isinstance(messages, list) else [messages]
+
+
+class OutboxWorker:
+    """Фоновая задача: отправляет уведомления из outbox пачками"""
+
+    def __init__(self, db: Database, sender: OutboundSender,
+                 batch_size: int = config.OUTBOX_BATCH_SIZE,
+                 poll_interval: float = config.OUTBOX_POLL_SECONDS,
+                 max_attempts: int = config.OUTBOX_MAX_ATTEMPTS,
+                 retry_base: float = config.OUTBOX_RETRY_BASE_SECONDS):
+        self.db = db
+        self.sender = sender
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        # Строка остаётся за этим процессом, пока очередь сообщений её отправляет
+        self.lease_seconds = max(120.0, poll_interval)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.metrics = {'batches': 0, 'sent': 0, 'retried': 0, 'failed': 0}
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Отправить ещё одну пачку (не дольше timeout) и остановить доставку"""
+        if self._task is None:
+            return
+        self._stopping = True
+        self.db.outbox_ready.set()
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            # Неотмеченные строки будут отправлены после перезапуска
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+
+    async def _deliver(self, row: OutboxMessage):
+        # Сообщения одного уведомления отправляются по порядку; при ошибке
+        # повторяется всё уведомление
+        for message in render(row.kind, row.payload):
+            if 'media' in message:
+                await self.sender.send_media_group(row.chat_id, priority=row.priority, **message)
+            elif 'photo' in message:
+                await self.sender.send_photo(row.chat_id, priority=row.priority,
+                                             parse_mode="HTML", **message)
+            else:
+                await self.sender.send_message(row.chat_id, priority=row.priority,
+                                               parse_mode="HTML", **message)
+
+    def _retry_at(self, now: float, attempts: int) -> float:
+        return now + self.retry_base * 2 ** (attempts - 1)
+
+    async def drain(self, now: Optional[float] = None) -> int:
+        """Отправить одну пачку и вернуть число обработанных строк"""
+        rows = await self.db.claim_outbox(self.batch_size, self.lease_seconds, now)
+        if not rows:
+            return 0
+        results = await asyncio.gather(*(self._deliver(row) for row in rows), return_exceptions=True)
+
+        now = time.time() if now is None else now
+        sent, retry, failed = [], [], []
+        for row, result in zip(rows, results):
+            if not isinstance(result, BaseException):
+                sent.append(row.outbox_id)
+            elif isinstance(result, PERMANENT_ERRORS) or row.attempts >= self.max_attempts:
+                logger.error(f"Notification {row.outbox_id} to chat {row.chat_id} failed: {result!r}")
+                failed.append((row.outbox_id, repr(result)))
+            else:
+                retry.append((row.outbox_id, self._retry_at(now, row.attempts), repr(result)))
+        await self.db.finish_outbox(sent, retry, failed)
+
+        self.metrics['batches'] += 1
+        self.metrics['sent'] += len(sent)
+        self.metrics['retried'] += len(retry)
+        self.metrics['failed'] += len(failed)
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            stopping = self._stopping
+            self.db.outbox_ready.clear()
+            try:
+                processed = await self.drain()
+            except Exception as e:
+                logger.error(f"Error delivering notifications: {e}")
+                processed = 0
+            # При остановке отправляется ещё одна пачка: записанное до stop()
+            if stopping:
+                break
+            if processed >= self.batch_size or self._stopping:
+                continue
+            # Новые уведомления будят сразу, отложенные повторы — не позже poll_interval
+            try:
+                await asyncio.wait_for(self.db.outbox_ready.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_metrics(self) -> Dict:
+        """Пачки, отправленные, отложенные и неотправляемые уведомления"""
+        return dict(self.metrics)
@@ -0,0 +1,224 @@
+"""
+Индекс очередей книг в памяти
+
+Для каждого типа книг хранится отсортированный по ключу queue_position список
+активных книг. Позиция книги, число книг впереди и топ очереди вычисляются
+за O(log n) без обращения к базе данных. Индекс загружается из SQLite при
+запуске и обновляется методами Database, изменяющими очередь.
+"""
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict, Iterator, List, Tuple
+
+BOOK_TYPES = ('paid', 'free')
+
+
+class OrderStatisticList:
+    """Отсортированный список пар (ключ, book_id) с поиском ранга за O(log n).
+
+    Пары хранятся блоками в компактных массивах array('q'), а длины блоков —
+    в дереве Фенвика, поэтому число элементов перед ключом считается как
+    префиксная сумма длин блоков плюс позиция внутри блока.
+    """
+
+    LOAD = 512  # Целевой размер блока; блок делится при двойном размере
+
+    def __init__(self, items=()):
+        self._keys: List[array] = []
+        self._ids: List[array] = []
+        self._maxes: List[Tuple[int, int]] = []
+        self._tree: List[int] = []
+        self._len = 0
+        self._build(sorted(items))
+
+    def _build(self, items):
+        self._keys, self._ids, self._maxes = [], [], []
+        for start in range(0, len(items), self.LOAD):
+            chunk = items[start:start + self.LOAD]
+            self._keys.append(array('q', (key for key, _ in chunk)))
+            self._ids.append(array('q', (book_id for _, book_id in chunk)))
+            self._maxes.append(chunk[-1])
+        self._len = len(items)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        tree = [0] + [len(block) for block in self._keys]
+        for index in range(1, len(tree)):
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+        self._tree = tree
+
+    def _tree_add(self, block: int, delta: int):
+        index = block + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def _tree_prefix(self, block: int) -> int:
+        """Число элементов в блоках перед block"""
+        total, index = 0, block
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _locate(self, key: int, book_id: int) -> Tuple[int, int]:
+        """Блок и позиция внутри блока для пары (ключ, book_id)"""
+        block = bisect_left(self._maxes, (key, book_id))
+        if block == len(self._maxes):
+            return block, 0
+        keys, ids = self._keys[block], self._ids[block]
+        position = bisect_left(keys, key)
+        while position < len(keys) and keys[position] == key and ids[position] < book_id:
+            position += 1
+        return block, position
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Tuple[int, int]]:
+        for keys, ids in zip(self._keys, self._ids):
+            yield from zip(keys, ids)
+
+    def add(self, key: int, book_id: int):
+        """Добавить пару (ключ, book_id)"""
+        if not self._maxes:
+            self._build([(key, book_id)])
+            return
+
+        block, position = self._locate(key, book_id)
+        if block == len(self._maxes):
+            block -= 1
+            position = len(self._keys[block])
+        self._keys[block].insert(position, key)
+        self._ids[block].insert(position, book_id)
+        self._maxes[block] = (self._keys[block][-1], self._ids[block][-1])
+        self._len += 1
+
+        if len(self._keys[block]) > 2 * self.LOAD:
+            keys, ids = self._keys[block], self._ids[block]
+            self._keys[block:block + 1] = [keys[:self.LOAD], keys[self.LOAD:]]
+            self._ids[block:block + 1] = [ids[:self.LOAD], ids[self.LOAD:]]
+            self._maxes[block:block + 1] = [
+                (keys[self.LOAD - 1], ids[self.LOAD - 1]), (keys[-1], ids[-1])
+            ]
+            self._rebuild_tree()
+        else:
+            self._tree_add(block, 1)
+
+    def remove(self, key: int, book_id: int) -> bool:
+        """Удалить пару (ключ, book_id); False, если её нет"""
+        block, position = self._locate(key, book_id)
+        if block == len(self._maxes):
+            return False
+        keys, ids = self._keys[block], self._ids[block]
+        if position >= len(keys) or keys[position] != key or ids[position] != book_id:
+            return False
+
+        del keys[position]
+        del ids[position]
+        self._len -= 1
+        if keys:
+            self._maxes[block] = (keys[-1], ids[-1])
+            self._tree_add(block, -1)
+        else:
+            del self._keys[block], self._ids[block], self._maxes[block]
+            self._rebuild_tree()
+        return True
+
+    def rank(self, key: int, book_id: int) -> int:
+        """Число пар меньше (ключ, book_id)"""
+        block, position = self._locate(key, book_id)
+        if block == len(self._maxes):
+            return self._len
+        return self._tree_prefix(block) + position
+
+    def head(self, count: int) -> List[Tuple[int, int]]:
+        """Первые count пар"""
+        result = []
+        for keys, ids in zip(self._keys, self._ids):
+            for pair in zip(keys, ids):
+                if len(result) >= count:
+                    return result
+                result.append(pair)
+        return result
+
+    def memory_usage(self) -> int:
+        """Примерный объём памяти в байтах"""
+        size = sys.getsizeof(self._keys) + sys.getsizeof(self._ids)
+        size += sys.getsizeof(self._maxes) + sys.getsizeof(self._tree)
+        size += sum(sys.getsizeof(block) for block in self._keys)
+        size += sum(sys.getsizeof(block) for block in self._ids)
+        size += len(self._maxes) * (sys.getsizeof((0, 0)) + 2 * sys.getsizeof(2 ** 40))
+        return size
+
+
+class QueueIndex:
+    """Очереди активных книг по типам с поиском позиции без запросов к БД"""
+
+    def __init__(self):
+        self._queues: Dict[str, OrderStatisticList] = {
+            book_type: OrderStatisticList() for book_type in BOOK_TYPES
+        }
+        self.loaded = False
+
+    async def load(self, db, book_type: str = None):
+        """Загрузить очередь (или все очереди) из базы данных"""
+        for current_type in ((book_type,) if book_type else BOOK_TYPES):
+            async with db.execute(
+                """SELECT queue_position, book_id FROM books
+                   WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+                   ORDER BY queue_position, book_id""",
+                (current_type,)
+            ) as cursor:
+                items = [(row[0], row[1]) for row in await cursor.fetchall()]
+            self._queues[current_type] = OrderStatisticList(items)
+        if book_type is None:
+            self.loaded = True
+
+    def add(self, book_type: str, key: int, book_id: int):
+        self._queues[book_type].add(key, book_id)
+
+    def remove(self, book_type: str, key: int, book_id: int) -> bool:
+        return self._queues[book_type].remove(key, book_id)
+
+    def move(self, book_type: str, old_key: int, new_key: int, book_id: int):
+        self._queues[book_type].remove(old_key, book_id)
+        self._queues[book_type].add(new_key, book_id)
+
+    def books_ahead(self, book_type: str, key: int, book_id: int) -> int:
+        """Сколько книг того же типа стоит в очереди перед книгой"""
+        return self._queues[book_type].rank(key, book_id)
+
+    def position(self, book_type: str, key: int, book_id: int) -> int:
+        """Позиция книги в очереди (с единицы)"""
+        return self.books_ahead(book_type, key, book_id) + 1
+
+    def top(self, book_type: str, count: int) -> List[int]:
+        """book_id первых count книг очереди"""
+        return [book_id for _, book_id in self._queues[book_type].head(count)]
+
+    def size(self, book_type: str) -> int:
+        return len(self._queues[book_type])
+
+    async def verify(self, db) -> Dict[str, int]:
+        """Сверить индекс с базой данных; возвращает число расхождений по типам"""
+        mismatches = {}
+        for book_type in BOOK_TYPES:
+            async with db.execute(
+                """SELECT queue_position, book_id FROM books
+                   WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+                   ORDER BY queue_position, book_id""",
+                (book_type,)
+            ) as cursor:
+                expected = [(row[0], row[1]) for row in await cursor.fetchall()]
+            actual = list(self._queues[book_type])
+            differences = sum(1 for left, right in zip(expected, actual) if left != right)
+            mismatches[book_type] = differences + abs(len(expected) - len(actual))
+        return mismatches
+
+    def memory_usage(self) -> Dict[str, int]:
+        """Примерный объём памяти очередей в байтах"""
+        return {book_type: queue.memory_usage() for book_type, queue in self._queues.items()}
@@ -1,75 +1,144 @@
 import asyncio
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Dict, Optional
 
 from database import Database
+from deadlines import ACTION, BOOK, SystemClock
 import config
 
-db = Database()
 
-
-async def auto_confirm_old_actions():
-    """Автоматически подтверждать действия старше 12 часов"""
+async def auto_confirm_old_actions(db: Database, now: Optional[datetime] = None) -> bool:
+    """Автоматически подтверждать действия старше 12 часов; False, если проверка не удалась"""
     try:
-        await db.auto_confirm_old_actions()
-        print(f"[{datetime.now()}] Auto-confirmation check completed")
+        # Уведомления записываются в outbox той же транзакцией
+        confirmed = await db.auto_confirm_old_actions(now)
+        print(f"[{datetime.now()}] Auto-confirmation check completed: {len(confirmed)} action(s) confirmed")
+        return True
     except Exception as e:
         print(f"[{datetime.now()}] Error in auto-confirmation: {e}")
+        return False
 
 
-async def check_completed_books():
-    """Проверить завершённые книги"""
+async def remove_expired_paid_books(db: Database, now: Optional[datetime] = None) -> bool:
+    """Удалить просроченные платные книги (не набравшие 5 действий за 30 дней); False при ошибке"""
     try:
-        # Получаем все книги в рекомендациях
-        for book_type in ['paid', 'free']:
-            books = await db.get_recommendations(book_type)
-            for book in books:
-                await db.check_book_completion(book['book_id'])
-        print(f"[{datetime.now()}] Book completion check completed")
+        # Уведомления владельцам записываются в outbox той же транзакцией
+        removed_books = await db.auto_remove_expired_books(now)
+        if removed_books:
+            print(f"[{datetime.now()}] Removed {len(removed_books)} expired paid book(s)")
+        else:
+            print(f"[{datetime.now()}] No expired books to remove")
+        return True
     except Exception as e:
-        print(f"[{datetime.now()}] Error in book completion check: {e}")
+        print(f"[{datetime.now()}] Error in expired books removal: {e}")
+        return False
 
 
-async def remove_expired_paid_books():
-    """Удалить просроченные платные книги (не набравшие 5 действий за 30 дней)"""
+async def rebalance_queues(db: Database):
+    """Перестроить ключи очередей, если между соседними книгами не осталось места"""
     try:
-        removed_count = await db.auto_remove_expired_books()
-        if removed_count > 0:
-            print(f"[{datetime.now()}] Removed {removed_count} expired paid book(s)")
-        else:
-            print(f"[{datetime.now()}] No expired books to remove")
+        rebalanced = await db.rebalance_queues()
+        if rebalanced:
+            print(f"[{datetime.now()}] Queue keys rebalanced: {rebalanced}")
     except Exception as e:
-        print(f"[{datetime.now()}] Error in expired books removal: {e}")
+        print(f"[{datetime.now()}] Error in queue rebalance: {e}")
+
+
+async def verify_queue_index(db: Database):
+    """Сверить очереди в памяти с базой данных и перечитать сроки"""
+    try:
+        mismatches = await db.verify_queue_index()
+        if any(mismatches.values()):
+            print(f"[{datetime.now()}] Queue index drift detected and reloaded: {mismatches}")
+        await db.reload_deadlines()
+    except Exception as e:
+        print(f"[{datetime.now()}] Error in queue index check: {e}")
+
+
+async def reconcile_statistics(db: Database):
+    """Сверить счётчики статистики с основными таблицами"""
+    try:
+        drift = await db.reconcile_statistics()
+        if drift:
+            print(f"[{datetime.now()}] Statistics counters drift detected and fixed: {drift}")
+    except Exception as e:
+        print(f"[{datetime.now()}] Error in statistics reconciliation: {e}")
+
+
+async def send_action_digests(db: Database):
+    """Записать сводки новых действий владельцам книг в режиме сводки"""
+    try:
+        digests = await db.enqueue_action_digests()
+        if digests:
+            print(f"[{datetime.now()}] Queued {digests} action digest(s)")
+    except Exception as e:
+        print(f"[{datetime.now()}] Error in action digests: {e}")
+
+
+async def purge_outbox(db: Database):
+    """Удалить старые отправленные уведомления"""
+    try:
+        purged = await db.purge_outbox()
+        if purged:
+            print(f"[{datetime.now()}] Purged {purged} delivered notification(s)")
+    except Exception as e:
+        print(f"[{datetime.now()}] Error in outbox purge: {e}")
 
 
-def setup_scheduler():
-    """Настроить планировщик задач"""
+def setup_scheduler(db: Database):
+    """Настроить планировщик задач (база данных передаётся в задачи)"""
     scheduler = AsyncIOScheduler()
     
-    # Автоподтверждение каждые 30 минут
+    # Автоподтверждение и истечение показа выполняет DeadlineScheduler точно в срок
+    
+    # Перестройка разреженных ключей очереди раз в сутки
+    scheduler.add_job(
+        rebalance_queues,
+        'interval',
+        args=[db],
+        hours=24,
+        id='rebalance_queues',
+        replace_existing=True
+    )
+    
+    # Сверка очередей и сроков в памяти с базой данных каждый час
+    scheduler.add_job(
+        verify_queue_index,
+        'interval',
+        args=[db],
+        hours=1,
+        id='verify_queue_index',
+        replace_existing=True
+    )
+    
+    # Сверка счётчиков статистики
     scheduler.add_job(
-        auto_confirm_old_actions,
+        reconcile_statistics,
         'interval',
-        minutes=30,
-        id='auto_confirm',
+        args=[db],
+        hours=config.STATS_RECONCILE_HOURS,
+        id='reconcile_statistics',
         replace_existing=True
     )
     
-    # Проверка завершённых книг каждые 15 минут
+    # Сводки действий для владельцев книг, выбравших режим сводки
     scheduler.add_job(
-        check_completed_books,
+        send_action_digests,
         'interval',
-        minutes=15,
-        id='check_books',
+        args=[db],
+        minutes=config.DIGEST_INTERVAL_MINUTES,
+        id='send_action_digests',
         replace_existing=True
     )
     
-    # Удаление просроченных платных книг каждые 6 часов
+    # Очистка доставленных уведомлений раз в сутки
     scheduler.add_job(
-        remove_expired_paid_books,
+        purge_outbox,
         'interval',
-        hours=6,
-        id='remove_expired',
+        args=[db],
+        hours=24,
+        id='purge_outbox',
         replace_existing=True
     )
     
@@ -77,3 +146,70 @@ def setup_scheduler():
     print("Scheduler started")
     
     return scheduler
+
+
+class DeadlineScheduler:
+    """Фоновая задача: спит до ближайшего срока и обрабатывает наступившие пачкой"""
+
+    def __init__(self, db: Database, clock=None):
+        self.db = db
+        self.clock = clock or SystemClock()
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {'wakeups': 0, 'actions_due': 0, 'books_due': 0, 'lag_max': 0.0, 'retries': 0}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _sleep_until(self, deadline: Optional[datetime]):
+        """Ждать срока или появления более раннего срока"""
+        index = self.db.deadlines
+        waiters = [asyncio.create_task(index.changed.wait())]
+        if deadline is not None:
+            delay = (deadline - self.clock.now()).total_seconds()
+            waiters.append(asyncio.create_task(self.clock.sleep(max(0.0, delay))))
+        try:
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for waiter in waiters:
+                waiter.cancel()
+
+    async def _run(self):
+        index = self.db.deadlines
+        while True:
+            index.changed.clear()
+            now = self.clock.now()
+            deadline = index.next_deadline()
+            if deadline is None or deadline > now:
+                await self._sleep_until(deadline)
+                continue
+
+            now = self.clock.now()
+            due = index.pop_due(now)
+            self.metrics['wakeups'] += 1
+            self.metrics['actions_due'] += len(due[ACTION])
+            self.metrics['books_due'] += len(due[BOOK])
+            self.metrics['lag_max'] = max(self.metrics['lag_max'], (now - deadline).total_seconds())
+
+            # Одна транзакция на все наступившие сроки каждого вида; при ошибке
+            # (например, занятой БД) сроки возвращаются в кучу с короткой задержкой
+            retry_at = now + timedelta(seconds=config.DEADLINE_RETRY_SECONDS)
+            if due[ACTION] and not await auto_confirm_old_actions(self.db, now=now):
+                index.restore(ACTION, due[ACTION], retry_at)
+                self.metrics['retries'] += 1
+            if due[BOOK] and not await remove_expired_paid_books(self.db, now=now):
+                index.restore(BOOK, due[BOOK], retry_at)
+                self.metrics['retries'] += 1
+
+    def get_metrics(self) -> Dict:
+        """Пробуждения, обработанные сроки, повторы после ошибок и максимальное опоздание (сек)"""
+        return {**self.metrics, 'pending': len(self.db.deadlines), 'next': self.db.deadlines.next_deadline()}
@@ -0,0 +1,324 @@
+"""
+Очередь исходящих сообщений Bot API с ограничением скорости
+
+Все сообщения бота проходят через одну очередь с приоритетами:
+- глобальный лимит (token bucket, около 30 сообщений в секунду);
+- лимит на чат: 1 сообщение в секунду, для групп — 20 в минуту
+  (с небольшим запасом на серию ответов подряд);
+- TelegramRetryAfter приостанавливает отправку на указанное время, сообщение
+  возвращается в очередь;
+- ответы пользователю (INTERACTIVE) отправляются раньше уведомлений и рассылок.
+
+Уведомления ставятся в очередь методами send_message/send_photo/send_media_group. Ответы
+обработчиков (message.answer и т.п.) попадают в очередь через middleware
+сессии бота, поэтому тоже учитываются в лимитах.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: меньше — раньше
+INTERACTIVE = 0  # Ответы на действия пользователя
+NOTIFICATION = 1  # Уведомления о действиях с книгами
+BULK = 2  # Массовые уведомления планировщика
+
+PRIORITY_NAMES = {INTERACTIVE: 'interactive', NOTIFICATION: 'notification', BULK: 'bulk'}
+
+# Запрос выполняется самой очередью: middleware не ставит его в очередь повторно
+_dispatching = contextvars.ContextVar('sender_dispatching', default=False)
+
+
+class SendJob:
+    """Сообщение в очереди"""
+
+    __slots__ = ('priority', 'seq', 'chat_id', 'call', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, priority: int, seq: int, chat_id: int, call: Callable[[], Awaitable]):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.call = call
+        self.future = asyncio.get_running_loop().create_future()
+        # Ошибка доставки логируется очередью; вызывающий может не ждать результат
+        self.future.add_done_callback(lambda future: future.cancelled() or future.exception())
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other: 'SendJob') -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class SenderMetrics:
+    """Счётчики очереди: отправлено, повторы, потери, задержка доставки"""
+
+    def __init__(self):
+        self.enqueued = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.sent = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.failed = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.dropped = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.retried = 0
+        self.retry_after = 0
+        self.latency_total = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.latency_max = {name: 0.0 for name in PRIORITY_NAMES.values()}
+
+    def record_sent(self, priority: str, latency: float):
+        self.sent[priority] += 1
+        self.latency_total[priority] += latency
+        if latency > self.latency_max[priority]:
+            self.latency_max[priority] = latency
+
+    def snapshot(self, depth: int, in_flight: int) -> Dict:
+        """Текущие значения метрик"""
+        return {
+            'queue_depth': depth,
+            'in_flight': in_flight,
+            'retried': self.retried,
+            'retry_after': self.retry_after,
+            'priorities': {
+                name: {
+                    'enqueued': self.enqueued[name],
+                    'sent': self.sent[name],
+                    'failed': self.failed[name],
+                    'dropped': self.dropped[name],
+                    'latency_avg_ms': round(self.latency_total[name] * 1000 / self.sent[name], 3)
+                    if self.sent[name] else 0.0,
+                    'latency_max_ms': round(self.latency_max[name] * 1000, 3),
+                }
+                for name in PRIORITY_NAMES.values()
+            },
+        }
+
+
+class OutboundSender:
+    """Очередь исходящих сообщений с глобальным лимитом и лимитами на чат"""
+
+    def __init__(self, bot=None, rate: float = config.SEND_RATE_PER_SECOND,
+                 chat_per_second: float = config.SEND_CHAT_PER_SECOND,
+                 group_per_minute: int = config.SEND_GROUP_PER_MINUTE,
+                 chat_burst: int = config.SEND_CHAT_BURST,
+                 max_retries: int = config.SEND_MAX_RETRIES,
+                 max_queue: int = config.SEND_QUEUE_MAX):
+        self.bot = bot
+        self.rate = rate
+        self.chat_rate = chat_per_second
+        self.group_rate = group_per_minute / 60
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self.metrics = SenderMetrics()
+        self._queue: List[SendJob] = []
+        # Отложенные сообщения: (время готовности, задание)
+        self._delayed: List = []
+        self._seq = itertools.count()
+        # Лимиты чатов: chat_id -> (доступные сообщения, время расчёта)
+        self._chat_tokens: Dict[int, tuple] = {}
+        self._chat_paused_until: Dict[int, float] = {}
+        self._tokens = float(rate)
+        self._tokens_at = time.monotonic()
+        self._paused_until = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight = set()
+
+    def set_bot(self, bot):
+        """Бот, через которого отправляются уведомления"""
+        self.bot = bot
+
+    # ===== Постановка в очередь =====
+    def send_message(self, chat_id: int, text: str, priority: int = NOTIFICATION, **kwargs) -> asyncio.Future:
+        """Поставить сообщение в очередь; future завершается после отправки"""
+        return self.submit(chat_id, lambda: self.bot.send_message(chat_id, text, **kwargs), priority)
+
+    def send_photo(self, chat_id: int, photo: str, priority: int = NOTIFICATION, **kwargs) -> asyncio.Future:
+        """Поставить фото в очередь; future завершается после отправки"""
+        return self.submit(chat_id, lambda: self.bot.send_photo(chat_id, photo, **kwargs), priority)
+
+    def send_media_group(self, chat_id: int, media: list, priority: int = NOTIFICATION, **kwargs) -> asyncio.Future:
+        """Поставить альбом (2–10 фото) в очередь; future завершается после отправки"""
+        return self.submit(chat_id, lambda: self.bot.send_media_group(chat_id, media, **kwargs), priority)
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable], priority: int = NOTIFICATION) -> asyncio.Future:
+        """Поставить в очередь произвольный запрос к чату"""
+        job = SendJob(priority, next(self._seq), chat_id, call)
+        name = PRIORITY_NAMES[priority]
+        self.metrics.enqueued[name] += 1
+
+        # При переполнении теряются только массовые уведомления
+        if priority == BULK and self.depth() >= self.max_queue:
+            self.metrics.dropped[name] += 1
+            job.future.set_exception(OverflowError("Outbound queue is full"))
+            return job.future
+
+        heapq.heappush(self._queue, job)
+        self._wake()
+        return job.future
+
+    async def middleware(self, make_request, bot, method):
+        """Middleware сессии бота: запросы к чатам проходят через очередь"""
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None or _dispatching.get() or self._worker is None:
+            return await make_request(bot, method)
+        return await self.submit(chat_id, lambda: make_request(bot, method), INTERACTIVE)
+
+    # ===== Обработка очереди =====
+    async def start(self):
+        """Запустить обработку очереди"""
+        if self._worker is None:
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Дождаться отправки очереди (не дольше timeout) и остановить обработку"""
+        if self._worker is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self.depth() or self._in_flight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        for job in self._queue + [job for _, job in self._delayed]:
+            self.metrics.dropped[PRIORITY_NAMES[job.priority]] += 1
+            job.future.cancel()
+        self._queue.clear()
+        self._delayed.clear()
+
+    def depth(self) -> int:
+        """Число сообщений, ожидающих отправки"""
+        return len(self._queue) + len(self._delayed)
+
+    def get_metrics(self) -> Dict:
+        """Глубина очереди, задержка доставки, повторы и потери"""
+        return self.metrics.snapshot(self.depth(), len(self._in_flight))
+
+    def _wake(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _chat_wait(self, chat_id: int, now: float) -> float:
+        """Сколько секунд чат не может принять следующее сообщение"""
+        # Отрицательные chat_id и @username — группы и каналы
+        is_group = not isinstance(chat_id, int) or chat_id < 0
+        rate = self.group_rate if is_group else self.chat_rate
+        tokens, updated_at = self._chat_tokens.get(chat_id, (self.chat_burst, now))
+        tokens = min(self.chat_burst, tokens + (now - updated_at) * rate)
+        self._chat_tokens[chat_id] = (tokens, now)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+        return max(wait, self._chat_paused_until.get(chat_id, 0.0) - now)
+
+    def _take_chat_token(self, chat_id: int):
+        tokens, updated_at = self._chat_tokens[chat_id]
+        self._chat_tokens[chat_id] = (tokens - 1, updated_at)
+        # Чаты с полным запасом не хранятся: память не растёт с числом собеседников
+        if len(self._chat_tokens) > 10000:
+            now = time.monotonic()
+            self._chat_tokens = {
+                chat: (tokens, at) for chat, (tokens, at) in self._chat_tokens.items()
+                if tokens + (now - at) * self.group_rate < self.chat_burst
+            }
+            self._chat_paused_until = {
+                chat: until for chat, until in self._chat_paused_until.items() if until > now
+            }
+
+    def _delay(self, job: SendJob, ready_at: float):
+        heapq.heappush(self._delayed, (ready_at, job.seq, job))
+
+    async def _next_job(self) -> SendJob:
+        """Задание с наивысшим приоритетом, чат которого готов принять сообщение"""
+        while True:
+            now = time.monotonic()
+            while self._delayed and self._delayed[0][0] <= now:
+                heapq.heappush(self._queue, heapq.heappop(self._delayed)[2])
+
+            if self._queue:
+                job = heapq.heappop(self._queue)
+                wait = self._chat_wait(job.chat_id, now)
+                if wait > 0:
+                    self._delay(job, now + wait)
+                    continue
+                return job
+
+            timeout = self._delayed[0][0] - now if self._delayed else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _take_token(self):
+        """Дождаться свободного места в глобальном лимите"""
+        while True:
+            now = time.monotonic()
+            if self._paused_until > now:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+            self._tokens = min(self.rate, self._tokens + (now - self._tokens_at) * self.rate)
+            self._tokens_at = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    async def _run(self):
+        while True:
+            job = await self._next_job()
+            await self._take_token()
+            self._take_chat_token(job.chat_id)
+            task = asyncio.create_task(self._execute(job))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _execute(self, job: SendJob):
+        name = PRIORITY_NAMES[job.priority]
+        job.attempts += 1
+        _dispatching.set(True)
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as e:
+            # Telegram просит подождать: приостанавливаем чат и общую отправку
+            self.metrics.retry_after += 1
+            resume_at = time.monotonic() + e.retry_after
+            self._paused_until = max(self._paused_until, resume_at)
+            self._chat_paused_until[job.chat_id] = resume_at
+            logger.warning(f"Flood control for chat {job.chat_id}: retry in {e.retry_after}s")
+            self._retry(job, name, e, resume_at)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            self._retry(job, name, e, time.monotonic() + 2 ** job.attempts)
+        except Exception as e:
+            self.metrics.failed[name] += 1
+            logger.error(f"Error sending to chat {job.chat_id}: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            self.metrics.record_sent(name, time.monotonic() - job.enqueued_at)
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _retry(self, job: SendJob, name: str, error: Exception, ready_at: float):
+        """Вернуть сообщение в очередь или отказаться после max_retries попыток"""
+        if job.attempts > self.max_retries:
+            self.metrics.dropped[name] += 1
+            logger.error(f"Dropped message to chat {job.chat_id} after {job.attempts} attempts: {error}")
+            if not job.future.done():
+                job.future.set_exception(error)
+            return
+        self.metrics.retried += 1
+        self._delay(job, ready_at)
+        self._wake()
+
+
+# Общая очередь исходящих сообщений для обработчиков и планировщика
+sender = OutboundSender()
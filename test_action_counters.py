@@ -0,0 +1,93 @@
+"""
+Тесты счётчиков подтверждённых действий пользователя по типам книг: ручное и
+автоматическое подтверждение, удаление книги, заполнение при миграции
+
+Запуск: python test_action_counters.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from database import Database
+
+
+async def setup(db: Database):
+    for user_id in range(1, 6):
+        await db.add_user(user_id, f"user{user_id}")
+    paid_id = await db.add_book(1, "Платная", "https://example.com", 100, 'paid')
+    free_id = await db.add_book(2, "Бесплатная", "https://example.com", 0, 'free')
+    return paid_id, free_id
+
+
+async def check_counters(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        paid_id, free_id = await setup(db)
+        await db.confirm_action(await db.add_action(paid_id, 3, 'purchase', 'file_id'), 'confirmed')
+        await db.confirm_action(await db.add_action(paid_id, 4, 'purchase', 'file_id'), 'rejected')
+        old_action = await db.add_action(free_id, 3, 'rating', 'file_id')
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE user_actions SET created_at = '2000-01-01 00:00:00' WHERE action_id = ?",
+                     (old_action,))
+        conn.commit()
+        conn.close()
+        assert len(await db.auto_confirm_old_actions()) == 1
+
+        assert await db.get_user_confirmed_actions_by_type(3) == {'paid': 1, 'free': 1, 'total': 2}
+        assert await db.get_user_confirmed_actions_by_type(4) == {'paid': 0, 'free': 0, 'total': 0}
+        assert await db.get_user_confirmed_actions_by_type(404) == {'paid': 0, 'free': 0, 'total': 0}
+
+        # После удаления книги действия пользователя не пропадают
+        await db.complete_book(paid_id)
+        await db.complete_book(free_id)
+        assert await db.get_user_confirmed_actions_by_type(3) == {'paid': 1, 'free': 1, 'total': 2}
+    finally:
+        await db.close()
+
+
+async def check_backfill(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        paid_id, free_id = await setup(db)
+        for user_id in (3, 4):
+            await db.confirm_action(await db.add_action(paid_id, user_id, 'purchase', 'file_id'), 'confirmed')
+        await db.confirm_action(await db.add_action(free_id, 3, 'review', 'file_id'), 'confirmed')
+    finally:
+        await db.close()
+
+    # База до появления счётчиков: миграция считает их по действиям
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE users SET confirmed_paid_actions = 0, confirmed_free_actions = 0")
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+
+    db = Database(db_path)
+    await db.connect()
+    try:
+        assert await db.get_user_confirmed_actions_by_type(3) == {'paid': 1, 'free': 1, 'total': 2}
+        assert await db.get_user_confirmed_actions_by_type(4) == {'paid': 1, 'free': 0, 'total': 1}
+    finally:
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_counters():
+    run(check_counters, 'counters.db')
+
+
+def test_backfill():
+    run(check_backfill, 'backfill.db')
+
+
+if __name__ == "__main__":
+    for test in (test_counters, test_backfill):
+        test()
+        print(f"✅ {test.__name__}")
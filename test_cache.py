@@ -0,0 +1,155 @@
+"""
+Тесты кэша рекомендаций: общая загрузка, отмена, сброс при записи и изменения другим процессом
+
+Запуск: python test_cache.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from cache import QueryCache
+from database import Database
+from handlers.feed import get_viewer_actions
+
+
+async def check_stampede():
+    """Одновременные запросы ждут одну загрузку"""
+    cache = QueryCache(ttl=60)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return [calls]
+
+    results = await asyncio.gather(*(cache.get_or_load('key', loader) for _ in range(20)))
+    assert calls == 1
+    assert all(result == [1] for result in results)
+    assert await cache.get_or_load('key', loader) == [1]
+    metrics = cache.get_metrics()
+    assert (metrics['misses'], metrics['shared'], metrics['hits']) == (1, 19, 1)
+
+    # Сброс во время загрузки: результат возвращается, но не сохраняется
+    async def slow_loader():
+        cache.invalidate('key')
+        return 'stale'
+
+    cache.invalidate()
+    assert await cache.get_or_load('key', slow_loader) == 'stale'
+    assert await cache.get_or_load('key', loader) == [2]
+
+    # TTL истёк — запись загружается заново
+    cache.ttl = 0
+    cache.invalidate()
+    await cache.get_or_load('key', loader)
+    await cache.get_or_load('key', loader)
+    assert calls == 4
+
+
+async def check_invalidation(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    for user_id in range(1, 4):
+        await db.add_user(user_id, f"user{user_id}")
+    book_id = await db.add_book(1, "Книга", "https://example.com", 0, 'free')
+
+    books = await db.get_recommendations('free')
+    assert [book.book_id for book in books] == [book_id]
+    assert await db.get_recommendations('free') is books
+
+    # Подтверждение действия меняет счётчик книги в рекомендациях
+    action_id = await db.add_action(book_id, 2, 'rating', 'file_id')
+    await db.confirm_action(action_id, 'confirmed')
+    assert (await db.get_recommendations('free'))[0].confirmed_actions == 1
+
+    # Новая книга сбрасывает только свой тип
+    paid = await db.get_recommendations('paid')
+    second_id = await db.add_book(2, "Вторая", "https://example.com", 0, 'free')
+    assert await db.get_recommendations('paid') is paid
+    assert [book.book_id for book in await db.get_recommendations('free')] == [book_id, second_id]
+
+    # Статусы зрителя в карусели сбрасываются при изменении его действий
+    cards = [{'book_id': second_id}]
+    statuses = await get_viewer_actions(db, 'free', cards, 3)
+    assert statuses == {} and await get_viewer_actions(db, 'free', cards, 3) is statuses
+    action_id = await db.add_action(second_id, 3, 'rating', 'file_id')
+    assert (await get_viewer_actions(db, 'free', cards, 3))[second_id].status == 'pending'
+    await db.confirm_action(action_id, 'rejected')
+    assert (await get_viewer_actions(db, 'free', cards, 3))[second_id].status == 'rejected'
+    await db.delete_action(action_id)
+    assert await get_viewer_actions(db, 'free', cards, 3) == {}
+
+    await db.complete_book(book_id)
+    assert [book.book_id for book in await db.get_recommendations('free')] == [second_id]
+
+    # Запись другим процессом обнаруживается по PRAGMA data_version
+    db.data_version_interval = 0
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE books SET title = 'Изменено' WHERE book_id = ?", (second_id,))
+    conn.execute(
+        """INSERT INTO books (user_id, title, link, book_type, queue_position, status)
+           VALUES (3, 'Внешняя', 'https://example.com', 'free', 1, 'in_recommendations')"""
+    )
+    conn.commit()
+    conn.close()
+    books = await db.get_recommendations('free')
+    assert [book.title for book in books] == ['Внешняя', 'Изменено']
+    assert (await db.get_book_by_id(second_id)).position == 2
+
+    metrics = db.get_cache_metrics()
+    await db.close()
+    assert metrics['hits'] >= 2 and metrics['invalidations'] >= 4
+
+
+async def check_cancellation():
+    """Отмена запроса, начавшего загрузку, не отменяет её для остальных"""
+    cache = QueryCache(ttl=60)
+    calls = 0
+
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.02)
+        return 'value'
+
+    first = asyncio.create_task(cache.get_or_load('key', loader))
+    await asyncio.sleep(0)
+    second = asyncio.create_task(cache.get_or_load('key', loader))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert await second == 'value'
+    assert first.cancelled()
+    assert await cache.get_or_load('key', loader) == 'value'
+    assert calls == 1
+
+    # Ошибка загрузки получают все ожидающие, следующий запрос загружает заново
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise ValueError('boom')
+
+    cache.invalidate()
+    results = await asyncio.gather(*(cache.get_or_load('key', failing) for _ in range(3)),
+                                   return_exceptions=True)
+    assert all(isinstance(result, ValueError) for result in results)
+    assert await cache.get_or_load('key', loader) == 'value'
+
+
+def test_stampede():
+    asyncio.run(check_stampede())
+
+
+def test_cancellation():
+    asyncio.run(check_cancellation())
+
+
+def test_invalidation():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check_invalidation(os.path.join(tmp_dir, 'cache.db')))
+
+
+if __name__ == "__main__":
+    for test in (test_stampede, test_cancellation, test_invalidation):
+        test()
+        print(f"✅ {test.__name__}")
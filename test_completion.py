@@ -0,0 +1,122 @@
+"""
+Тесты завершения книг в транзакции подтверждения: автоподтверждение → завершение →
+продвижение следующей книги в рекомендации
+
+Запуск: python test_completion.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import config
+from database import Database
+
+
+async def setup(db: Database, books: int):
+    for user_id in range(1, 40):
+        await db.add_user(user_id, f"user{user_id}")
+    return [
+        await db.add_book(owner_id, f"Книга {owner_id}", "https://example.com", 0, 'free')
+        for owner_id in range(1, books + 1)
+    ]
+
+
+async def confirm_times(db: Database, book_id: int, first_user: int, count: int):
+    results = []
+    for user_id in range(first_user, first_user + count):
+        action_id = await db.add_action(book_id, user_id, 'rating', 'file_id')
+        results.append(await db.confirm_action(action_id, 'confirmed'))
+    return results
+
+
+async def check_auto_confirm_chain(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_ids = await setup(db, config.MAX_BOOKS_IN_RECOMMENDATIONS + 1)
+        first, waiting = book_ids[0], book_ids[-1]
+        assert (await db.get_book_by_id(waiting)).status == 'in_queue'
+
+        await confirm_times(db, first, 20, config.ACTIONS_REQUIRED - 1)
+        last_action = await db.add_action(first, 30, 'rating', 'file_id')
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE user_actions SET created_at = '2000-01-01 00:00:00' WHERE action_id = ?",
+                     (last_action,))
+        conn.commit()
+        conn.close()
+
+        # Последнее действие подтверждается автоматически, книга завершается в той же транзакции
+        confirmed = await db.auto_confirm_old_actions()
+        assert [(action.action_id, action.book_completed) for action in confirmed] == [(last_action, True)]
+        assert confirmed[0].title == "Книга 1" and confirmed[0].book_owner_id == 1
+        assert await db.get_book_by_id(first) is None
+
+        # Уведомления помощнику и владельцу завершённой книги записаны в outbox
+        conn = sqlite3.connect(db_path)
+        notices = conn.execute(
+            "SELECT chat_id, kind FROM outbox WHERE kind IN ('action_auto_confirmed', 'book_completed')"
+        ).fetchall()
+        conn.close()
+        assert notices == [(30, 'action_auto_confirmed'), (1, 'book_completed')]
+
+        # Следующая книга очереди сразу в рекомендациях
+        promoted = await db.get_book_by_id(waiting)
+        assert promoted.status == 'in_recommendations'
+        assert promoted.recommendations_started_at is not None
+        assert promoted.position == config.MAX_BOOKS_IN_RECOMMENDATIONS
+        assert [book.book_id for book in await db.get_recommendations('free')] == book_ids[1:]
+        assert db.queue.size('free') == config.MAX_BOOKS_IN_RECOMMENDATIONS
+        assert not any((await db.verify_queue_index()).values())
+    finally:
+        await db.close()
+
+
+async def check_manual_confirm(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_ids = await setup(db, config.MAX_BOOKS_IN_RECOMMENDATIONS + 2)
+        results = [action.completed_book for action in
+                   await confirm_times(db, book_ids[1], 20, config.ACTIONS_REQUIRED)]
+        assert results[:-1] == [None] * (config.ACTIONS_REQUIRED - 1)
+        assert results[-1].book_id == book_ids[1] and results[-1].user_id == 2
+
+        # Отклонение не меняет счётчики и не завершает книгу
+        action_id = await db.add_action(book_ids[0], 35, 'rating', 'file_id')
+        rejected = await db.confirm_action(action_id, 'rejected')
+        assert rejected.status == 'rejected' and rejected.completed_book is None
+
+        recommended = [book.book_id for book in await db.get_recommendations('free')]
+        assert recommended == [book_ids[0]] + book_ids[2:config.MAX_BOOKS_IN_RECOMMENDATIONS + 1]
+
+        # Книги, набравшие действия до обновления, завершаются при запуске
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE books SET confirmed_actions = ? WHERE book_id = ?",
+                     (config.ACTIONS_REQUIRED, book_ids[0]))
+        conn.commit()
+        conn.close()
+        completed = await db.complete_reached_books()
+        assert [book.book_id for book in completed] == [book_ids[0]]
+        assert [book.book_id for book in await db.get_recommendations('free')] == book_ids[2:]
+    finally:
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_auto_confirm_chain():
+    run(check_auto_confirm_chain, 'auto.db')
+
+
+def test_manual_confirm():
+    run(check_manual_confirm, 'manual.db')
+
+
+if __name__ == "__main__":
+    for test in (test_auto_confirm_chain, test_manual_confirm):
+        test()
+        print(f"✅ {test.__name__}")
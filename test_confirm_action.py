@@ -0,0 +1,94 @@
+"""
+Тесты атомарного подтверждения действия: 50 одновременных нажатий засчитываются
+один раз, в том числе из двух процессов; чужая книга не подтверждается
+
+Запуск: python test_confirm_action.py (или через pytest)
+"""
+import asyncio
+import os
+import tempfile
+
+from database import Database
+
+OWNER, HELPER = 1, 2
+
+
+async def setup(db: Database):
+    await db.add_user(OWNER, "owner")
+    await db.add_user(HELPER, "helper")
+    book_id = await db.add_book(OWNER, "Книга", "https://example.com", 0, 'free')
+    helper_book = await db.add_book(HELPER, "Книга помощника", "https://example.com", 0, 'paid')
+    action_id = await db.add_action(book_id, HELPER, 'review', 'file_id')
+    return book_id, helper_book, action_id
+
+
+async def check_counted_once(db: Database, book_id: int, helper_book: int):
+    assert (await db.get_book_by_id(book_id)).confirmed_actions == 1
+    assert (await db.get_book_by_id(helper_book)).actions_limit == 1
+    user = await db.get_user(HELPER)
+    assert user.confirmed_actions == 1 and user.confirmed_free_actions == 1
+    assert (await db.get_statistics())['actions']['confirmed'] == 1
+
+
+async def check_concurrent_confirms(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_id, helper_book, action_id = await setup(db)
+
+        # Чужой пользователь не может подтвердить действие
+        assert await db.confirm_action(action_id, 'confirmed', owner_id=HELPER) is None
+        assert (await db.get_action_by_id(action_id)).status == 'pending'
+
+        results = await asyncio.gather(*(
+            db.confirm_action(action_id, 'confirmed', owner_id=OWNER) for _ in range(50)
+        ))
+        applied = [result for result in results if result is not None]
+        assert len(applied) == 1
+        assert applied[0].title == "Книга" and applied[0].user_id == HELPER
+        assert applied[0].book_owner_id == OWNER and applied[0].completed_book is None
+        await check_counted_once(db, book_id, helper_book)
+
+        # Отклонение после подтверждения тоже ничего не меняет
+        assert await db.confirm_action(action_id, 'rejected', owner_id=OWNER) is None
+        assert (await db.get_action_by_id(action_id)).status == 'confirmed'
+    finally:
+        await db.close()
+
+
+async def check_two_processes(db_path: str):
+    first = Database(db_path)
+    await first.connect()
+    second = Database(db_path)
+    await second.connect()
+    try:
+        book_id, helper_book, action_id = await setup(first)
+        # Два процесса с отдельными пулами: блокировка писателя не общая
+        results = await asyncio.gather(*(
+            database.confirm_action(action_id, 'confirmed', owner_id=OWNER)
+            for _ in range(25) for database in (first, second)
+        ))
+        assert sum(result is not None for result in results) == 1
+        await check_counted_once(first, book_id, helper_book)
+    finally:
+        await first.close()
+        await second.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_concurrent_confirms():
+    run(check_concurrent_confirms, 'confirm.db')
+
+
+def test_two_processes():
+    run(check_two_processes, 'processes.db')
+
+
+if __name__ == "__main__":
+    for test in (test_concurrent_confirms, test_two_processes):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,201 @@
+"""
+Тесты планировщика сроков: автоподтверждение и истечение показа точно в срок,
+пробуждение при появлении более раннего срока, загрузка сроков при запуске,
+повтор после ошибки обработки
+
+Запуск: python test_deadlines.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+from datetime import timedelta
+
+import config
+from database import Database
+from deadlines import ACTION, BOOK, utc_now
+from scheduler import DeadlineScheduler
+
+
+class FakeClock:
+    """Часы с ручной перемоткой: sleep ждёт, пока время не будет промотано"""
+
+    def __init__(self):
+        self._now = utc_now()
+        self._advanced = asyncio.Condition()
+
+    def now(self):
+        return self._now
+
+    async def sleep(self, seconds: float):
+        target = self._now + timedelta(seconds=seconds)
+        async with self._advanced:
+            await self._advanced.wait_for(lambda: self._now >= target)
+
+    async def advance(self, delta: timedelta):
+        async with self._advanced:
+            self._now += delta
+            self._advanced.notify_all()
+
+
+def notifications(db_path: str):
+    """Уведомления, записанные в outbox: (получатель, вид)"""
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT chat_id, kind FROM outbox ORDER BY outbox_id").fetchall()
+    conn.close()
+    return rows
+
+
+async def wait_for(predicate, timeout: float = 2.0):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not await predicate():
+        assert loop.time() < deadline, "условие не выполнено вовремя"
+        await asyncio.sleep(0.01)
+
+
+async def check_deadlines(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(db, clock)
+    scheduler.start()
+    try:
+        for user_id in (1, 2):
+            await db.add_user(user_id, f"user{user_id}")
+        paid_id = await db.add_book(1, "Платная", "https://example.com", 100, 'paid')
+        free_id = await db.add_book(2, "Бесплатная", "https://example.com", 0, 'free')
+        assert (await db.get_book_by_id(paid_id)).status == 'in_recommendations'
+        assert len(db.deadlines) == 1
+
+        # Планировщик спит до срока книги; более раннее действие его будит
+        await asyncio.sleep(0.05)
+        action_id = await db.add_action(free_id, 1, 'rating', 'file_id')
+        assert len(db.deadlines) == 2
+
+        async def action_status():
+            return (await db.get_action_by_id(action_id)).status
+
+        await clock.advance(timedelta(hours=config.AUTO_CONFIRM_HOURS - 1))
+        await asyncio.sleep(0.05)
+        assert await action_status() == 'pending'
+
+        await clock.advance(timedelta(hours=2))
+
+        async def action_confirmed():
+            return await action_status() == 'auto_confirmed'
+
+        await wait_for(action_confirmed)
+        assert notifications(db_path)[-1] == (1, 'action_auto_confirmed')
+        assert await db.get_book_by_id(paid_id) is not None
+
+        assert len(db.deadlines) == 1
+        await clock.advance(timedelta(days=config.BOOK_EXPIRATION_DAYS))
+
+        async def book_removed():
+            return await db.get_book_by_id(paid_id) is None
+
+        await wait_for(book_removed)
+        assert notifications(db_path)[-1] == (1, 'book_expired')
+        assert len(db.deadlines) == 0
+
+        metrics = scheduler.get_metrics()
+        assert metrics['actions_due'] == 1 and metrics['books_due'] == 1
+        assert metrics['wakeups'] == 2 and metrics['pending'] == 0
+    finally:
+        await scheduler.stop()
+        await db.close()
+
+
+async def check_reload(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        await db.add_user(1, "user1")
+        await db.add_user(2, "user2")
+        paid_id = await db.add_book(1, "Платная", "https://example.com", 100, 'paid')
+        action_id = await db.add_action(paid_id, 2, 'rating', 'file_id')
+        # Подтверждённое вручную действие снимается с учёта
+        manual_id = await db.add_action(paid_id, 2, 'review', 'file_id')
+        await db.confirm_action(manual_id, 'confirmed')
+        assert len(db.deadlines) == 2
+    finally:
+        await db.close()
+
+    # После перезапуска сроки восстанавливаются из базы
+    db = Database(db_path)
+    await db.connect()
+    try:
+        assert len(db.deadlines) == 2
+        first = db.deadlines.next_deadline()
+        due = db.deadlines.pop_due(first + timedelta(days=config.BOOK_EXPIRATION_DAYS))
+        assert due == {ACTION: [action_id], BOOK: [paid_id]}
+    finally:
+        await db.close()
+
+
+async def check_retry(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    clock = FakeClock()
+    scheduler = DeadlineScheduler(db, clock)
+    scheduler.start()
+    try:
+        await db.add_user(1, "user1")
+        await db.add_user(2, "user2")
+        book_id = await db.add_book(1, "Бесплатная", "https://example.com", 0, 'free')
+        action_id = await db.add_action(book_id, 2, 'rating', 'file_id')
+
+        # Первая попытка падает (БД занята): срок возвращается в кучу
+        confirm = db.auto_confirm_old_actions
+        failures = []
+
+        async def busy_once(now=None):
+            if not failures:
+                failures.append(now)
+                raise sqlite3.OperationalError("database is locked")
+            return await confirm(now)
+
+        db.auto_confirm_old_actions = busy_once
+        await clock.advance(timedelta(hours=config.AUTO_CONFIRM_HOURS))
+
+        async def retry_armed():
+            return scheduler.get_metrics()['retries'] == 1
+
+        await wait_for(retry_armed)
+        assert len(db.deadlines) == 1
+        assert db.deadlines.next_deadline() == failures[0] + timedelta(seconds=config.DEADLINE_RETRY_SECONDS)
+
+        await clock.advance(timedelta(seconds=config.DEADLINE_RETRY_SECONDS))
+
+        async def action_confirmed():
+            return (await db.get_action_by_id(action_id)).status == 'auto_confirmed'
+
+        await wait_for(action_confirmed)
+        assert len(db.deadlines) == 0
+    finally:
+        await scheduler.stop()
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_deadlines():
+    run(check_deadlines, 'deadlines.db')
+
+
+def test_reload():
+    run(check_reload, 'reload.db')
+
+
+def test_retry():
+    run(check_retry, 'retry.db')
+
+
+if __name__ == "__main__":
+    for test in (test_deadlines, test_reload, test_retry):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,154 @@
+"""
+Тесты сводок действий для владельцев книг: пакетное подтверждение одной
+транзакцией, режим уведомлений сводкой и содержимое сводки
+
+Запуск: python test_digest.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import config
+from database import Database
+from keyboards import get_action_digest_keyboard, remove_action_buttons
+from outbox import render
+
+OWNER, OTHER_OWNER = 1, 2
+HELPERS = range(10, 10 + config.ACTIONS_REQUIRED + 2)
+
+
+def outbox_kinds(db_path: str, kind: str):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT chat_id FROM outbox WHERE kind = ? ORDER BY outbox_id", (kind,)).fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+async def setup(db: Database):
+    for user_id in (OWNER, OTHER_OWNER, *HELPERS):
+        await db.add_user(user_id, f"user{user_id}")
+    book_id = await db.add_book(OWNER, "Книга", "https://example.com", 0, 'free')
+    other_book = await db.add_book(OTHER_OWNER, "Чужая книга", "https://example.com", 0, 'free')
+    return book_id, other_book
+
+
+async def check_confirm_actions(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_id, other_book = await setup(db)
+        action_ids = [await db.add_action(book_id, user_id, 'rating', 'file_id') for user_id in HELPERS]
+        foreign = await db.add_action(other_book, HELPERS[0], 'rating', 'file_id')
+        await db.confirm_action(action_ids[0], 'rejected')
+
+        # Чужое и уже обработанное действия пропускаются, книга завершается один раз
+        confirmed = await db.confirm_actions(action_ids + [foreign], owner_id=OWNER)
+        assert [action.action_id for action in confirmed] == action_ids[1:]
+        assert all(action.book_completed for action in confirmed)
+        assert await db.get_book_by_id(book_id) is None
+        assert (await db.get_action_by_id(foreign)).status == 'pending'
+        assert list((await db.get_statistics())['daily'].values()) == [{'completed': 1, 'expired': 0}]
+        assert outbox_kinds(db_path, 'action_confirmed') == list(HELPERS[1:])
+        # Владельцу отвечает обработчик, уведомление о завершении не пишется
+        assert outbox_kinds(db_path, 'book_completed') == []
+        for user_id in HELPERS[1:]:
+            assert (await db.get_user_confirmed_actions_by_type(user_id))['free'] == 1
+
+        # Повторное нажатие ничего не меняет
+        assert await db.confirm_actions(action_ids, owner_id=OWNER) == []
+        assert await db.confirm_actions([]) == []
+        assert [action.action_id for action in await db.get_pending_actions(owner_id=OTHER_OWNER)] == [foreign]
+        assert await db.reconcile_statistics() == {}
+    finally:
+        await db.close()
+
+
+async def check_digest_mode(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_id, _ = await setup(db)
+        await db.add_action(book_id, HELPERS[0], 'rating', 'file_id')
+        await db.set_notify_mode(OWNER, 'digest')
+        assert (await db.get_user(OWNER)).notify_mode == 'digest'
+
+        # В режиме сводки действия не отправляются по одному
+        queued = [await db.add_action(book_id, user_id, 'rating', f"photo{user_id}") for user_id in HELPERS[1:4]]
+        assert outbox_kinds(db_path, 'action_submitted') == [OWNER]
+
+        assert await db.enqueue_action_digests() == 1
+        assert await db.enqueue_action_digests() == 0
+        assert outbox_kinds(db_path, 'action_digest') == [OWNER]
+        rows = await db.claim_outbox(10, lease_seconds=60)
+        digest = next(row for row in rows if row.kind == 'action_digest')
+        # Уже отправленное сразу действие в сводку не попадает
+        assert [action['action_id'] for action in digest.payload['actions']] == queued
+
+        album, summary = render(digest.kind, digest.payload)
+        assert [media.media for media in album['media']] == [f"photo{user_id}" for user_id in HELPERS[1:4]]
+        assert "@user11" in summary['text']
+        buttons = summary['reply_markup'].inline_keyboard
+        assert len(buttons) == len(queued) + 1
+        assert buttons[-1][0].callback_data == f"confirm_all:{queued[-1]}"
+
+        # Сводка ограничена DIGEST_MAX_ACTIONS, остальное — в следующей
+        original = config.DIGEST_MAX_ACTIONS
+        config.DIGEST_MAX_ACTIONS = 1
+        try:
+            later = [await db.add_action(book_id, user_id, 'rating', 'file_id') for user_id in HELPERS[4:6]]
+            assert await db.enqueue_action_digests() == 1
+        finally:
+            config.DIGEST_MAX_ACTIONS = original
+        assert (await db.get_user(OWNER)).last_digest_action_id == later[0]
+
+        # Возврат к мгновенным уведомлениям отправляет оставшиеся сразу
+        await db.set_notify_mode(OWNER, 'instant')
+        assert outbox_kinds(db_path, 'action_digest') == [OWNER] * 3
+        await db.add_action(book_id, HELPERS[6], 'rating', 'file_id')
+        assert outbox_kinds(db_path, 'action_submitted') == [OWNER] * 2
+    finally:
+        await db.close()
+
+
+def check_keyboards():
+    markup = get_action_digest_keyboard([5, 7])
+    rest = remove_action_buttons(markup, 5)
+    assert [row[0].callback_data for row in rest.inline_keyboard] == ["confirm_action:7:confirmed", "confirm_all:7"]
+    # После последнего действия «Подтвердить все» тоже убирается
+    assert remove_action_buttons(rest, 7) is None
+    assert remove_action_buttons(None, 7) is None
+
+    # Одно фото отправляется без альбома
+    single = render('action_digest', {'actions': [
+        {'action_id': 3, 'photo': 'p', 'title': "Книга", 'book_type': 'free', 'username': None}
+    ]})
+    assert single[0] == {'photo': 'p', 'caption': "1. 📚 Книга — @Аноним"}
+    many = render('action_digest', {'actions': [
+        {'action_id': n, 'photo': f"p{n}", 'title': "Книга", 'book_type': 'free', 'username': "u"}
+        for n in range(12)
+    ]})
+    assert [len(message.get('media', [])) for message in many] == [10, 2, 0]
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_confirm_actions():
+    run(check_confirm_actions, 'bulk.db')
+
+
+def test_digest_mode():
+    run(check_digest_mode, 'digest.db')
+
+
+def test_keyboards():
+    check_keyboards()
+
+
+if __name__ == "__main__":
+    for test in (test_confirm_actions, test_digest_mode, test_keyboards):
+        test()
+        print(f"✅ {test.__name__}")
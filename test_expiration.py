@@ -23,8 +23,8 @@ async def test_expiration():
         print("Нет книг в базе")
     
     print("\n--- Запуск проверки просроченных книг ---")
-    removed_count = await db.auto_remove_expired_books()
-    print(f"Удалено книг: {removed_count}\n")
+    removed_books = await db.auto_remove_expired_books()
+    print(f"Удалено книг: {len(removed_books)}\n")
     
     # Получаем все книги после удаления
     print("Книги в базе после проверки:")
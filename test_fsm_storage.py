@@ -0,0 +1,103 @@
+"""
+Тесты хранилища состояний FSM в SQLite: перезапуск, объединение записей, TTL и LRU
+
+Запуск: python test_fsm_storage.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from aiogram.fsm.storage.base import StorageKey
+
+from fsm_storage import SQLiteStorage
+from handlers.add_book import AddBookStates
+
+
+def make_key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=42, chat_id=user_id, user_id=user_id)
+
+
+async def check_restart(db_path: str):
+    storage = SQLiteStorage(db_path, flush_interval=None)
+    key = make_key(1)
+    await storage.set_state(key, AddBookStates.waiting_for_link)
+    await storage.update_data(key, {'book_type': 'paid'})
+    await storage.update_data(key, {'title': 'Книга'})
+    await storage.set_state(make_key(2), "waiting_for_screenshot")
+    await storage.set_state(make_key(2), None)
+
+    # Пять изменений двух пользователей — одна транзакция и по строке на пользователя
+    await storage.flush()
+    metrics = storage.get_metrics()
+    assert (metrics['flushes'], metrics['rows_written'], metrics['writes']) == (1, 2, 5)
+    await storage.close()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0] == 1
+    conn.close()
+
+    # После перезапуска сценарий продолжается с того же шага
+    storage = SQLiteStorage(db_path, flush_interval=None)
+    assert await storage.get_state(key) == AddBookStates.waiting_for_link.state
+    assert await storage.get_data(key) == {'book_type': 'paid', 'title': 'Книга'}
+    assert await storage.get_state(make_key(2)) is None
+    await storage.close()
+
+
+async def check_ttl_and_lru(db_path: str):
+    storage = SQLiteStorage(db_path, cache_size=3, flush_interval=None, state_ttl=3600)
+    for user_id in range(1, 11):
+        await storage.set_state(make_key(user_id), "waiting_for_screenshot")
+    # Несохранённые записи не вытесняются, после сброса кэш возвращается к лимиту
+    assert storage.get_metrics()['cached'] == 10
+    await storage.flush()
+    assert storage.get_metrics()['cached'] == 3
+    assert await storage.get_state(make_key(1)) == "waiting_for_screenshot"
+
+    # Брошенный сценарий сбрасывается при чтении и удаляется из файла при очистке
+    storage.state_ttl = 0
+    await asyncio.sleep(0.01)
+    assert await storage.get_state(make_key(1)) is None
+    assert await storage.sweep() >= 9
+    await storage.flush()
+    assert storage.get_metrics()['cached'] <= 1
+    await storage.close()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0] == 0
+    conn.close()
+
+
+async def check_background_flush(db_path: str):
+    storage = SQLiteStorage(db_path, flush_interval=0.01)
+    await storage.set_data(make_key(1), {'book_id': 7})
+    await asyncio.sleep(0.1)
+    assert storage.get_metrics()['dirty'] == 0
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT data FROM fsm_states").fetchone()[0] == '{"book_id": 7}'
+    conn.close()
+    await storage.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_restart():
+    run(check_restart, 'restart.db')
+
+
+def test_ttl_and_lru():
+    run(check_ttl_and_lru, 'ttl.db')
+
+
+def test_background_flush():
+    run(check_background_flush, 'flush.db')
+
+
+if __name__ == "__main__":
+    for test in (test_restart, test_ttl_and_lru, test_background_flush):
+        test()
+        print(f"✅ {test.__name__}")
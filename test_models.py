@@ -0,0 +1,128 @@
+"""
+Тесты записей строк: столбцы записей совпадают со схемой, методы чтения
+возвращают Book, Action, User и OutboxMessage, частичные записи содержат только
+выбранные столбцы
+
+Запуск: python test_models.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import config
+from database import Database
+from models import Action, Book, OutboxMessage, User
+
+OWNER, HELPER = 1, 2
+
+
+def table_columns(db_path: str, table: str):
+    conn = sqlite3.connect(db_path)
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    conn.close()
+    return columns
+
+
+async def check_records(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        # Новый столбец в миграции должен попасть и в запись
+        for record, table in ((Book, 'books'), (Action, 'user_actions'), (User, 'users'),
+                              (OutboxMessage, 'outbox')):
+            assert sorted(record.COLUMNS) == sorted(table_columns(db_path, table)), record
+
+        await db.add_user(OWNER, "owner")
+        await db.add_user(HELPER, "helper")
+        book_id = await db.add_book(OWNER, "Книга", "https://example.com", 0, 'free')
+        action_id = await db.add_action(book_id, HELPER, 'rating', 'file_id')
+
+        book = await db.get_book_by_id(book_id)
+        assert isinstance(book, Book) and not hasattr(book, '__dict__')
+        assert book.title == "Книга" and book.position == 1 and book.username is None
+        assert not hasattr(book, '__getitem__')
+        recommended = (await db.get_recommendations('free'))[0]
+        assert recommended.username == "owner" and recommended.position == 1
+
+        action = await db.get_action_by_id(action_id)
+        assert isinstance(action, Action) and action.book_owner_id == OWNER and action.title == "Книга"
+        assert (await db.get_pending_actions())[0].username == "helper"
+        feed_actions = await db.get_user_actions_for_books(HELPER, [book_id])
+        assert feed_actions[book_id].action_id == action_id and feed_actions[book_id].title is None
+
+        user = await db.get_user(HELPER)
+        assert isinstance(user, User) and user.username == "helper" and user.notify_mode == 'instant'
+    finally:
+        await db.close()
+
+
+def expect(error: type, call):
+    try:
+        call()
+    except error:
+        return
+    raise AssertionError(f"{error.__name__} expected")
+
+
+async def check_partial_records(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        # Запись без обязательных столбцов не создаётся, неизвестный столбец не выбирается
+        expect(TypeError, lambda: Book(book_id=1))
+        expect(ValueError, lambda: Book.select(columns=('book_id', 'owner')))
+
+        await db.add_user(OWNER, "owner")
+        await db.add_user(HELPER, "helper")
+        book_id = await db.add_book(OWNER, "Книга", "https://example.com", 0, 'free')
+        action_id = await db.add_action(book_id, HELPER, 'rating', 'file_id')
+
+        # Снимок очереди и статус действия читаются из части столбцов
+        queued = (await db.get_queue_books('free'))[0]
+        assert queued.title == "Книга" and queued.username == "owner" and queued.position == 1
+        expect(AttributeError, lambda: queued.link)
+        status = await db.get_user_action_for_book(HELPER, book_id)
+        assert status.action_id == action_id and status.status == 'pending'
+        expect(AttributeError, lambda: status.screenshot_file_id)
+
+        # Уведомления забираются столбцами CLAIM_COLUMNS
+        claimed = await db.claim_outbox(10, lease_seconds=60)
+        assert [message.kind for message in claimed] == ['action_submitted']
+        assert isinstance(claimed[0], OutboxMessage) and claimed[0].payload['title'] == "Книга"
+        assert claimed[0].chat_id == OWNER and claimed[0].attempts == 1
+        expect(AttributeError, lambda: claimed[0].status)
+
+        # Завершённая книга — столбцы REMOVED_COLUMNS, действие — с полями книги
+        async with db.pool.writer() as conn:
+            await conn.execute("UPDATE books SET confirmed_actions = ? WHERE book_id = ?",
+                               (config.ACTIONS_REQUIRED - 1, book_id))
+            await conn.commit()
+        confirmed = await db.confirm_action(action_id, 'confirmed', owner_id=OWNER)
+        assert confirmed.title == "Книга" and confirmed.book_owner_id == OWNER and confirmed.book_type == 'free'
+        completed = confirmed.completed_book
+        assert (completed.book_id, completed.user_id, completed.book_type) == (book_id, OWNER, 'free')
+        expect(AttributeError, lambda: completed.link)
+        assert repr(completed).startswith(f"Book(book_id={book_id}, user_id={OWNER}, title='Книга'")
+    finally:
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_records():
+    run(check_records, 'records.db')
+
+
+def test_partial_records():
+    run(check_partial_records, 'partial.db')
+
+
+if __name__ == "__main__":
+    test_records()
+    print("✅ test_records")
+    test_partial_records()
+    print("✅ test_partial_records")
@@ -0,0 +1,191 @@
+"""
+Тесты outbox: уведомления записываются в транзакции изменения данных,
+доставляются пачками с повторами и переживают перезапуск
+
+Запуск: python test_outbox.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError
+
+from database import Database
+from outbox import OutboxWorker, render
+
+OWNER, HELPER, OTHER, LATE = 1, 2, 3, 4
+
+
+class FlakySender:
+    """Очередь сообщений без сети: ошибки доставки задаются по чатам"""
+
+    def __init__(self):
+        self.sent = []
+        self.errors = {}
+
+    async def _send(self, chat_id: int, kwargs):
+        error = self.errors.get(chat_id)
+        if error:
+            raise error
+        self.sent.append((chat_id, kwargs))
+
+    def send_message(self, chat_id: int, text: str, priority: int = 1, **kwargs):
+        return asyncio.ensure_future(self._send(chat_id, {'text': text, **kwargs}))
+
+    def send_photo(self, chat_id: int, photo: str, priority: int = 1, **kwargs):
+        return asyncio.ensure_future(self._send(chat_id, {'photo': photo, **kwargs}))
+
+
+def outbox_rows(db_path: str):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute(
+        "SELECT chat_id, kind, status, attempts FROM outbox ORDER BY outbox_id"
+    ).fetchall()
+    conn.close()
+    return rows
+
+
+async def setup(db: Database):
+    await db.add_user(OWNER, "owner")
+    await db.add_user(HELPER, "helper")
+    await db.add_user(OTHER, None)
+    await db.add_user(LATE, "late")
+    return await db.add_book(OWNER, "Книга", "https://example.com", 100, 'paid')
+
+
+async def check_written_with_changes(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_id = await setup(db)
+        action_id = await db.add_action(book_id, HELPER, 'purchase', 'photo_id')
+        # Повторное действие отклонено ограничением: уведомления нет
+        assert await db.add_action(book_id, HELPER, 'purchase', 'photo_id') == -1
+        assert outbox_rows(db_path) == [(OWNER, 'action_submitted', 'pending', 0)]
+
+        # Уведомление пишется только при изменении статуса
+        assert await db.confirm_action(action_id, 'rejected', owner_id=OWNER)
+        assert await db.confirm_action(action_id, 'confirmed', owner_id=OWNER) is None
+        other_action = await db.add_action(book_id, OTHER, 'purchase', 'photo_id')
+        assert await db.confirm_action(other_action, 'confirmed', owner_id=OWNER)
+        assert [row[:2] for row in outbox_rows(db_path)] == [
+            (OWNER, 'action_submitted'), (HELPER, 'action_rejected'),
+            (OWNER, 'action_submitted'), (OTHER, 'action_confirmed'),
+        ]
+
+        rows = await db.claim_outbox(10, lease_seconds=60)
+        submitted = render(rows[0].kind, rows[0].payload)[0]
+        assert submitted['photo'] == 'photo_id' and "@helper" in submitted['caption']
+        assert submitted['reply_markup'].inline_keyboard[0][0].callback_data == f"confirm_action:{action_id}:confirmed"
+        assert "@Аноним" in render(rows[2].kind, rows[2].payload)[0]['caption']
+        assert "@owner" in render(rows[3].kind, rows[3].payload)[0]['text']
+    finally:
+        await db.close()
+
+
+async def check_delivery(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_id = await setup(db)
+        for user_id in (HELPER, OTHER):
+            await db.confirm_action(await db.add_action(book_id, user_id, 'purchase', 'photo_id'), 'confirmed')
+
+        sender = FlakySender()
+        sender.errors[HELPER] = TelegramNetworkError(method=None, message="timeout")
+        sender.errors[OTHER] = TelegramForbiddenError(method=None, message="bot was blocked by the user")
+        worker = OutboxWorker(db, sender, batch_size=10, max_attempts=3, retry_base=5)
+
+        now = time.time()
+        assert await worker.drain(now) == 4
+        assert [chat_id for chat_id, _ in sender.sent] == [OWNER, OWNER]
+        assert [row[2] for row in outbox_rows(db_path)] == ['sent', 'pending', 'sent', 'failed']
+
+        # Повтор не раньше задержки, задержка удваивается с каждой попыткой
+        assert await worker.drain(now + 4) == 0
+        assert await worker.drain(now + 5) == 1
+        assert await worker.drain(now + 5 + 9) == 0
+        del sender.errors[HELPER]
+        assert await worker.drain(now + 5 + 10) == 1
+        assert sender.sent[-1][0] == HELPER and "подтверждено" in sender.sent[-1][1]['text']
+        assert outbox_rows(db_path)[1] == (HELPER, 'action_confirmed', 'sent', 3)
+        assert worker.get_metrics() == {'batches': 3, 'sent': 3, 'retried': 2, 'failed': 1}
+
+        # Исчерпавшее попытки уведомление больше не отправляется
+        await db.add_action(book_id, LATE, 'purchase', 'photo_id')
+        sender.errors[OWNER] = TelegramNetworkError(method=None, message="timeout")
+        for attempt in range(3):
+            assert await worker.drain(now + 3600 * (attempt + 1)) == 1
+        assert outbox_rows(db_path)[-1][2:] == ('failed', 3)
+
+        # Отправленные и неотправляемые удаляются по сроку хранения
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE outbox SET created_at = '2000-01-01 00:00:00'")
+        conn.commit()
+        conn.close()
+        assert await db.purge_outbox() == 5
+        assert outbox_rows(db_path) == []
+    finally:
+        await db.close()
+
+
+async def check_restart(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        book_id = await setup(db)
+        await db.add_action(book_id, HELPER, 'purchase', 'photo_id')
+        await db.add_action(book_id, OTHER, 'purchase', 'photo_id')
+        # Процесс забрал первое уведомление и упал, не успев отметить отправку
+        assert len(await db.claim_outbox(1, lease_seconds=60)) == 1
+    finally:
+        await db.close()
+
+    db = Database(db_path)
+    await db.connect()
+    try:
+        sender = FlakySender()
+        worker = OutboxWorker(db, sender)
+        now = time.time()
+        # Второе уведомление отправляется сразу, первое — после истечения аренды
+        assert await worker.drain(now) == 1
+        assert await worker.drain(now + 61) == 1
+        assert len(sender.sent) == 2
+        assert [row[2] for row in outbox_rows(db_path)] == ['sent', 'sent']
+
+        # Фоновая доставка будится записью нового уведомления
+        worker.start()
+        await db.add_action(book_id, LATE, 'purchase', 'photo_id')
+        for _ in range(100):
+            if len(sender.sent) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await worker.stop()
+        assert len(sender.sent) == 3
+    finally:
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_written_with_changes():
+    run(check_written_with_changes, 'outbox.db')
+
+
+def test_delivery():
+    run(check_delivery, 'delivery.db')
+
+
+def test_restart():
+    run(check_restart, 'restart.db')
+
+
+if __name__ == "__main__":
+    for test in (test_written_with_changes, test_delivery, test_restart):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,150 @@
+"""
+Регрессионный тест планов запросов: горячие запросы не должны сканировать таблицы
+
+Выполняет основные методы Database на заполненной временной базе, собирает
+все выполненные SQL-запросы и проверяет их через EXPLAIN QUERY PLAN.
+Запуск: python test_query_plans.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+from database import Database
+import config
+
+# Запросы, которые не выполняются на пути обработки сообщений
+SKIPPED_PREFIXES = ('PRAGMA', 'BEGIN', 'COMMIT', 'ROLLBACK', 'CREATE', 'ALTER', 'INSERT INTO users')
+
+# Временные таблицы пакетной обработки и материализованные подзапросы:
+# их полный просмотр и есть обрабатываемый набор
+ALLOWED_SCANS = ('confirm_batch', 'expired_batch', 'batch', 'ranked')
+
+# Частичные индексы, содержащие только обрабатываемые строки (загрузка сроков,
+# неотправленные уведомления в порядке доставки)
+ALLOWED_INDEX_SCANS = ('USING INDEX idx_actions_pending_created', 'USING INDEX idx_outbox_pending')
+
+
+def seed(db_path: str, books_per_type: int = 300):
+    """Заполнить базу книгами и действиями, чтобы планировщик выбирал индексы"""
+    conn = sqlite3.connect(db_path)
+    conn.executemany(
+        "INSERT INTO users (telegram_id, username) VALUES (?, ?)",
+        ((user_id, f"user{user_id}") for user_id in range(1, books_per_type + 1))
+    )
+    old = (datetime.now() - timedelta(days=config.BOOK_EXPIRATION_DAYS + 1)).strftime('%Y-%m-%d %H:%M:%S')
+    for book_type in ('paid', 'free'):
+        conn.executemany(
+            """INSERT INTO books (user_id, title, link, price, book_type, queue_position, status,
+                                  recommendations_started_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            ((position, f"Книга {position}", "https://example.com", 0, book_type, position,
+              'in_recommendations' if position <= config.MAX_BOOKS_IN_RECOMMENDATIONS else 'in_queue',
+              old if position <= config.MAX_BOOKS_IN_RECOMMENDATIONS else None)
+             for position in range(1, books_per_type + 1))
+        )
+    conn.execute(
+        """INSERT INTO user_actions (book_id, user_id, action_type, status, created_at)
+           SELECT b.book_id, u.telegram_id, 'purchase', 'confirmed', ?
+           FROM books b JOIN users u ON u.telegram_id % 50 = b.book_id % 50""",
+        (old,)
+    )
+    conn.commit()
+    conn.close()
+
+
+async def collect_hot_queries(db_path: str):
+    """Выполнить горячие методы Database и найти полные сканирования в их запросах"""
+    db = Database(db_path)
+    await db.connect()
+    seed(db_path)
+    # База заполнена в обход Database: перезагружаем очереди в памяти
+    await db.verify_queue_index()
+
+    statements = []
+    for conn in db.pool.connections():
+        await conn.set_trace_callback(statements.append)
+
+    user_id = 7
+    await db.add_user(user_id, "user7")
+    books = await db.get_recommendations('paid')
+    await db.get_queue_books('free')
+    await db.get_user_books(user_id)
+    await db.get_user_context(user_id)
+    await db.get_user_book(user_id, 'paid')
+    await db.get_book_by_id(books[0].book_id)
+    await db.get_user_action_for_book(user_id, books[0].book_id)
+    await db.get_user_actions_for_books(user_id, [book.book_id for book in books])
+    await db.get_user_confirmed_actions_by_type(user_id)
+
+    book_id = await db.add_book(user_id, "Новая книга", "https://example.com", 0, 'free')
+    action_id = await db.add_action(book_id, 11, 'rating', 'file_id')
+    await db.get_action_by_id(action_id)
+    await db.confirm_action(action_id, 'confirmed')
+    await db.complete_book(book_id)
+    await db.move_book_up(books[-1].book_id + 1)
+    await db.rebalance_queues()
+    await db.auto_confirm_old_actions()
+    await db.auto_remove_expired_books()
+    await db.set_notify_mode(user_id, 'digest')
+    digest_book = await db.add_book(user_id, "Книга для сводки", "https://example.com", 0, 'free')
+    digest_actions = [await db.add_action(digest_book, helper, 'rating', 'file_id') for helper in (12, 13)]
+    await db.enqueue_action_digests()
+    await db.get_pending_actions(owner_id=user_id)
+    await db.confirm_actions(digest_actions, owner_id=user_id)
+    await db.set_notify_mode(user_id, 'instant')
+    claimed = await db.claim_outbox(10, lease_seconds=60)
+    await db.finish_outbox([claimed[0].outbox_id], [(claimed[1].outbox_id, 0, "error")],
+                           [(claimed[2].outbox_id, "error")])
+
+    for conn in db.pool.connections():
+        await conn.set_trace_callback(None)
+
+    statements = [
+        sql for sql in dict.fromkeys(statement.strip() for statement in statements)
+        if not sql.upper().startswith(SKIPPED_PREFIXES)
+    ]
+    # План строится на соединении писателя, где существуют временные таблицы
+    async with db.pool.writer() as conn:
+        scans = await find_full_scans(conn, statements)
+    await db.close()
+    return statements, scans
+
+
+async def find_full_scans(conn, statements):
+    """Вернуть запросы, план которых содержит полное сканирование таблицы"""
+    scans = []
+    for sql in statements:
+        async with conn.execute(f"EXPLAIN QUERY PLAN {sql}") as cursor:
+            plan = await cursor.fetchall()
+        details = [
+            row[3] for row in plan
+            if row[3].startswith('SCAN ')
+            and not row[3].startswith('SCAN (')
+            and row[3].split()[1] not in ALLOWED_SCANS
+            and not row[3].endswith(ALLOWED_INDEX_SCANS)
+        ]
+        if details:
+            scans.append((sql, details))
+    return scans
+
+
+async def check_query_plans():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return await collect_hot_queries(os.path.join(tmp_dir, 'plans.db'))
+
+
+def test_hot_queries_use_indexes():
+    statements, scans = asyncio.run(check_query_plans())
+    assert statements
+    assert not scans, "\n\n".join(f"{sql}\n  -> {details}" for sql, details in scans)
+
+
+if __name__ == "__main__":
+    statements, scans = asyncio.run(check_query_plans())
+    print(f"Проверено запросов: {len(statements)}")
+    for sql, details in scans:
+        print(f"\n❌ {' '.join(sql.split())}\n   {details}")
+    if not scans:
+        print("✅ Все горячие запросы используют индексы")
@@ -0,0 +1,113 @@
+"""
+Тесты очереди в памяти: позиции совпадают с базой после любых изменений очереди
+
+Запуск: python test_queue_index.py (или через pytest)
+"""
+import asyncio
+import os
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+from database import Database
+from queue_index import OrderStatisticList
+import config
+
+
+def check_order_statistic_list():
+    """Случайные вставки и удаления против отсортированного списка"""
+    rng = random.Random(7)
+    queue = OrderStatisticList()
+    queue.LOAD = 4  # Маленькие блоки, чтобы проверить деление и удаление блоков
+    expected = []
+
+    for step in range(3000):
+        if expected and rng.random() < 0.45:
+            pair = expected.pop(rng.randrange(len(expected)))
+            assert queue.remove(*pair)
+        else:
+            pair = (rng.randrange(-500, 500), step)
+            queue.add(*pair)
+            expected.append(pair)
+            expected.sort()
+        assert len(queue) == len(expected)
+
+        if step % 50 == 0:
+            assert list(queue) == expected
+            assert queue.head(3) == expected[:3]
+            for index, pair in enumerate(expected):
+                assert queue.rank(*pair) == index
+
+    assert not queue.remove(10_000, 1)
+
+
+async def expected_positions(db: Database, book_type: str):
+    """Позиции по базе данных: book_id -> позиция"""
+    async with db.pool.reader() as conn:
+        async with conn.execute(
+            """SELECT book_id FROM books
+               WHERE book_type = ? AND status IN ('in_queue', 'in_recommendations')
+               ORDER BY queue_position, book_id""",
+            (book_type,)
+        ) as cursor:
+            return {row[0]: index for index, row in enumerate(await cursor.fetchall(), start=1)}
+
+
+async def check_write_through(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    for user_id in range(1, 31):
+        await db.add_user(user_id, f"user{user_id}")
+        await db.add_book(user_id, f"Книга {user_id}", "https://example.com", 99, 'paid')
+        await db.add_book(user_id, f"Книга {user_id}", "https://example.com", 0, 'free')
+
+    # Перемещения книг вверх по очереди и перестройка ключей
+    for _ in range(15):
+        await db.move_book_up(30)
+    for _ in range(12):
+        await db.move_book_up(40)
+    await db.rebalance_queues()
+    await db.complete_book(3)
+    await db.complete_book(44)
+
+    # Просроченная книга в рекомендациях
+    old = (datetime.now() - timedelta(days=config.BOOK_EXPIRATION_DAYS + 1)).strftime('%Y-%m-%d %H:%M:%S')
+    async with db.pool.writer() as conn:
+        await conn.execute(
+            "UPDATE books SET recommendations_started_at = ? WHERE book_id = 1", (old,)
+        )
+        await conn.commit()
+    removed = await db.auto_remove_expired_books()
+    assert [book.book_id for book in removed] == [1]
+
+    assert await db.verify_queue_index() == {'paid': 0, 'free': 0}
+    for book_type in ('paid', 'free'):
+        positions = await expected_positions(db, book_type)
+        assert db.queue.size(book_type) == len(positions)
+        assert db.queue.top(book_type, 3) == list(positions)[:3]
+        for book_id, position in positions.items():
+            book = await db.get_book_by_id(book_id)
+            assert book.position == position
+
+    # Внешнее изменение базы обнаруживается самопроверкой
+    async with db.pool.writer() as conn:
+        await conn.execute("DELETE FROM books WHERE book_id = 2")
+        await conn.commit()
+    assert (await db.verify_queue_index())['free'] > 0
+    assert await db.verify_queue_index() == {'paid': 0, 'free': 0}
+    await db.close()
+
+
+def test_order_statistic_list():
+    check_order_statistic_list()
+
+
+def test_write_through():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check_write_through(os.path.join(tmp_dir, 'queue_index.db')))
+
+
+if __name__ == "__main__":
+    for test in (test_order_statistic_list, test_write_through):
+        test()
+        print(f"✅ {test.__name__}")
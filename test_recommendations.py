@@ -0,0 +1,98 @@
+"""
+Тесты пересчёта рекомендаций: меняются только книги, входящие в топ или выходящие из него
+
+Запуск: python test_recommendations.py (или через pytest)
+"""
+import asyncio
+import os
+import tempfile
+
+from database import Database
+import config
+
+OLD_START = '2000-01-01 00:00:00'
+
+
+async def create_queue(db_path: str, books: int) -> Database:
+    """База с очередью бесплатных книг (книга i на позиции i)"""
+    db = Database(db_path)
+    await db.connect()
+    for index in range(1, books + 1):
+        await db.add_user(index, f"user{index}")
+        await db.add_book(index, f"Книга {index}", "https://example.com", 0, 'free')
+    # Отмечаем время начала показа, чтобы отличить сохранённое значение от нового
+    async with db.pool.writer() as conn:
+        await conn.execute(
+            "UPDATE books SET recommendations_started_at = ? WHERE status = 'in_recommendations'",
+            (OLD_START,)
+        )
+        await conn.commit()
+    return db
+
+
+async def recommendation_state(db: Database):
+    async with db.pool.reader() as conn:
+        async with conn.execute(
+            """SELECT book_id, recommendations_started_at FROM books
+               WHERE status = 'in_recommendations' ORDER BY queue_position"""
+        ) as cursor:
+            return [tuple(row) for row in await cursor.fetchall()]
+
+
+async def check_completion_keeps_started_at(db_path: str):
+    slots = config.MAX_BOOKS_IN_RECOMMENDATIONS
+    db = await create_queue(db_path, slots + 2)
+
+    await db.complete_book(1)
+    state = await recommendation_state(db)
+    await db.close()
+
+    assert [book_id for book_id, _ in state] == list(range(2, slots + 2))
+    # Оставшиеся в топе книги сохранили время начала показа
+    assert all(started == OLD_START for book_id, started in state if book_id <= slots)
+    # Новая книга в топе получила своё время начала показа
+    assert state[-1][1] not in (None, OLD_START)
+
+
+async def check_diff_and_write_count(db_path: str):
+    slots = config.MAX_BOOKS_IN_RECOMMENDATIONS
+    db = await create_queue(db_path, slots + 2)
+
+    async with db.pool.writer() as conn:
+        # Топ не изменился: ни одной записи
+        before = conn.total_changes
+        changes = await db._update_recommendations_status(conn, 'free')
+        assert changes == {'promoted': [], 'demoted': []}
+        assert conn.total_changes == before
+
+        # Последняя книга топа и следующая в очереди меняются местами
+        await conn.execute("UPDATE books SET queue_position = 0 WHERE book_id = ?", (slots + 1,))
+        before = conn.total_changes
+        changes = await db._update_recommendations_status(conn, 'free')
+        await conn.commit()
+        assert changes == {'promoted': [slots + 1], 'demoted': [slots]}
+        # Две книги, и каждая смена статуса обновляет два счётчика статистики (триггер)
+        assert conn.total_changes - before == 2 * 3
+
+    state = await recommendation_state(db)
+    await db.close()
+    assert {book_id for book_id, _ in state} == set(range(1, slots)) | {slots + 1}
+
+
+def run(check):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, 'recommendations.db')))
+
+
+def test_completion_keeps_started_at():
+    run(check_completion_keeps_started_at)
+
+
+def test_diff_and_write_count():
+    run(check_diff_and_write_count)
+
+
+if __name__ == "__main__":
+    for test in (test_completion_keeps_started_at, test_diff_and_write_count):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,118 @@
+"""
+Тесты очереди исходящих сообщений: приоритеты, лимиты чатов, retry_after
+
+Запуск: python test_sender.py (или через pytest)
+"""
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+
+from sender import OutboundSender, INTERACTIVE, NOTIFICATION, BULK
+
+
+def recorder(log, name):
+    async def call():
+        log.append((name, time.monotonic()))
+        return name
+    return call
+
+
+async def check_priorities():
+    sender = OutboundSender(rate=1000, chat_burst=10)
+    log = []
+    # Очередь заполняется до запуска: порядок определяется только приоритетом
+    for index in range(3):
+        sender.submit(100 + index, recorder(log, f"bulk{index}"), BULK)
+    sender.submit(200, recorder(log, "notification"), NOTIFICATION)
+    reply = sender.submit(300, recorder(log, "reply"), INTERACTIVE)
+    await sender.start()
+    assert await reply == "reply"
+    await sender.stop()
+    assert [name for name, _ in log] == ["reply", "notification", "bulk0", "bulk1", "bulk2"]
+    assert sender.get_metrics()['priorities']['bulk']['sent'] == 3
+
+
+async def check_chat_limit():
+    sender = OutboundSender(rate=1000, chat_per_second=20, chat_burst=1)
+    log = []
+    await sender.start()
+    futures = [sender.submit(1, recorder(log, index)) for index in range(5)]
+    # Другой чат не ждёт лимита первого
+    other = sender.submit(2, recorder(log, "other"))
+    await asyncio.gather(*futures, other)
+    await sender.stop()
+
+    times = [at for name, at in log if name != "other"]
+    assert times[-1] - times[0] >= 4 / 20 * 0.9
+    assert log[1][0] == "other"
+
+
+async def check_retry_after():
+    sender = OutboundSender(rate=1000, max_retries=2)
+    await sender.start()
+    attempts = 0
+
+    async def flaky():
+        nonlocal attempts
+        attempts += 1
+        if attempts < 3:
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Too Many Requests", retry_after=0)
+        return "delivered"
+
+    assert await sender.submit(1, flaky) == "delivered"
+
+    async def flood():
+        raise TelegramRetryAfter(SendMessage(chat_id=2, text="x"), "Too Many Requests", retry_after=0)
+
+    try:
+        await sender.submit(2, flood, BULK)
+        assert False, "message must be dropped"
+    except TelegramRetryAfter:
+        pass
+    await sender.stop()
+
+    metrics = sender.get_metrics()
+    assert metrics['retry_after'] == 5
+    assert metrics['priorities']['bulk']['dropped'] == 1
+    assert metrics['queue_depth'] == 0
+
+
+async def check_middleware():
+    sender = OutboundSender(rate=1000)
+    await sender.start()
+    calls = []
+
+    async def make_request(bot, method):
+        calls.append(type(method).__name__)
+        return True
+
+    # Запросы к чатам идут через очередь, остальные — напрямую
+    await sender.middleware(make_request, None, SendMessage(chat_id=1, text="x"))
+    await sender.middleware(make_request, None, AnswerCallbackQuery(callback_query_id="1"))
+    await sender.stop()
+    assert calls == ["SendMessage", "AnswerCallbackQuery"]
+    assert sender.get_metrics()['priorities']['interactive']['sent'] == 1
+
+
+def test_priorities():
+    asyncio.run(check_priorities())
+
+
+def test_chat_limit():
+    asyncio.run(check_chat_limit())
+
+
+def test_retry_after():
+    asyncio.run(check_retry_after())
+
+
+def test_middleware():
+    asyncio.run(check_middleware())
+
+
+if __name__ == "__main__":
+    for test in (test_priorities, test_chat_limit, test_retry_after, test_middleware):
+        test()
+        print(f"✅ {test.__name__}")
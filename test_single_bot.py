@@ -0,0 +1,122 @@
+"""
+Тест внедрения зависимостей: обработчики получают bot, db и sender от диспетчера,
+а на процесс создаётся ровно одна HTTP-сессия бота
+
+Запуск: python test_single_bot.py (или через pytest)
+"""
+import asyncio
+import gc
+import os
+import tempfile
+from collections import Counter
+from datetime import datetime
+
+from aiogram.client.session.base import BaseSession
+from aiogram.types import CallbackQuery, Chat, Message, PhotoSize, Update, User
+
+import config
+from database import Database
+from fsm_storage import SQLiteStorage
+from outbox import OutboxWorker
+from sender import OutboundSender
+
+
+class RecordingSession(BaseSession):
+    """Сессия Bot API без сети: запоминает вызовы методов"""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[(type(method).__name__, getattr(method, 'chat_id', None))] += 1
+        if method.__returning__ is bool:
+            return True
+        return Message(
+            message_id=1, date=datetime.now(),
+            chat=Chat(id=getattr(method, 'chat_id', 0) or 0, type='private'), text='ok'
+        )
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+def make_user(user_id: int) -> User:
+    return User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> Update:
+    return Update(update_id=update_id, callback_query=CallbackQuery(
+        id=str(update_id), from_user=make_user(user_id), chat_instance='test', data=data,
+        message=Message(message_id=update_id, date=datetime.now(),
+                        chat=Chat(id=user_id, type='private'), text='card')
+    ))
+
+
+def photo_update(update_id: int, user_id: int) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=make_user(user_id),
+        photo=[PhotoSize(file_id='screenshot', file_unique_id='screenshot', width=10, height=10)]
+    ))
+
+
+async def check_single_session(db_path: str):
+    config.BOT_TOKEN = config.BOT_TOKEN or "42:TEST"
+    import main
+
+    db = Database(db_path)
+    sender = OutboundSender(rate=1000, chat_burst=10)
+    session = RecordingSession()
+    bot = main.create_bot(sender, session=session)
+    storage = SQLiteStorage(db_path + '.fsm')
+    dp = main.create_dispatcher(db, sender, storage)
+    outbox = OutboxWorker(db, sender, poll_interval=0.05)
+
+    await db.connect()
+    await sender.start()
+    outbox.start()
+    try:
+        owner_id, buyer_id = 1, 2
+        await db.add_user(owner_id, "owner")
+        await db.add_user(buyer_id, "buyer")
+        book_id = await db.add_book(owner_id, "Книга", "https://example.com", 100, 'paid')
+
+        # Покупатель отправляет скриншот, владелец подтверждает действие
+        await dp.feed_update(bot, callback_update(1, buyer_id, f"send_screenshot:{book_id}:{owner_id}"))
+        await dp.feed_update(bot, photo_update(2, buyer_id))
+        action = await db.get_user_action_for_book(buyer_id, book_id)
+        assert action and action.status == 'pending'
+        await dp.feed_update(bot, callback_update(3, owner_id, f"confirm_action:{action.action_id}:confirmed"))
+        # Уведомления владельцу и покупателю доставляются из outbox
+        await outbox.stop()
+        await sender.stop(timeout=5)
+
+        assert (await db.get_action_by_id(action.action_id)).status == 'confirmed'
+        assert session.calls[('SendPhoto', owner_id)] == 1
+        assert session.calls[('SendMessage', buyer_id)] >= 2
+        assert sender.bot is bot
+        assert outbox.get_metrics()['sent'] == 2
+    finally:
+        await outbox.stop()
+        await sender.stop(timeout=1)
+        await storage.close()
+        await db.close()
+
+    # Обработчики не создают своих ботов: сессия на процесс ровно одна
+    sessions = [obj for obj in gc.get_objects() if isinstance(obj, BaseSession)]
+    assert sessions == [session], sessions
+    assert not hasattr(main, 'bot')
+
+
+def test_single_session():
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check_single_session(os.path.join(tmp_dir, 'di.db')))
+
+
+if __name__ == "__main__":
+    test_single_session()
+    print("✅ test_single_session")
@@ -0,0 +1,125 @@
+"""
+Тесты счётчиков статистики: триггеры, события по дням, сверка и заполнение при миграции
+
+Запуск: python test_statistics.py (или через pytest)
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+import config
+from database import Database
+
+
+def count_directly(db_path: str):
+    """Статистика подсчётом по основным таблицам"""
+    conn = sqlite3.connect(db_path)
+    books = {
+        (book_type, status): count for book_type, status, count in
+        conn.execute("SELECT book_type, status, COUNT(*) FROM books GROUP BY book_type, status")
+    }
+    actions = dict(conn.execute("SELECT status, COUNT(*) FROM user_actions GROUP BY status").fetchall())
+    users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    conn.close()
+    return users, books, actions
+
+
+async def check_counters(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        for user_id in range(1, 20):
+            await db.add_user(user_id, f"user{user_id}")
+        await db.add_user(1, "renamed")
+        free_ids = [await db.add_book(owner_id, f"Книга {owner_id}", "https://example.com", 0, 'free')
+                    for owner_id in range(1, config.MAX_BOOKS_IN_RECOMMENDATIONS + 3)]
+        paid_id = await db.add_book(19, "Платная", "https://example.com", 100, 'paid')
+
+        # Книга набирает действия и завершается, следующая поднимается в рекомендации
+        for user_id in range(10, 10 + config.ACTIONS_REQUIRED):
+            action_id = await db.add_action(free_ids[0], user_id, 'rating', 'file_id')
+            await db.confirm_action(action_id, 'confirmed')
+        rejected = await db.add_action(free_ids[1], 10, 'rating', 'file_id')
+        await db.confirm_action(rejected, 'rejected')
+        await db.add_action(free_ids[2], 11, 'review', 'file_id')
+        await db.add_action(paid_id, 12, 'purchase', 'file_id')
+
+        # Платная книга истекает вместе с действием
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE books SET recommendations_started_at = '2000-01-01 00:00:00' WHERE book_id = ?",
+                     (paid_id,))
+        conn.commit()
+        conn.close()
+        assert [book.book_id for book in await db.auto_remove_expired_books()] == [paid_id]
+
+        stats = await db.get_statistics()
+        users, books, actions = count_directly(db_path)
+        assert stats['total_users'] == users == 19
+        assert {(book_type, status): count for book_type, by_status in stats['books'].items()
+                for status, count in by_status.items() if count} == books
+        assert {status: count for status, count in stats['actions'].items() if count} == actions
+        assert stats['actions'] == {'pending': 1, 'confirmed': config.ACTIONS_REQUIRED,
+                                    'rejected': 1, 'auto_confirmed': 0}
+        assert stats['books']['free'] == {'in_recommendations': config.MAX_BOOKS_IN_RECOMMENDATIONS, 'in_queue': 1}
+        assert stats['paid_books'] == 0 and stats['total_books'] == len(free_ids) - 1
+        assert list(stats['daily'].values()) == [{'completed': 1, 'expired': 1}]
+
+        assert await db.reconcile_statistics() == {}
+
+        # Запись в обход триггеров обнаруживается и исправляется сверкой
+        conn = sqlite3.connect(db_path)
+        conn.execute("UPDATE stats_counters SET value = value + 5 WHERE name = 'users'")
+        conn.commit()
+        conn.close()
+        assert await db.reconcile_statistics() == {'users': (24, 19)}
+        assert (await db.get_statistics())['total_users'] == 19
+    finally:
+        await db.close()
+
+
+async def check_backfill(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        for user_id in range(1, 4):
+            await db.add_user(user_id, f"user{user_id}")
+        await db.add_book(1, "Книга", "https://example.com", 0, 'free')
+    finally:
+        await db.close()
+
+    # База до появления счётчиков: миграция заполняет их по существующим данным
+    conn = sqlite3.connect(db_path)
+    conn.execute("DELETE FROM stats_counters")
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    conn.close()
+
+    db = Database(db_path)
+    await db.connect()
+    try:
+        stats = await db.get_statistics()
+        assert stats['total_users'] == 3
+        assert stats['books']['free'] == {'in_recommendations': 1, 'in_queue': 0}
+        assert await db.reconcile_statistics() == {}
+    finally:
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_counters():
+    run(check_counters, 'stats.db')
+
+
+def test_backfill():
+    run(check_backfill, 'backfill.db')
+
+
+if __name__ == "__main__":
+    for test in (test_counters, test_backfill):
+        test()
+        print(f"✅ {test.__name__}")
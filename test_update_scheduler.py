@@ -0,0 +1,94 @@
+"""
+Тесты ограничения параллельной обработки обновлений: порядок внутри пользователя,
+общий лимит и отбрасывание при переполнении
+
+Запуск: python test_update_scheduler.py (или через pytest)
+"""
+import asyncio
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Chat, Message, Update, User
+
+from update_scheduler import UpdateScheduler
+
+
+def text_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}"), text=text
+    ))
+
+
+def make_dispatcher(scheduler: UpdateScheduler, delay: float):
+    handled = []
+    running = {'now': 0, 'peak': 0}
+    router = Router()
+
+    @router.message()
+    async def handler(message: Message):
+        running['now'] += 1
+        running['peak'] = max(running['peak'], running['now'])
+        # Первое сообщение пользователя обрабатывается дольше следующих
+        await asyncio.sleep(delay if message.text == "0" else delay / 10)
+        handled.append((message.from_user.id, int(message.text)))
+        running['now'] -= 1
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    dp.update.outer_middleware(scheduler)
+    return dp, handled, running
+
+
+async def check_lanes():
+    scheduler = UpdateScheduler(max_concurrency=4, max_waiting=1000, lane_max=100)
+    dp, handled, running = make_dispatcher(scheduler, 0.02)
+    bot = Bot(token="42:TEST")
+    updates = [text_update(user_id * 100 + step, user_id, str(step))
+               for step in range(5) for user_id in range(1, 11)]
+    # Как при polling: каждое обновление — отдельная задача
+    await asyncio.gather(*(dp.feed_update(bot, update) for update in updates))
+    await bot.session.close()
+
+    assert len(handled) == 50
+    for user_id in range(1, 11):
+        assert [step for uid, step in handled if uid == user_id] == list(range(5))
+    assert running['peak'] == 4
+
+    metrics = scheduler.get_metrics()
+    assert metrics['processed'] == 50 and metrics['in_flight_max'] == 4
+    assert metrics['lanes'] == 0 and metrics['lanes_max'] == 10 and metrics['waiting'] == 0
+    assert metrics['wait_max_ms'] > 0
+
+
+async def check_shedding():
+    scheduler = UpdateScheduler(max_concurrency=1, max_waiting=5, lane_max=3)
+    dp, handled, _ = make_dispatcher(scheduler, 0.02)
+    bot = Bot(token="42:TEST")
+    # Один пользователь присылает 10 сообщений подряд: в очереди остаётся не больше 3
+    spam = [text_update(step, 1, str(step)) for step in range(10)]
+    # Десять разных пользователей: ожидающих не больше 5
+    burst = [text_update(100 + user_id, user_id, "0") for user_id in range(2, 12)]
+    await asyncio.gather(*(dp.feed_update(bot, update) for update in spam + burst))
+    await bot.session.close()
+
+    metrics = scheduler.get_metrics()
+    assert [step for uid, step in handled if uid == 1] == [0, 1, 2]
+    assert metrics['shed_lane_full'] == 7
+    assert metrics['shed_queue_full'] >= 1
+    assert metrics['processed'] == len(handled)
+    assert metrics['processed'] + metrics['shed_lane_full'] + metrics['shed_queue_full'] == 20
+
+
+def test_lanes():
+    asyncio.run(check_lanes())
+
+
+def test_shedding():
+    asyncio.run(check_shedding())
+
+
+if __name__ == "__main__":
+    for test in (test_lanes, test_shedding):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,144 @@
+"""
+Тесты контекста пользователя: профиль и книги загружаются одним запросом за
+обновление, обработчики меню берут его из аргумента user_context, число
+соединений на обработчик видно в метриках
+
+Запуск: python test_user_context.py (или через pytest)
+"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.types import Chat, Message, Update, User
+
+from database import Database
+from db_pool import track_checkouts
+from fsm_storage import SQLiteStorage
+from handlers import add_book, common, my_book
+from sender import OutboundSender
+from test_single_bot import RecordingSession
+from user_context import UserContext, UserContextMiddleware
+
+OWNER, HELPER, STRANGER = 1, 2, 3
+
+
+def text_update(update_id: int, user_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}"),
+        text=text
+    ))
+
+
+async def setup(db: Database):
+    await db.add_user(OWNER, "owner")
+    await db.add_user(HELPER, "helper")
+    await db.add_book(OWNER, "Платная", "https://example.com", 100, 'paid')
+    book_id = await db.add_book(OWNER, "Бесплатная", "https://example.com", 0, 'free')
+    await db.confirm_action(await db.add_action(book_id, HELPER, 'rating', 'file_id'), 'confirmed')
+    # Проверка изменений другими процессами не добавляет соединений в подсчёт
+    db.data_version_interval = 3600
+    await db.get_user_books(OWNER)
+
+
+async def check_context(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        await setup(db)
+        context = UserContext(db, OWNER)
+        with track_checkouts() as counter:
+            await context.load()
+            await context.load()
+        assert counter == {'reader': 1, 'writer': 0}
+        assert context.books == await db.get_user_books(OWNER)
+        assert context.book('paid').title == "Платная" and context.book('free').position == 1
+        assert context.notify_mode == 'instant'
+
+        helper = await UserContext(db, HELPER).load()
+        assert helper.books == [] and helper.user.username == "helper"
+        assert helper.helper_counts == await db.get_user_confirmed_actions_by_type(HELPER)
+        assert helper.helper_counts == {'paid': 0, 'free': 1, 'total': 1}
+
+        stranger = await UserContext(db, STRANGER).load()
+        assert stranger.user is None and stranger.books == []
+        assert stranger.helper_counts['total'] == 0 and await stranger.fsm_state() is None
+
+        # После изменений в том же обновлении контекст перечитывается
+        await db.set_notify_mode(OWNER, 'digest')
+        assert context.notify_mode == 'instant'
+        context.invalidate()
+        assert (await context.load()).notify_mode == 'digest'
+    finally:
+        await db.close()
+
+
+def create_dispatcher(db: Database, storage: SQLiteStorage, middleware: UserContextMiddleware) -> Dispatcher:
+    """Обработчики меню на отдельном роутере (роутеры модулей подключает main)"""
+    router = Router()
+    router.message.register(my_book.show_my_book_status, F.text == "📊 Моя книга")
+    router.message.register(add_book.add_book_start, F.text == "➕ Добавить свою книгу")
+    router.message.register(common.how_it_works, F.text == "ℹ️ Как это работает")
+    dp = Dispatcher(storage=storage, db=db)
+    dp.message.middleware(middleware)
+    dp.include_router(router)
+    return dp
+
+
+async def check_handlers(db_path: str):
+    db = Database(db_path)
+    sender = OutboundSender(rate=1000, chat_burst=10)
+    session = RecordingSession()
+    bot = Bot(token="42:TEST", session=session)
+    sender.set_bot(bot)
+    bot.session.middleware(sender.middleware)
+    storage = SQLiteStorage(db_path + '.fsm')
+    middleware = UserContextMiddleware(db)
+    dp = create_dispatcher(db, storage, middleware)
+
+    await db.connect()
+    await sender.start()
+    try:
+        await setup(db)
+        await dp.feed_update(bot, text_update(1, OWNER, "📊 Моя книга"))
+        await dp.feed_update(bot, text_update(2, HELPER, "➕ Добавить свою книгу"))
+        await dp.feed_update(bot, text_update(3, HELPER, "ℹ️ Как это работает"))
+        await sender.stop(timeout=5)
+
+        # Одно соединение и один запрос на обработчик, вместо трёх
+        metrics = middleware.get_metrics()
+        assert metrics['handlers.my_book.show_my_book_status'] == {'calls': 1, 'reader': 1, 'writer': 0, 'max': 1}
+        assert metrics['handlers.add_book.add_book_start'] == {'calls': 1, 'reader': 1, 'writer': 0, 'max': 1}
+        # Обработчикам без контекста он ничего не стоит
+        assert metrics['handlers.common.how_it_works']['max'] == 0
+        assert session.calls[('SendMessage', OWNER)] == 1 and session.calls[('SendMessage', HELPER)] == 2
+
+        # Помощник с подтверждённым действием перешёл к выбору типа книги
+        state = await storage.get_state(key=StorageKey(bot_id=bot.id, chat_id=HELPER, user_id=HELPER))
+        assert state == "AddBookStates:waiting_for_type"
+    finally:
+        await sender.stop(timeout=1)
+        await storage.close()
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_context():
+    run(check_context, 'context.db')
+
+
+def test_handlers():
+    run(check_handlers, 'handlers.db')
+
+
+if __name__ == "__main__":
+    for test in (test_context, test_handlers):
+        test()
+        print(f"✅ {test.__name__}")
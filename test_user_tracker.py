@@ -0,0 +1,135 @@
+"""
+Тесты регистрации пользователей без лишних записей: UPSERT, кэш username и
+пакетная запись смены username из входящих обновлений
+
+Запуск: python test_user_tracker.py (или через pytest)
+"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Chat, Message, Update, User
+
+from database import Database
+from user_tracker import UsernameTracker
+
+
+def text_update(update_id: int, user_id: int, username: str) -> Update:
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), chat=Chat(id=user_id, type='private'),
+        from_user=User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=username),
+        text="📘 Платные книги"
+    ))
+
+
+async def trace_writes(db: Database):
+    """Запросы на соединении писателя"""
+    statements = []
+    async with db.pool.writer() as conn:
+        await conn.set_trace_callback(statements.append)
+    return statements
+
+
+def writes(statements):
+    """Начатые транзакции записи (запросы внутри триггеров трассируются повторно)"""
+    return [sql for sql in statements if sql.lstrip().upper().startswith('BEGIN')]
+
+
+async def check_add_user(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        statements = await trace_writes(db)
+        await db.add_user(1, "alice")
+        await db.add_user(1, "alice")
+        await db.add_user(1, "alice")
+        assert len(writes(statements)) == 1
+
+        # Смена username: одна запись, рекомендации с книгой пользователя перечитываются
+        await db.add_book(1, "Книга", "https://example.com", 0, 'free')
+        assert (await db.get_recommendations('free'))[0].username == "alice"
+        statements.clear()
+        await db.add_user(1, "alice_new")
+        assert len(writes(statements)) == 1
+        assert (await db.get_recommendations('free'))[0].username == "alice_new"
+
+        # После перезапуска кэш пуст: UPSERT без изменений не меняет строк
+        db.usernames.clear()
+        async with db.pool.writer() as conn:
+            before = conn.total_changes
+        await db.add_user(1, "alice_new")
+        async with db.pool.writer() as conn:
+            assert conn.total_changes == before
+        assert db.get_cache_metrics()['users']['hits'] == 3
+    finally:
+        await db.close()
+
+
+async def check_tracker(db_path: str):
+    db = Database(db_path)
+    await db.connect()
+    try:
+        await db.add_user(1, "alice")
+        await db.add_user(2, "bob")
+        await db.add_book(1, "Книга", "https://example.com", 0, 'free')
+        await db.get_recommendations('free')
+
+        tracker = UsernameTracker(db, flush_interval=3600)
+        router = Router()
+
+        @router.message()
+        async def handler(message: Message):
+            pass
+
+        dp = Dispatcher()
+        dp.include_router(router)
+        dp.update.outer_middleware(tracker)
+        bot = Bot(token="42:TEST")
+        statements = await trace_writes(db)
+
+        # Повторяющиеся обновления с прежним username ничего не пишут
+        updates = [text_update(step, 2, "bob") for step in range(5)]
+        # Смена username и незарегистрированный пользователь
+        updates += [text_update(10, 1, "alice_new"), text_update(11, 1, "alice_newest"),
+                    text_update(12, 3, "carol")]
+        for update in updates:
+            await dp.feed_update(bot, update)
+        await bot.session.close()
+        assert writes(statements) == []
+
+        await tracker.close()
+        assert len(writes(statements)) == 1
+        # Изменения всех пользователей — поиск и обновление по одному запросу
+        assert len([sql for sql in statements if 'json_each' in sql]) == 2
+        assert tracker.get_metrics() == {'flushes': 1, 'updated': 1}
+        assert (await db.get_user(1)).username == "alice_newest"
+        assert await db.get_user(3) is None
+        assert (await db.get_recommendations('free'))[0].username == "alice_newest"
+
+        # Записанное значение известно кэшу: /start с ним не обращается к БД
+        statements.clear()
+        await db.add_user(1, "alice_newest")
+        assert statements == []
+    finally:
+        await db.close()
+
+
+def run(check, name: str):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        asyncio.run(check(os.path.join(tmp_dir, name)))
+
+
+def test_add_user():
+    run(check_add_user, 'users.db')
+
+
+def test_tracker():
+    run(check_tracker, 'tracker.db')
+
+
+if __name__ == "__main__":
+    for test in (test_add_user, test_tracker):
+        test()
+        print(f"✅ {test.__name__}")
@@ -0,0 +1,117 @@
+"""
+Тесты режима вебхука: секретный токен, мгновенный ответ, пул воркеров, /healthz
+и обязательные настройки
+
+Обновления отправляются POST-запросом в локальный сервер, как это делает Telegram.
+
+Запуск: python test_webhook.py (или через pytest)
+"""
+import asyncio
+import time
+
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+import config
+from webhook import WEBHOOK_HANDLER, check_webhook_config, create_app
+
+SECRET = "test_secret"
+
+
+def update_json(update_id: int, user_id: int, text: str) -> dict:
+    """Обновление в том виде, в каком его присылает Telegram"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text
+        }
+    }
+
+
+async def check_webhook():
+    handled = []
+    in_flight = 0
+    peak = 0
+    router = Router()
+
+    @router.message()
+    async def slow_handler(message: Message):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.05)
+        handled.append(message.text)
+        in_flight -= 1
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    bot = Bot(token="42:TEST")
+    app = create_app(dp, bot, SECRET, workers=2, queue_size=3)
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+        response = await client.post(config.WEBHOOK_PATH, json=update_json(1, 1, "чужой"),
+                                     headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+        assert response.status == 401
+
+        # Ответ приходит раньше, чем обработчик успевает завершиться
+        started = time.perf_counter()
+        responses = [
+            await client.post(config.WEBHOOK_PATH, json=update_json(index, index, f"text{index}"),
+                              headers=headers)
+            for index in range(2, 10)
+        ]
+        assert time.perf_counter() - started < 0.1
+        statuses = sorted(response.status for response in responses)
+        # Два обновления у воркеров, три в очереди, остальные отклоняются до повторной доставки
+        assert statuses.count(200) >= 3 and statuses.count(503) >= 1, statuses
+
+        await asyncio.wait_for(app[WEBHOOK_HANDLER].queue.join(), 5)
+        assert peak == 2
+        assert len(handled) == statuses.count(200)
+
+        health = await (await client.get('/healthz')).json()
+        assert health['status'] == 'ok'
+        assert health['processed'] == len(handled)
+        assert health['unauthorized'] == 1
+        assert health['rejected'] == statuses.count(503)
+        assert health['queue_depth'] == 0
+    finally:
+        await client.close()
+        await bot.session.close()
+
+
+def test_webhook():
+    asyncio.run(check_webhook())
+
+
+def test_webhook_config():
+    saved = config.WEBHOOK_URL, config.WEBHOOK_SECRET
+    try:
+        config.WEBHOOK_URL = "https://bot.example.com"
+        for secret in ("", "with spaces", "x" * 257):
+            config.WEBHOOK_SECRET = secret
+            try:
+                check_webhook_config()
+            except RuntimeError:
+                pass
+            else:
+                raise AssertionError(f"RuntimeError expected for secret {secret!r}")
+        config.WEBHOOK_SECRET = SECRET
+        check_webhook_config()
+    finally:
+        config.WEBHOOK_URL, config.WEBHOOK_SECRET = saved
+
+
+if __name__ == "__main__":
+    test_webhook()
+    print("✅ test_webhook")
+    test_webhook_config()
+    print("✅ test_webhook_config")
@@ -0,0 +1,117 @@
+"""Ограничение параллельной обработки обновлений: общий лимит и очередь на пользователя"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import config
+
+logger = logging.getLogger(__name__)
+
+
+class Lane:
+    """Очередь обновлений одного пользователя"""
+
+    __slots__ = ('lock', 'size')
+
+    def __init__(self):
+        # asyncio.Lock пробуждает ожидающих в порядке очереди
+        self.lock = asyncio.Lock()
+        self.size = 0
+
+
+class UpdateScheduler(BaseMiddleware):
+    """Outer middleware для dp.update: общий семафор и очередь на каждого пользователя"""
+
+    def __init__(self, max_concurrency: int = config.UPDATE_MAX_CONCURRENCY,
+                 max_waiting: int = config.UPDATE_QUEUE_MAX,
+                 lane_max: int = config.UPDATE_LANE_MAX):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_waiting = max_waiting
+        self.lane_max = lane_max
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._lanes: Dict[int, Lane] = {}
+        self.in_flight = 0
+        self.waiting = 0
+        self.metrics = {
+            'processed': 0, 'shed_queue_full': 0, 'shed_lane_full': 0,
+            'wait_total': 0.0, 'wait_max': 0.0, 'lanes_max': 0, 'in_flight_max': 0
+        }
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        if self.waiting >= self.max_waiting:
+            return self._shed('shed_queue_full', event, user)
+
+        lane = None
+        if user is not None:
+            lane = self._lanes.get(user.id)
+            if lane is None:
+                lane = self._lanes[user.id] = Lane()
+                self.metrics['lanes_max'] = max(self.metrics['lanes_max'], len(self._lanes))
+            elif lane.size >= self.lane_max:
+                return self._shed('shed_lane_full', event, user)
+            lane.size += 1
+
+        started = time.perf_counter()
+        admitted = False
+        self.waiting += 1
+        try:
+            # Сначала очередь пользователя, потом общий слот: ожидающие
+            # обновления одного пользователя не занимают слоты других
+            if lane is not None:
+                await lane.lock.acquire()
+            try:
+                async with self._slots:
+                    admitted = True
+                    self._admit(time.perf_counter() - started)
+                    try:
+                        return await handler(event, data)
+                    finally:
+                        self.in_flight -= 1
+                        self.metrics['processed'] += 1
+            finally:
+                if lane is not None:
+                    lane.lock.release()
+        finally:
+            if not admitted:
+                # Отменено во время ожидания
+                self.waiting -= 1
+            if lane is not None:
+                lane.size -= 1
+                if lane.size == 0:
+                    del self._lanes[user.id]
+
+    def _admit(self, waited: float):
+        self.waiting -= 1
+        self.in_flight += 1
+        self.metrics['wait_total'] += waited
+        self.metrics['wait_max'] = max(self.metrics['wait_max'], waited)
+        self.metrics['in_flight_max'] = max(self.metrics['in_flight_max'], self.in_flight)
+
+    def _shed(self, reason: str, event: TelegramObject, user) -> None:
+        self.metrics[reason] += 1
+        logger.warning(
+            f"Update {getattr(event, 'update_id', None)} from {user.id if user else None} shed: {reason}"
+        )
+        return None
+
+    def get_metrics(self) -> Dict:
+        """Очереди пользователей, ожидание слота и отброшенные обновления"""
+        processed = self.metrics['processed']
+        return {
+            'lanes': len(self._lanes),
+            'lanes_max': self.metrics['lanes_max'],
+            'in_flight': self.in_flight,
+            'in_flight_max': self.metrics['in_flight_max'],
+            'waiting': self.waiting,
+            'processed': processed,
+            'shed_queue_full': self.metrics['shed_queue_full'],
+            'shed_lane_full': self.metrics['shed_lane_full'],
+            'wait_avg_ms': round(self.metrics['wait_total'] * 1000 / processed, 3) if processed else 0.0,
+            'wait_max_ms': round(self.metrics['wait_max'] * 1000, 3),
+        }
@@ -0,0 +1,96 @@
+"""Контекст пользователя для обработчиков: профиль и книги одним запросом на обновление"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.types import TelegramObject
+
+from database import Database
+from db_pool import track_checkouts
+from models import Book, User
+
+_NOT_LOADED = object()
+
+
+class UserContext:
+    """Профиль, активные книги и состояние FSM пользователя в пределах одного обновления"""
+
+    def __init__(self, db: Database, user_id: int, state: Optional[FSMContext] = None):
+        self.db = db
+        self.user_id = user_id
+        self.state = state
+        self.user: Optional[User] = None
+        self.books: List[Book] = []
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._fsm_state = _NOT_LOADED
+
+    async def load(self) -> 'UserContext':
+        """Загрузить профиль и книги (один запрос за обновление)"""
+        if not self._loaded:
+            async with self._lock:
+                if not self._loaded:
+                    context = await self.db.get_user_context(self.user_id)
+                    self.user, self.books = context['user'], context['books']
+                    self._loaded = True
+        return self
+
+    def invalidate(self):
+        """Забыть загруженные данные (после изменений в том же обновлении)"""
+        self._loaded = False
+        self._fsm_state = _NOT_LOADED
+
+    def book(self, book_type: str) -> Optional[Book]:
+        """Последняя активная книга данного типа"""
+        return next((book for book in self.books if book.book_type == book_type), None)
+
+    @property
+    def helper_counts(self) -> Dict[str, int]:
+        """Подтверждённые действия пользователя по типам книг (как get_user_confirmed_actions_by_type)"""
+        paid = self.user.confirmed_paid_actions if self.user else 0
+        free = self.user.confirmed_free_actions if self.user else 0
+        return {'paid': paid, 'free': free, 'total': paid + free}
+
+    @property
+    def notify_mode(self) -> str:
+        return self.user.notify_mode if self.user else 'instant'
+
+    async def fsm_state(self) -> Optional[str]:
+        """Текущее состояние FSM (читается из хранилища один раз)"""
+        if self._fsm_state is _NOT_LOADED:
+            self._fsm_state = await self.state.get_state() if self.state else None
+        return self._fsm_state
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Inner middleware для message и callback_query: аргумент user_context и счётчики запросов"""
+
+    def __init__(self, db: Database):
+        self.db = db
+        # Имя обработчика -> вызовы и выданные соединения
+        self.metrics: Dict[str, Dict[str, int]] = {}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        if user is not None:
+            data['user_context'] = UserContext(self.db, user.id, data.get('state'))
+        with track_checkouts() as counter:
+            try:
+                return await handler(event, data)
+            finally:
+                self._record(data.get('handler'), counter)
+
+    def _record(self, handler_object, counter: Dict[str, int]):
+        callback = getattr(handler_object, 'callback', None)
+        name = f"{callback.__module__}.{callback.__name__}" if callback else 'unknown'
+        stats = self.metrics.setdefault(name, {'calls': 0, 'reader': 0, 'writer': 0, 'max': 0})
+        stats['calls'] += 1
+        stats['reader'] += counter['reader']
+        stats['writer'] += counter['writer']
+        stats['max'] = max(stats['max'], counter['reader'] + counter['writer'])
+
+    def get_metrics(self) -> Dict:
+        """Для каждого обработчика: вызовы, выданные соединения (reader, writer) и максимум за вызов"""
+        return {name: dict(stats) for name, stats in self.metrics.items()}
@@ -0,0 +1,62 @@
+"""Отслеживание смены username пользователей по входящим обновлениям"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import config
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class UsernameTracker(BaseMiddleware):
+    """Outer middleware для dp.update с фоновой записью изменений username"""
+
+    def __init__(self, db: Database, flush_interval: float = config.USERNAME_FLUSH_INTERVAL_SECONDS):
+        self.db = db
+        self.flush_interval = flush_interval
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {'flushes': 0, 'updated': 0}
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        if user is not None and not user.is_bot:
+            self.db.note_username(user.id, user.username)
+        return await handler(event, data)
+
+    async def start(self, **kwargs):
+        """Запустить фоновую запись (обработчик dp.startup)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self, **kwargs):
+        """Остановить фоновую запись и записать оставшиеся изменения (обработчик dp.shutdown)"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        updated = await self.db.flush_usernames()
+        self.metrics['flushes'] += 1
+        self.metrics['updated'] += updated
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Error writing usernames: {e}")
+
+    def get_metrics(self) -> Dict:
+        """Число фоновых записей и обновлённых username"""
+        return dict(self.metrics)
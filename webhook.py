@@ -0,0 +1,178 @@
+"""
+Режим вебхука: aiohttp-сервер вместо long polling
+
+Telegram получает ответ 200 сразу после проверки секретного токена и
+постановки обновления в очередь, а обработку выполняет пул воркеров
+фиксированного размера. Эндпоинт /healthz отдаёт состояние очереди.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Any, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HANDLER = web.AppKey('webhook_handler', SimpleRequestHandler)
+# Допустимый секретный токен вебхука (ограничение Bot API)
+SECRET_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,256}')
+
+
+def check_webhook_config():
+    """Проверить настройки вебхука до запуска бота.
+
+    Секрет задаётся явно: сгенерированный при запуске секрет не совпал бы
+    у нескольких процессов и после перезапуска до повторного set_webhook.
+    """
+    if not config.WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+    if not SECRET_TOKEN_PATTERN.fullmatch(config.WEBHOOK_SECRET):
+        raise RuntimeError("WEBHOOK_SECRET must be set when BOT_MODE=webhook "
+                           "(1-256 characters: A-Z, a-z, 0-9, _ and -)")
+
+
+class WorkerPoolRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука с ограниченным числом одновременно обрабатываемых обновлений"""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: Optional[str],
+                 workers: int = config.WEBHOOK_WORKERS, queue_size: int = config.WEBHOOK_QUEUE_MAX,
+                 **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.workers_count = max(1, workers)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._workers = []
+        self.metrics = {
+            'received': 0, 'processed': 0, 'failed': 0, 'rejected': 0, 'unauthorized': 0,
+            'latency_total': 0.0, 'latency_max': 0.0
+        }
+
+    async def start(self):
+        """Запустить воркеры (повторный вызов ничего не делает)"""
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers_count)]
+
+    async def close(self, timeout: float = 10):
+        """Дообработать очередь и остановить воркеры.
+
+        Сессию бота закрывает main после отправки оставшихся сообщений.
+        """
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Webhook queue not drained, {self.queue.qsize()} update(s) dropped")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def verify_secret(self, telegram_secret_token: str, bot: Bot) -> bool:
+        verified = super().verify_secret(telegram_secret_token, bot)
+        if not verified:
+            self.metrics['unauthorized'] += 1
+        return verified
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        try:
+            self.queue.put_nowait((bot, update, time.perf_counter()))
+        except asyncio.QueueFull:
+            # Telegram повторит доставку позже
+            self.metrics['rejected'] += 1
+            return web.Response(status=503, text="Busy")
+        self.metrics['received'] += 1
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _worker(self):
+        while True:
+            bot, update, received_at = await self.queue.get()
+            try:
+                await self._background_feed_update(bot, update)
+                self.metrics['processed'] += 1
+            except Exception as e:
+                self.metrics['failed'] += 1
+                logger.error(f"Error processing webhook update {update.get('update_id')}: {e}")
+            finally:
+                latency = time.perf_counter() - received_at
+                self.metrics['latency_total'] += latency
+                if latency > self.metrics['latency_max']:
+                    self.metrics['latency_max'] = latency
+                self.queue.task_done()
+
+    def get_metrics(self) -> Dict:
+        """Очередь обновлений и время от получения до конца обработки"""
+        done = self.metrics['processed'] + self.metrics['failed']
+        return {
+            'queue_depth': self.queue.qsize(),
+            'workers': len(self._workers),
+            'received': self.metrics['received'],
+            'processed': self.metrics['processed'],
+            'failed': self.metrics['failed'],
+            'rejected': self.metrics['rejected'],
+            'unauthorized': self.metrics['unauthorized'],
+            'latency_avg_ms': round(self.metrics['latency_total'] * 1000 / done, 3) if done else 0.0,
+            'latency_max_ms': round(self.metrics['latency_max'] * 1000, 3),
+        }
+
+
+def create_app(dp: Dispatcher, bot: Bot, secret_token: Optional[str],
+               workers: int = config.WEBHOOK_WORKERS,
+               queue_size: int = config.WEBHOOK_QUEUE_MAX) -> web.Application:
+    """aiohttp-приложение с вебхуком по WEBHOOK_PATH и проверкой /healthz"""
+    app = web.Application()
+    handler = WorkerPoolRequestHandler(dp, bot, secret_token, workers=workers, queue_size=queue_size)
+    handler.register(app, path=config.WEBHOOK_PATH)
+    app[WEBHOOK_HANDLER] = handler
+
+    async def healthz(request: web.Request) -> web.Response:
+        health = {'status': 'ok', **handler.get_metrics()}
+        update_scheduler = dp.workflow_data.get('update_scheduler')
+        if update_scheduler:
+            health['update_scheduler'] = update_scheduler.get_metrics()
+        return web.json_response(health)
+
+    async def start_workers(app: web.Application):
+        await handler.start()
+
+    app.router.add_get('/healthz', healthz)
+    app.on_startup.append(start_workers)
+    # startup/shutdown диспетчера (в том числе закрытие хранилища FSM), как при polling
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """Зарегистрировать вебхук в Telegram и обслуживать его до отмены.
+
+    При остановке вебхук удаляется: Telegram хранит новые обновления до
+    следующей регистрации вебхука или запуска polling.
+    """
+    app = create_app(dp, bot, config.WEBHOOK_SECRET)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.WEBHOOK_HOST, config.WEBHOOK_PORT)
+    await site.start()
+    logger.info(f"Webhook server listening on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}")
+
+    await bot.set_webhook(
+        url=config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+        secret_token=config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    try:
+        await asyncio.Event().wait()
+    finally:
+        try:
+            await bot.delete_webhook()
+            logger.info("Webhook deleted")
+        except Exception as e:
+            logger.warning(f"Could not delete webhook: {e}")
+        logger.info(f"Webhook metrics: {app[WEBHOOK_HANDLER].get_metrics()}")
+        await runner.cleanup()